@@ -1,11 +1,11 @@
 import os.path
 
 import click
-from sbs.file_manager import *
 from sbs.config import *
-from sbs.navigator import Navigator
-from sbs.colors import *
-from sbs.menu import *
+from sbs.values import DEFAULT_JOBS
+
+# Drive, encryption and progress bars are only imported by the commands which need them, so that starting sbs stays
+# quick
 
 @click.group()
 @click.option("--config", "-c", default=get_data_dir() / "config/config.json", help="Path to config file")
@@ -28,35 +28,36 @@ def cli(context, config, verbose):
 @click.option("--unique/--not-unique", default=False, help="Whethxer it is first backup (helps time-wise)")
 @click.option("--limit", default=-1, help="Limit in bytes to backup size")
 @click.option("--debug / --not-debug", default=False, help="Whether or not to debug (choose backup).")
-
+@click.option("--jobs", "-j", default=DEFAULT_JOBS, help="Number of files to upload concurrently to start with")
+@click.option("--resume", is_flag=True, default=False, help="Carry on with the last backup if it was interrupted")
 @click.pass_context
-def backup(context, do: bool, unique: bool, limit: int, debug: bool):
+def backup(context, do: bool, unique: bool, limit: int, debug: bool, jobs: int, resume: bool):
     """
     Creates backup
     """
+    from sbs.file_manager import FileManager
+    from sbs.menu import menu
     config: Config = context.obj["config"]
     parent_id = config.parent_id
     fm: FileManager = FileManager(config=config, key_file=config.key)
     if debug:
         options = []
         chosen_backups = []
-        for backup in fm.list_backups()[:10]:
-            try:
-                options.append( f"{str(backup)}; {backup.get_full_backup_size()} bytes")
+        backups = fm.list_backups()[:10]
+        fm.load_stats(backups)
+        for backup in backups:
+            if backup.get_cached_stats() is not None:
+                options.append(f"{str(backup)}; {backup.get_full_backup_size()} bytes")
                 chosen_backups.append(backup)
-
-
-            except:
-                pass
         bu=chosen_backups[menu(options, default=0)]
     else:
         bu=None
     if limit < 0:
         fm.backup(config.backup_path, do=do, limit=None, unique=unique, exclude_list=config.exclude,
-                  config=config, previous_backup=bu)
+                  config=config, previous_backup=bu, jobs=jobs, resume=resume)
     else:
         fm.backup(config.backup_path, do=do, limit=limit, unique=unique, exclude_list=config.exclude,
-                  config=config, previous_backup=bu)
+                  config=config, previous_backup=bu, jobs=jobs, resume=resume)
     if not parent_id:
         config.dump(context.obj["cfg_path"])
 
@@ -72,23 +73,19 @@ def generate_config():
 @cli.command()
 @click.option("--restore-path", "-p", help="Path for restoration of files")
 @click.option("--debug / --normal", help="Whether or not to choose backup to restore (for debugging).")
+@click.option("--jobs", "-j", default=DEFAULT_JOBS, help="Number of files to download concurrently to start with")
 @click.pass_context
-def restore(context, restore_path, debug: bool):
+def restore(context, restore_path, debug: bool, jobs: int):
     """
     Restores files to restore path
     """
+    from sbs.navigator import Navigator
     config: Config = context.obj["config"]
 
     if restore_path is None:
         restore_path = config.restore
-    navigator = Navigator(config.key, config)
-    backups = navigator.fm.list_backups()
-
-    bu = None
-    for back_up in backups:
-        if back_up.get_files_list():
-            bu = back_up
-            break
+    navigator = Navigator(config.key, config, jobs=jobs)
+    bu = navigator.fm.find_latest_backup()
     navigator.navigate(bu, restoration_path=restore_path)
 
 
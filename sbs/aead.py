@@ -0,0 +1,132 @@
+import struct
+from functools import lru_cache
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Hash import SHA256
+from Cryptodome.Protocol.KDF import HKDF
+
+# Objects are sealed in segments, each encrypted and authenticated with AES-GCM on its own, after a header:
+#   magic | format | segment size | salt
+# The key of an object is derived from the master key and the salt, and the nonce of a segment is its index and
+# whether it is the last one, so segments may be sealed and opened in any order, a range of them may be opened
+# alone, and reordering, truncating or extending an object fails authentication. The header is authenticated with
+# every segment. Objects without the header are legacy alpha2.0 objects: IV followed by an AES-CBC cipher.
+MAGIC = b"SBS"
+FORMAT_AEAD = 1
+HEADER = struct.Struct(">3sBI16s")
+NONCE = struct.Struct(">7xIB")
+SALT_SIZE = 16
+TAG_SIZE = 16
+# Bounds on the segment size of a header, so that the first bytes of a legacy object are very unlikely to pass for
+# one
+MIN_SEGMENT_SIZE = 4096
+MAX_SEGMENT_SIZE = 1 << 24
+
+
+class IntegrityError(Exception):
+    """
+    Raised when downloaded data does not match what was backed up
+    """
+
+
+def make_header(segment_size: int, salt: bytes) -> bytes:
+    return HEADER.pack(MAGIC, FORMAT_AEAD, segment_size, salt)
+
+
+def parse_header(data) -> tuple:
+    """
+    @param data: First bytes of an object
+    @return: (segment size, salt) if data starts with a header, else None
+    """
+    if len(data) < HEADER.size:
+        return None
+    magic, version, segment_size, salt = HEADER.unpack(bytes(data[:HEADER.size]))
+    if magic != MAGIC or version != FORMAT_AEAD or \
+            not MIN_SEGMENT_SIZE <= segment_size <= MAX_SEGMENT_SIZE or segment_size % 16:
+        return None
+    return segment_size, salt
+
+
+def segment_count(length: int, segment_size: int) -> int:
+    """
+    @return: Number of segments of plain data of a given length, an empty object has one empty segment
+    """
+    return max(1, -(-length // segment_size))
+
+
+def sealed_size(length: int, segment_size: int) -> int:
+    """
+    @return: Size of the object sealing plain data of a given length, header included
+    """
+    return HEADER.size + length + TAG_SIZE * segment_count(length, segment_size)
+
+
+@lru_cache(maxsize=64)
+def derive_key(key: bytes, salt: bytes) -> bytes:
+    return HKDF(key, 32, salt, SHA256, context=b"sbs segment key")
+
+
+def segment_cipher(key: bytes, header: bytes, salt: bytes, index: int, final: bool):
+    aes = AES.new(derive_key(key, salt), AES.MODE_GCM, nonce=NONCE.pack(index, final), mac_len=TAG_SIZE)
+    aes.update(header)
+    return aes
+
+
+def seal_segments(key: bytes, header: bytes, index: int, data, final: bool) -> bytearray:
+    """
+    Seals consecutive segments of an object
+    @param key: Master key
+    @param header: Header of object
+    @param index: Index of first segment
+    @param data: Plain data of segments, a whole number of segments unless final
+    @param final: Whether the last segment is the last of the object
+    @return: Ciphers of segments, each followed by its tag
+    """
+    segment_size, salt = parse_header(header)
+    data = memoryview(data)
+    out = bytearray(len(data) + TAG_SIZE * segment_count(len(data), segment_size))
+    view = memoryview(out)
+    position = 0
+    for i, start in enumerate(range(0, max(len(data), 1), segment_size)):
+        segment = data[start:start + segment_size]
+        aes = segment_cipher(key, header, salt, index + i, final and start + segment_size >= len(data))
+        # Encrypted straight into the output, without copies
+        aes.encrypt(segment, output=view[position:position + len(segment)])
+        position += len(segment)
+        view[position:position + TAG_SIZE] = aes.digest()
+        position += TAG_SIZE
+    return out
+
+
+def open_segments(key: bytes, header: bytes, index: int, data, final: bool) -> bytearray:
+    """
+    Opens consecutive segments of an object, see seal_segments
+    @param data: Ciphers of segments, each followed by its tag
+    @return: Plain data of segments
+    @raise IntegrityError: if a segment fails authentication
+    """
+    segment_size, salt = parse_header(header)
+    stride = segment_size + TAG_SIZE
+    if not len(data):
+        if final:
+            raise IntegrityError("Cipher is truncated")
+        return bytearray()
+    data = memoryview(data)
+    segments = segment_count(len(data), stride)
+    if len(data) - TAG_SIZE * segments < 0:
+        raise IntegrityError("Cipher is truncated")
+    out = bytearray(len(data) - TAG_SIZE * segments)
+    view = memoryview(out)
+    position = 0
+    for i, start in enumerate(range(0, len(data), stride)):
+        segment = data[start:start + stride]
+        if len(segment) < TAG_SIZE:
+            raise IntegrityError("Cipher is truncated")
+        aes = segment_cipher(key, header, salt, index + i, final and start + stride >= len(data))
+        aes.decrypt(segment[:-TAG_SIZE], output=view[position:position + len(segment) - TAG_SIZE])
+        position += len(segment) - TAG_SIZE
+        try:
+            aes.verify(segment[-TAG_SIZE:])
+        except ValueError:
+            raise IntegrityError("Segment {} failed authentication".format(index + i))
+    return out
@@ -2,21 +2,69 @@ from sbs.stoof import Cryptologor
 import json
 from time import ctime
 from io import BytesIO
-from googleapiclient.http import MediaIoBaseDownload
 from tqdm import tqdm
+from sbs.manifest import decode_manifest, read_header, aggregates
+from sbs.catalog import BackupCatalog
+from sbs.storage import Storage
 from sbs.values import *
 
 
+# Names of the final manifest of a backup, binary or, for backups made before it, JSON
+MANIFEST_NAMES = ("backup_{}.manifest".format(VERSION_CODE), "backup_{}.json".format(VERSION_CODE))
+
+
+class MissingParentError(Exception):
+    """
+    Raised when the parent backup a delta manifest was written against is gone, so its files cannot be known
+    """
+
+
+def same_file(a: map, b: map) -> bool:
+    """
+    Whether two file maps point to the same uploaded data
+    """
+    return a.get("digest") == b.get("digest") and a.get("digest_algorithm") == b.get("digest_algorithm") and \
+        a.get("pieces") == b.get("pieces") and a.get("total_size") == b.get("total_size")
+
+
+def make_delta(files: list, parent_map: map):
+    """
+    Compares files of a backup with those of its parent backup
+    @param files: List of file maps of backup
+    @param parent_map: Map of source to file map of parent backup
+    @return: List of file maps which are new or changed, list of sources which were deleted
+    """
+    changed = [file for file in files
+               if file.get("source") not in parent_map or not same_file(file, parent_map[file.get("source")])]
+    sources = {file.get("source") for file in files}
+    deleted = [source for source in parent_map if source not in sources]
+    return changed, deleted
+
+
 class Backup:
-    def __init__(self, service, file: map, config, c: Cryptologor = None):
+    def __init__(self, storage: Storage, file: map, config, c: Cryptologor = None, cache=None,
+                 catalog: BackupCatalog = None):
+        """
+        Backup stored in a folder of a storage
+        @param storage: Storage
+        @param file: Map with id and name of backup folder
+        @param config: Config
+        @param c: Cryptologor
+        @param cache: ManifestCache to keep manifest in (optional)
+        @param catalog: BackupCatalog to find the decrypted name and stats of backup in and keep them in (optional)
+        """
 
         if c is None:
             self.c = Cryptologor()
         else:
             self.c = c
         self.id = file['id']
-        self.service = service
-        json_map = json.JSONDecoder().decode(c.decrypt_name(file.get('name')))
+        self.storage = storage
+        json_map = catalog.info(file) if catalog is not None else None
+        if json_map is None:
+            json_map = json.JSONDecoder().decode(c.decrypt_name(file.get('name')))
+            if catalog is not None:
+                catalog.add(config.parent_id, file, json_map)
         self.source = json_map.get("dir")
         self.time = json_map.get("time")
         self.files_list = None
@@ -24,38 +72,176 @@ class Backup:
         self.pointer = 0
         self.total_size = None
         self.files_map = None
+        self.cache = cache
+        self.catalog = catalog
+        self.config = config
+        # Number of delta manifests between this one and a full one
+        self.depth = None
+        # Ids of the backups whose manifests make up the files of this one, this one first and the one with a full
+        # manifest last
+        self.chain = None
+        self.stats = None
+        # Decrypted names of objects in the backup folder to their ids, listed once
+        self.names = None
 
     def __repr__(self):
         return "<Backup of {} uploaded {}>".format(self.source, ctime(self.time))
 
 
 
+    def download_manifest(self):
+        """
+        Downloads manifest of backup, binary or, for backups made before it, JSON. A backup which was interrupted
+        only has the checkpoint manifest of its session until it is resumed and finished, and is taken as having none,
+        so that it is neither restored nor written a delta against.
+        @return: Encrypted manifest, or None if backup has none
+        """
+        for name in MANIFEST_NAMES:
+            data = self.download_named(name)
+            if data is not None:
+                return data
+        return None
+
+    def has_manifest(self) -> bool:
+        """
+        Whether the backup was finished, told without downloading its manifest: by the catalog if its stats were
+        read before, else by the objects of its folder
+        """
+        if self.files_map is not None or self.get_cached_stats() is not None:
+            return True
+        if self.names is None:
+            self.set_children(self.storage.list(self.id))
+        return any(name in self.names for name in MANIFEST_NAMES)
+
+    def get_manifest_data(self):
+        """
+        @return: Decrypted manifest, from the cache if it is there, or None if backup has none
+        """
+        data = self.cache.get(self.id) if self.cache is not None else None
+        if data is None:
+            data = self.download_manifest()
+            if data is not None and self.cache is not None:
+                self.cache.put(self.id, data)
+        return self.c.decrypt(data) if data is not None else None
+
+    def get_stats(self):
+        """
+        Stats of backup, see manifest.aggregates, read from the header of the manifest so that the files need not
+        be decoded, or from the catalog if they were read before
+        @return: Map with count, total_size and dirs
+        """
+        if self.get_cached_stats() is None:
+            data = self.get_manifest_data()
+            header = read_header(data) if data is not None else None
+            if header is not None and header.get("stats") is not None:
+                self.stats = header.get("stats")
+            else:
+                # Manifest from before stats were kept
+                self.stats = aggregates((self.get_files_list() or {}).values())
+            if data is not None and self.catalog is not None:
+                self.catalog.set_stats(self.id, self.stats)
+        return self.stats
+
+    def get_cached_stats(self):
+        """
+        @return: Stats of backup if they are known without downloading its manifest, else None
+        """
+        if self.stats is None and self.catalog is not None:
+            self.stats = self.catalog.stats(self.id)
+        return self.stats
+
+    def set_children(self, files: list):
+        """
+        Gives the backup the objects of its folder, when they were listed along with those of other backups
+        @param files: List of maps with id and name, see Storage.list
+        """
+        self.names = {}
+        for file in files:
+            self.names[self.c.decrypt_name(file.get("name"))] = file.get("id")
+
+    def set_files_list(self, files_map: map, chain: list):
+        """
+        Gives the backup its files when they are known without its manifest, e.g. from the stat index
+        @param files_map: Map of source to file map
+        @param chain: Chain of manifest, see get_files_list
+        """
+        self.files_map = files_map
+        self.chain = chain
+        self.depth = len(chain) - 1
+
+    def download_named(self, name: str):
+        """
+        Downloads an object the application finds by name in the backup folder
+        @param name: Name, as before encryption
+        @return: Encrypted data, or None if backup has no such object
+        """
+        if self.names is None:
+            self.set_children(self.storage.list(self.id))
+        if name not in self.names:
+            return None
+        fh = BytesIO()
+        bar = tqdm(unit="B", unit_scale=True, dynamic_ncols=True)
+        try:
+            self.storage.get(self.names[name], fh, bar=bar)
+        finally:
+            bar.close()
+        return fh.getvalue()
+
+    def get_shard_root(self):
+        """
+        Piece of the shard of the root directory, for backups whose manifest is also written as shards (see
+        FileManager.upload_shards)
+        @return: Piece map, or None if the backup has no shards
+        """
+        key = self.id + ".index"
+        data = self.cache.get(key) if self.cache is not None else None
+        if data is None:
+            data = self.download_named("index_{}.json".format(VERSION_CODE))
+            if data is None:
+                return None
+            if self.cache is not None:
+                self.cache.put(key, data)
+        return json.loads(self.c.decrypt(data).decode("UTF-8")).get("root")
+
     def get_files_list(self):
 
         if self.files_map is None:
-            files = self.service.files().list(spaces="appDataFolder", q="'{}' in parents".format(self.id)).execute()[
-                'files']
-            for file in files:
-                if self.c.decrypt_name(file.get("name")) == "backup_{}.json".format(VERSION_CODE):
-                    request = self.service.files().get_media(fileId=file.get('id'))
-                    fh = BytesIO()
-                    downloader = MediaIoBaseDownload(fh, request, chunksize=CHUNK_SIZE)
-                    done = False
-                    bar = tqdm(total=1)
-                    total = 0
-                    while done is False:
-                        status, done = downloader.next_chunk()
-                        progress = status.progress()
-                        bar.update(progress - total)
-                        total = progress
-                    bar.update(1 - total)
-                    bar.close()
-                    fh.seek(0)
-                    json_data = self.c.decrypt(fh.read()).decode("UTF-8")
-                    data = json.JSONDecoder().decode(json_data)
+            data = self.get_manifest_data()
+            if data is not None:
+                data = decode_manifest(data)
+                if data.get("parent"):
+                    # Delta manifest, holding only what changed since its parent
+                    try:
+                        parent = self.get_backup(data.get("parent"))
+                        parent_files = parent.get_files_list()
+                    except FileNotFoundError:
+                        parent_files = None
+                    if parent_files is None:
+                        raise MissingParentError("Parent backup {} of backup {} is missing, the manifest of the backup "
+                                                 "only holds what changed since".format(data.get("parent"), self.id))
+                    files_map = dict(parent_files)
+                    for source in data.get("deleted", []):
+                        files_map.pop(source, None)
+                    files_map.update((file.get("source"), file) for file in data.get("files"))
+                    self.files_map = files_map
+                    self.chain = [self.id] + parent.chain
+                else:
                     self.files_map = {file.get("source"): file for file in data.get("files")}
+                    self.chain = [self.id]
+                self.depth = data.get("depth", 0)
         return self.files_map
 
+    def get_backup(self, backup_id: str):
+        """
+        Backup of the same parent folder, by id
+        @param backup_id: google drive id of backup folder
+        @return: Backup
+        """
+        file = self.catalog.file(backup_id) if self.catalog is not None else None
+        if file is None:
+            file = self.storage.find(self.config.parent_id, backup_id)
+        return Backup(self.storage, file, self.config, c=self.c, cache=self.cache, catalog=self.catalog)
+
     def find_file_by_path(self, path: str):
         self.get_files_list()
         # by_path = bin_search(self.get_files_list(), path)
@@ -72,13 +258,6 @@ class Backup:
             return self.files_list_by_digest
 
     def get_full_backup_size(self):
-        if self.total_size:
-            return self.total_size
-        else:
-            self.total_size = 0
-            for file in self.get_files_list():
-                for piece in file.get("pieces"):
-                    self.total_size += piece.get("size")
+        if self.total_size is None:
+            self.total_size = self.get_stats().get("total_size")
         return self.total_size
-
-
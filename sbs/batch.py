@@ -0,0 +1,59 @@
+import time
+
+from sbs.retry import RetryPolicy, Retrier
+from sbs.values import BATCH_SIZE
+
+
+def execute_batch(service, requests: list, policy: RetryPolicy = None, batch_size: int = BATCH_SIZE, log=None,
+                  return_exceptions: bool = False) -> list:
+    """
+    Executes Drive API requests in batches, up to batch_size requests per round trip. Drive answers each request of a
+    batch on its own, so each is retried on its own under the policy: those which failed and may succeed later are
+    sent again together in the next batch, after the longest wait any of them asks for. A batch which fails as a
+    whole is retried as a whole. Media requests cannot be batched.
+    @param service: Drive service
+    @param requests: List of HttpRequest
+    @param policy: RetryPolicy of each request
+    @param batch_size: Most requests per batch, Drive takes up to 100
+    @param log: Function given a message on each retry
+    @param return_exceptions: Whether a request which failed for good has its error in the results, rather than
+                              raised once the batch it is in is done
+    @return: List of responses, in the order of requests
+    """
+    results = [None] * len(requests)
+    retriers = [Retrier(policy, log=log) for _ in requests]
+    batch_retrier = Retrier(policy, log=log)
+    pending = list(range(len(requests)))
+    while pending:
+        retry = []
+        delay = 0
+        for start in range(0, len(pending), batch_size):
+            errors = {}
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    results[int(request_id)] = response
+                else:
+                    errors[int(request_id)] = exception
+
+            def send(indices: list):
+                errors.clear()
+                batch = service.new_batch_http_request(callback=on_response)
+                for i in indices:
+                    batch.add(requests[i], request_id=str(i))
+                batch.execute()
+
+            batch_retrier.call(send, pending[start:start + batch_size])
+            for i, e in errors.items():
+                try:
+                    delay = max(delay, retriers[i].next_delay(e))
+                except Exception:
+                    if not return_exceptions:
+                        raise
+                    results[i] = e
+                else:
+                    retry.append(i)
+        if retry:
+            time.sleep(delay)
+        pending = retry
+    return results
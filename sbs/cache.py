@@ -0,0 +1,89 @@
+import hashlib
+import os
+import uuid
+
+DIGEST_SIZE = 32
+
+
+class ManifestCache:
+    def __init__(self, directory, max_size: int):
+        """
+        On disk cache of backup manifests, as encrypted on Drive, keyed by the id of the backup folder. Backups never
+        change once written, so a cached manifest never goes stale. Each file starts with the SHA-256 of the rest,
+        and a file which does not match is dropped. The least recently used manifests are evicted once the cache
+        outgrows max_size bytes.
+        @param directory: Directory of cache
+        @param max_size: Size of cache in bytes
+        """
+        self.directory = str(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, backup_id: str) -> str:
+        return os.path.join(self.directory, backup_id)
+
+    def get(self, backup_id: str):
+        """
+        @param backup_id: google drive id of backup folder
+        @return: Encrypted manifest, or None if it is not cached or damaged
+        """
+        path = self.path(backup_id)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if hashlib.sha256(data[DIGEST_SIZE:]).digest() != data[:DIGEST_SIZE]:
+            self.remove(backup_id)
+            return None
+        # Modification time is the last use, for eviction
+        os.utime(path)
+        return data[DIGEST_SIZE:]
+
+    def put(self, backup_id: str, data: bytes):
+        """
+        Caches manifest, then evicts until the cache fits
+        @param backup_id: google drive id of backup folder
+        @param data: Encrypted manifest
+        """
+        if len(data) + DIGEST_SIZE > self.max_size:
+            return
+        # Written aside and renamed, so that readers never see half a file
+        temporary_path = os.path.join(self.directory, ".{}.tmp".format(uuid.uuid4().hex))
+        try:
+            with open(temporary_path, "wb") as f:
+                f.write(hashlib.sha256(data).digest())
+                f.write(data)
+            os.replace(temporary_path, self.path(backup_id))
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.evict()
+
+    def remove(self, backup_id: str):
+        try:
+            os.remove(self.path(backup_id))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Removes least recently used manifests until the cache fits in max_size
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,87 @@
+import json
+import os
+import sqlite3
+from threading import Lock
+
+
+class BackupCatalog:
+    def __init__(self, db_path):
+        """
+        Local catalog of backup folders, keyed by their id, with the decrypted time and source of each and, once
+        known, its stats (see manifest.aggregates). Folder names are then decrypted once, and listing backups with
+        their sizes needs no manifest download. A backup never changes once its manifest is written, so entries never
+        go stale, and those of folders which are gone are pruned when the parent folder is listed.
+        @param db_path: Path of SQLite database
+        """
+        db_path = str(db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = Lock()
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS backups (
+                id TEXT PRIMARY KEY,
+                parent TEXT,
+                name TEXT,
+                time REAL,
+                source TEXT,
+                stats TEXT
+            )
+        """)
+
+    def info(self, file: map):
+        """
+        @param file: Map with id and name of backup folder
+        @return: Map with dir and time, as in the name of the folder, or None if the folder is not catalogued
+        """
+        with self.lock:
+            row = self.db.execute("SELECT time, source FROM backups WHERE id = ? AND name = ?",
+                                  (file.get("id"), file.get("name"))).fetchone()
+        return {"dir": row[1], "time": row[0]} if row is not None else None
+
+    def file(self, backup_id: str):
+        """
+        @param backup_id: Id of backup folder
+        @return: Map with id and name of backup folder, or None if it is not catalogued
+        """
+        with self.lock:
+            row = self.db.execute("SELECT name FROM backups WHERE id = ?", (backup_id,)).fetchone()
+        return {"id": backup_id, "name": row[0]} if row is not None else None
+
+    def add(self, parent: str, file: map, info: map):
+        """
+        Catalogs a backup folder
+        @param parent: Id of parent folder
+        @param file: Map with id and name of backup folder
+        @param info: Decrypted name of folder, map with dir and time
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO backups (id, parent, name, time, source) VALUES (?, ?, ?, ?, ?)",
+                            (file.get("id"), parent, file.get("name"), info.get("time"), info.get("dir")))
+            self.db.commit()
+
+    def stats(self, backup_id: str):
+        """
+        @param backup_id: Id of backup folder
+        @return: Stats of backup, or None if they are not known yet
+        """
+        with self.lock:
+            row = self.db.execute("SELECT stats FROM backups WHERE id = ?", (backup_id,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    def set_stats(self, backup_id: str, stats: map):
+        with self.lock:
+            self.db.execute("UPDATE backups SET stats = ? WHERE id = ?", (json.dumps(stats), backup_id))
+            self.db.commit()
+
+    def prune(self, parent: str, backup_ids):
+        """
+        Forgets the backups of a parent folder which are not in it anymore
+        @param parent: Id of parent folder
+        @param backup_ids: Ids of the backup folders in it
+        """
+        backup_ids = set(backup_ids)
+        with self.lock:
+            gone = [row[0] for row in self.db.execute("SELECT id FROM backups WHERE parent = ?", (parent,))
+                    if row[0] not in backup_ids]
+            self.db.executemany("DELETE FROM backups WHERE id = ?", ((backup_id,) for backup_id in gone))
+            self.db.commit()
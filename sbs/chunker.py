@@ -0,0 +1,72 @@
+import re
+import zlib
+
+from sbs.values import CDC_MIN_SIZE, CDC_AVERAGE_SIZE, CDC_MAX_SIZE
+
+WINDOW_SIZE = 32
+# Windows are only hashed where they end on one of these bytes, found by the regular expression engine, as hashing
+# every window in Python is far too slow. Zero and 0xff are left out, so that empty regions of disk images do not
+# make a candidate of every byte.
+CANDIDATE_BYTES = b"\n;\x8d\xc4"
+CANDIDATE_PROBABILITY = len(CANDIDATE_BYTES) / 256
+CANDIDATE_REGEX = re.compile(b"[" + re.escape(CANDIDATE_BYTES) + b"]")
+READ_SIZE = 8 * 1024 ** 2
+
+
+def boundary_mask(min_size: int, average_size: int) -> int:
+    """
+    Mask of the bits of a window hash which must all be zero at a boundary, such that chunks come out at about the
+    average size
+    """
+    candidates = (average_size - min_size) * CANDIDATE_PROBABILITY
+    bits = max(1, int(candidates).bit_length() - 1)
+    return (1 << bits) - 1
+
+
+def find_boundary(data, start: int, min_size: int, max_size: int, mask: int) -> int:
+    """
+    Finds the end of the chunk starting at start. A boundary is after a candidate byte whose window of the last
+    WINDOW_SIZE bytes hashes to a value with all bits of the mask zero. The first min_size bytes of the chunk are
+    skipped, as no boundary may be in them.
+    @param data: Data
+    @param start: Start of chunk
+    @param min_size: Minimal chunk size
+    @param max_size: Maximal chunk size
+    @param mask: Mask from boundary_mask
+    @return: End of chunk, at most len(data)
+    """
+    end = min(len(data), start + max_size)
+    for match in CANDIDATE_REGEX.finditer(data, start + min_size, end):
+        i = match.end()
+        if not zlib.crc32(data[i - WINDOW_SIZE:i]) & mask:
+            return i
+    return end
+
+
+def chunk_stream(f, min_size: int = CDC_MIN_SIZE, average_size: int = CDC_AVERAGE_SIZE,
+                 max_size: int = CDC_MAX_SIZE):
+    """
+    Generator of content defined chunks of a file. Boundaries depend on the content around them only, so data that
+    is shifted by an insertion earlier in the file still comes out in the same chunks.
+    @param f: File opened in binary mode
+    @return: Generator of bytes
+    """
+    mask = boundary_mask(min_size, average_size)
+    buffer = b""
+    eof = False
+    while True:
+        # Keep at least one maximal chunk in the buffer, so a boundary is never cut short by the end of a read
+        while not eof and len(buffer) < max_size:
+            data = f.read(READ_SIZE)
+            if data:
+                buffer += data
+            else:
+                eof = True
+        if not buffer:
+            return
+        start = 0
+        while len(buffer) - start >= max_size or (eof and start < len(buffer)):
+            end = find_boundary(buffer, start, min_size, max_size, mask)
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
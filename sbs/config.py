@@ -88,6 +88,23 @@ class Config:
             self.parent_id = EXAMPLE_PARENT_ID
             self.credentials_dir = EXAMPLE_CREDENTIALS_DIR
             self.log_dir = EXAMPLE_LOG_DIR
+            self.max_file_size = None
+            self.exclude_extensions = []
+            self.pack_threshold = None
+            self.pack_size = None
+            self.dedup_threshold = None
+            self.manifest_cache_size = None
+            self.checkpoint_interval = None
+            self.session_checkpoint_files = None
+            self.session_checkpoint_bytes = None
+            self.retry_max_attempts = None
+            self.retry_deadline = None
+            self.max_jobs = None
+            self.max_request_rate = None
+            self.crypto_processes = None
+            self.digest_algorithm = None
+            self.batch_size = None
+            self.storage_path = None
             self.version = VERSION
         else:
 
@@ -101,6 +118,23 @@ class Config:
             self.parent_id = m.get("parent_id")
 
             self.log_dir=m.get("log_dir")
+            self.max_file_size = m.get("max_file_size")
+            self.exclude_extensions = m.get("exclude_extensions", [])
+            self.pack_threshold = m.get("pack_threshold")
+            self.pack_size = m.get("pack_size")
+            self.dedup_threshold = m.get("dedup_threshold")
+            self.manifest_cache_size = m.get("manifest_cache_size")
+            self.checkpoint_interval = m.get("checkpoint_interval")
+            self.session_checkpoint_files = m.get("session_checkpoint_files")
+            self.session_checkpoint_bytes = m.get("session_checkpoint_bytes")
+            self.retry_max_attempts = m.get("retry_max_attempts")
+            self.retry_deadline = m.get("retry_deadline")
+            self.max_jobs = m.get("max_jobs")
+            self.max_request_rate = m.get("max_request_rate")
+            self.crypto_processes = m.get("crypto_processes")
+            self.digest_algorithm = m.get("digest_algorithm")
+            self.batch_size = m.get("batch_size")
+            self.storage_path = m.get("storage_path")
 
     def to_map(self):
         """
@@ -115,7 +149,24 @@ class Config:
             "key_path": str(self.key),
             "parent_id": self.parent_id,
             "log_dir":str(self.log_dir),
-            "credentials_dir":str(self.credentials_dir)
+            "credentials_dir":str(self.credentials_dir),
+            "max_file_size": self.max_file_size,
+            "exclude_extensions": self.exclude_extensions,
+            "pack_threshold": self.pack_threshold,
+            "pack_size": self.pack_size,
+            "dedup_threshold": self.dedup_threshold,
+            "manifest_cache_size": self.manifest_cache_size,
+            "checkpoint_interval": self.checkpoint_interval,
+            "session_checkpoint_files": self.session_checkpoint_files,
+            "session_checkpoint_bytes": self.session_checkpoint_bytes,
+            "retry_max_attempts": self.retry_max_attempts,
+            "retry_deadline": self.retry_deadline,
+            "max_jobs": self.max_jobs,
+            "max_request_rate": self.max_request_rate,
+            "crypto_processes": self.crypto_processes,
+            "digest_algorithm": self.digest_algorithm,
+            "batch_size": self.batch_size,
+            "storage_path": self.storage_path
         }
 
     def dump(self, path=None):
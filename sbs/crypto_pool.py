@@ -0,0 +1,178 @@
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Queue, Empty
+from threading import Lock
+
+from Cryptodome.Cipher import AES
+
+from sbs.aead import seal_segments, open_segments, parse_header, TAG_SIZE, MIN_SEGMENT_SIZE
+
+BLOCK_SIZE = 16
+
+# State of worker processes
+worker_key = None
+worker_blocks = {}
+
+
+def init_worker(key: bytes):
+    global worker_key
+    worker_key = key
+
+
+def attach(name: str) -> SharedMemory:
+    """
+    Attaches a block of shared memory created by the parent process, once per worker
+    """
+    block = worker_blocks.get(name)
+    if block is None:
+        # Only the parent, which created the block, may unlink it, so the worker must not have it tracked
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            block = SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+        worker_blocks[name] = block
+    return block
+
+
+def run_job(name: str, size: int, output: int, func, *args) -> int:
+    """
+    Runs a job of a CryptoPool in a worker process: func is given the key, the first size bytes of a block of shared
+    memory and args, and what it returns is written to the block from offset output
+    @return: Length of result
+    """
+    buf = attach(name).buf
+    result = func(worker_key, buf[:size], *args)
+    buf[output:output + len(result)] = result
+    return len(result)
+
+
+def seal_job(key: bytes, data, header: bytes, index: int, final: bool) -> bytes:
+    return seal_segments(key, header, index, data, final)
+
+
+def open_job(key: bytes, data, header: bytes, index: int, final: bool) -> bytes:
+    return open_segments(key, header, index, data, final)
+
+
+def decrypt_cbc_job(key: bytes, data, iv: bytes) -> bytes:
+    return AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+
+
+class CryptoPool:
+    def __init__(self, key: bytes, processes: int, part_size: int):
+        """
+        Process pool doing the encryption and decryption of threads of the parent process on all cores. Data is cut
+        into parts, worked on by as many workers at once as there are free blocks of shared memory: a thread copies
+        each part into a block rather than pickling it, a worker reads it and writes its result to the second half
+        of the block, and the thread copies the result out. Workers are started on first use. They are spawned, so
+        each imports the __main__ module of the program again, which must guard its entry point with
+        if __name__ == "__main__".
+        @param key: AES key
+        @param processes: Number of worker processes
+        @param part_size: Size of parts of plain data, a multiple of the AES block size
+        """
+        self.key = key
+        self.processes = processes
+        self.part_size = part_size - part_size % BLOCK_SIZE
+        # Room for a part with the tags of its segments
+        self.half = self.part_size + self.part_size // MIN_SEGMENT_SIZE * TAG_SIZE + TAG_SIZE
+        self.executor = None
+        self.lock = Lock()
+        self.blocks = []
+        # Free blocks, twice as many as workers so that copies in and out overlap the work of every worker
+        self.free = Queue()
+        self.closed = False
+
+    def start(self):
+        # Spawned rather than forked, forking a process with threads running may deadlock the children
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_worker, initargs=(self.key,))
+        for _ in range(2 * self.processes):
+            block = SharedMemory(create=True, size=2 * self.half)
+            self.blocks.append(block)
+            self.free.put(block)
+        atexit.register(self.close)
+
+    def run(self, jobs: list) -> bytes:
+        """
+        Runs jobs on the workers
+        @param jobs: List of (data, func, args), see run_job
+        @return: Concatenated results of jobs
+        """
+        with self.lock:
+            if self.executor is None:
+                self.start()
+        # Only the first block is waited for, so that threads never hold blocks while waiting for more
+        blocks = [self.free.get()]
+        while len(blocks) < len(jobs):
+            try:
+                blocks.append(self.free.get_nowait())
+            except Empty:
+                break
+        out = bytearray()
+        try:
+            for batch in range(0, len(jobs), len(blocks)):
+                futures = []
+                for block, (data, func, args) in zip(blocks, jobs[batch:batch + len(blocks)]):
+                    block.buf[:len(data)] = data
+                    futures.append(self.executor.submit(run_job, block.name, len(data), self.half, func, *args))
+                # Blocks are only reused once every worker is done with its own, even if one failed
+                wait(futures)
+                for block, future in zip(blocks, futures):
+                    out += block.buf[self.half:self.half + future.result()]
+        finally:
+            for block in blocks:
+                self.free.put(block)
+        return bytes(out)
+
+    def seal(self, header: bytes, index: int, data, final: bool) -> bytes:
+        """
+        Parallel seal_segments
+        """
+        segment_size = parse_header(header)[0]
+        part = max(1, self.part_size // segment_size) * segment_size
+        data = memoryview(data)
+        starts = range(0, max(len(data), 1), part)
+        return self.run([(data[start:start + part], seal_job,
+                          (header, index + start // segment_size, final and start + part >= len(data)))
+                         for start in starts])
+
+    def open(self, header: bytes, index: int, data, final: bool) -> bytes:
+        """
+        Parallel open_segments
+        """
+        segment_size = parse_header(header)[0]
+        segments = max(1, self.part_size // segment_size)
+        part = segments * (segment_size + TAG_SIZE)
+        data = memoryview(data)
+        return self.run([(data[start:start + part], open_job,
+                          (header, index + start // part * segments, final and start + part >= len(data)))
+                         for start in range(0, len(data), part)])
+
+    def decrypt_cbc(self, iv: bytes, data) -> bytes:
+        """
+        AES-CBC decryption, parallel as every block is chained from the cipher block before it
+        """
+        data = memoryview(data)
+        return self.run([(data[start:start + self.part_size], decrypt_cbc_job,
+                          (bytes(data[start - BLOCK_SIZE:start]) if start else iv,))
+                         for start in range(0, len(data), self.part_size)])
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        with self.lock:
+            if self.closed or self.executor is None:
+                return
+            self.closed = True
+        self.executor.shutdown(wait=True)
+        for block in self.blocks:
+            block.close()
+            block.unlink()
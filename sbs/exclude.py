@@ -0,0 +1,175 @@
+import os
+import re
+
+GLOB_CHARACTERS = "*?["
+# Marks the end of an excluded path in the trie
+END = object()
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a gitignore style glob to a regular expression. "*" and "?" do not match "/", "**" matches any number
+    of directories.
+    @param pattern: Glob
+    @return: Regular expression
+    """
+    i = 0
+    regex = ""
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex += "[" + body.replace("\\", "\\\\") + "]"
+                i = end + 1
+        else:
+            regex += re.escape(c)
+    return regex
+
+
+def compile_any(regexes: list):
+    """
+    Compiles regular expressions into one which fully matches any of them, or None if there are none
+    """
+    if not regexes:
+        return None
+    return re.compile("|".join("(?:{})".format(regex) for regex in regexes), re.DOTALL)
+
+
+class ExclusionRules:
+    def __init__(self, exclude_list: list, root: str, max_file_size: int = None, extensions: list = None):
+        """
+        Rules for excluding files from a backup, compiled once so that checking an entry costs about one step per
+        directory of its path, however many rules there are.
+
+        Entries of the exclude list are read as follows:
+        - An absolute path, or a path starting with "./", excludes that file or directory of the backup.
+        - A name without "/" excludes files and directories of that name at any depth, e.g. "node_modules".
+        - Other relative paths are relative to the root of the backup.
+        - "*", "?", "[...]" and "**" glob as in .gitignore, and a trailing "/" only matches directories.
+        @param exclude_list: List of paths and globs to exclude
+        @param root: Absolute path of backed up directory
+        @param max_file_size: Files larger than this many bytes are excluded
+        @param extensions: File extensions to exclude, e.g. [".iso", ".vmdk"]
+        """
+        self.root = root
+        self.max_file_size = max_file_size
+        self.extensions = {extension.lower() if extension.startswith(".") else "." + extension.lower()
+                           for extension in extensions or []}
+        self.path_trie = {}
+        self.dir_path_trie = {}
+        self.names = set()
+        self.dir_names = set()
+        name_globs, dir_name_globs, path_globs, dir_path_globs = [], [], [], []
+
+        for entry in exclude_list or []:
+            dir_only = entry.endswith("/") and entry.rstrip("/") != ""
+            entry = entry.rstrip("/") if dir_only else entry
+            is_glob = any(c in entry for c in GLOB_CHARACTERS)
+            if os.path.isabs(entry):
+                relative = os.path.relpath(entry, root)
+                if relative == ".." or relative.startswith(".." + os.path.sep):
+                    # Outside of the backup
+                    continue
+                entry = relative
+            elif entry.startswith("./"):
+                entry = entry[2:]
+            elif "/" not in entry:
+                if is_glob:
+                    (dir_name_globs if dir_only else name_globs).append(glob_to_regex(entry))
+                else:
+                    (self.dir_names if dir_only else self.names).add(entry)
+                continue
+            entry = os.path.normpath(entry).replace(os.path.sep, "/")
+            if is_glob:
+                (dir_path_globs if dir_only else path_globs).append(glob_to_regex(entry))
+            elif entry == ".":
+                continue
+            else:
+                node = self.dir_path_trie if dir_only else self.path_trie
+                for part in entry.split("/"):
+                    node = node.setdefault(part, {})
+                node[END] = True
+
+        self.name_regex = compile_any(name_globs)
+        self.dir_name_regex = compile_any(dir_name_globs)
+        self.path_regex = compile_any(path_globs)
+        self.dir_path_regex = compile_any(dir_path_globs)
+
+    @staticmethod
+    def split(path: str) -> list:
+        """
+        Splits a path relative to the root of the backup, e.g. "./a/b", into its parts
+        """
+        parts = path.split(os.path.sep)
+        if parts and parts[0] == ".":
+            parts.pop(0)
+        return parts
+
+    @staticmethod
+    def in_trie(trie: dict, parts: list) -> bool:
+        node = trie
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if END in node:
+                return True
+        return False
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        parts = self.split(path)
+        if not parts:
+            return False
+        name = parts[-1]
+        if name in self.names or self.in_trie(self.path_trie, parts):
+            return True
+        if self.name_regex is not None and self.name_regex.fullmatch(name):
+            return True
+        if self.path_regex is not None and self.path_regex.fullmatch("/".join(parts)):
+            return True
+        if is_dir:
+            if name in self.dir_names or self.in_trie(self.dir_path_trie, parts):
+                return True
+            if self.dir_name_regex is not None and self.dir_name_regex.fullmatch(name):
+                return True
+            if self.dir_path_regex is not None and self.dir_path_regex.fullmatch("/".join(parts)):
+                return True
+        return False
+
+    def excludes_dir(self, path: str) -> bool:
+        """
+        Whether a directory is excluded, in which case nothing under it needs to be looked at
+        @param path: Path relative to root, e.g. "./a/b"
+        """
+        return self.matches(path, True)
+
+    def excludes_file(self, path: str, st: os.stat_result = None) -> bool:
+        """
+        Whether a file is excluded
+        @param path: Path relative to root, e.g. "./a/b"
+        @param st: Stat of file, for the size rule
+        """
+        if self.max_file_size is not None and st is not None and st.st_size > self.max_file_size:
+            return True
+        if self.extensions and os.path.splitext(path)[1].lower() in self.extensions:
+            return True
+        return self.matches(path, False)
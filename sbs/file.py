@@ -3,19 +3,34 @@ import os
 
 class File:
 
-    def __init__(self, is_dir: bool, parent, name: str):
+    def __init__(self, is_dir: bool, parent, name: str, entry: map = None, loader=None):
         """
         Object to represent file tree for navigating the restore menus in navigator.py
         @param is_dir: whether or not file is directory (which can have children)
         @param parent: parent file whence file came
         @param name: file / directory name
+        @param entry: manifest entry of file, if known without the whole manifest
+        @param loader: function given the directory, adding its children the first time they are needed
         """
         self.is_dir = is_dir
         self.parent = parent
         self.name = name
-        if is_dir:
-            # Directories start without children
-            self.children = []
+        self.entry = entry
+        self.loader = loader
+        # Directories start without children
+        self._children = [] if is_dir and loader is None else None
+
+    @property
+    def children(self):
+        if self._children is None and self.is_dir:
+            self._children = []
+            try:
+                self.loader(self)
+            except BaseException:
+                # Try again next time
+                self._children = None
+                raise
+        return self._children
 
     def add_child(self, child: str, isdir: bool):
         """
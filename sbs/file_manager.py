@@ -1,31 +1,41 @@
 import os
-from socket import timeout
 from typing import List
 
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 from googleapiclient.errors import HttpError
-from google.auth.exceptions import *
+from google.auth.exceptions import TransportError
 from io import BytesIO
 from tqdm import tqdm
-from sbs.stoof import Cryptologor
+from sbs.stoof import Cryptologor, IntegrityError
+from sbs.aead import parse_header
 import time
 import json
-import random
-from Cryptodome.Hash import SHA256
+from functools import partial
+from itertools import groupby
+import hashlib
 import base64
-from sbs.sha import digest
-import httplib2
-from sbs.service_getter import get_service
-from sbs.backup import Backup
-from sbs.config import Config
+from sbs.sha import digest, new_hash, entry_algorithm, LEGACY_ALGORITHM
+from sbs.storage import Storage, open_storage
+from sbs.backup import Backup, MissingParentError, make_delta
+from sbs.config import Config, get_data_dir
+from sbs.index import StatIndex, ChunkStore, stat_key
+from sbs.chunker import chunk_stream
+from sbs.scanner import scan_tree
+from sbs.exclude import ExclusionRules
+from sbs.packer import Packer
+from sbs.cache import ManifestCache
+from sbs.catalog import BackupCatalog
+from sbs.manifest import encode_manifest, aggregates
+from sbs.session import SessionJournal
+from sbs.throttle import AdaptiveLimiter
 from sbs.values import *
 
-from threading import Thread
+from threading import Lock, Semaphore
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
 
 
 
-def check_latest_backup_without_hash_scan(backup: Backup, relative_path: str) -> map:
+def check_latest_backup_without_hash_scan(backup: Backup, relative_path: str, st: os.stat_result = None) -> map:
     """
     Checks for file path in latest backup (only most recent backup of source directory), skips check for digest.
     This is the much faster and recommended way of looking for a file.
@@ -33,13 +43,65 @@ def check_latest_backup_without_hash_scan(backup: Backup, relative_path: str) ->
 
     @param backup: Backup object to check
     @param relative_path: path to seek
+    @param st: Stat of file taken by the scan, so that a file which vanished since does not fail the check (optional)
     @return: File map, or none
     """
 
-    last_modified = os.path.getmtime(relative_path)
+    last_modified = st.st_mtime if st is not None else os.path.getmtime(relative_path)
     if last_modified > backup.time:
         return None
-    return backup.find_file_by_path(relative_path)
+    file = backup.find_file_by_path(relative_path)
+    # Entries kept from an earlier backup, e.g. as the file failed to upload, are as old as their upload
+    if file is not None and file.get("uploaded") and last_modified > file.get("uploaded"):
+        return None
+    return file
+
+
+def contiguous_runs(pieces: list, bundles: dict = None, limit: int = RANGE_LIMIT):
+    """
+    Groups pieces of a file into runs of slices which follow one another in the same bundle, so each run may be
+    fetched with one ranged read. Pieces which are whole objects, or slices of bundles in bundles, are runs of their
+    own.
+    @param pieces: Pieces of file
+    @param bundles: Map of bundle id to data of bundles fetched whole
+    @param limit: Maximal size of a run
+    @return: Generator of lists of pieces
+    """
+    run = []
+    for piece in pieces:
+        if piece.get("offset") is None or (bundles and piece.get("id") in bundles):
+            if run:
+                yield run
+                run = []
+            yield [piece]
+            continue
+        if run and (piece.get("id") != run[-1]["id"] or
+                    piece["offset"] != run[-1]["offset"] + run[-1]["size"] or
+                    piece["offset"] + piece["size"] - run[0]["offset"] > limit):
+            yield run
+            run = []
+        run.append(piece)
+    if run:
+        yield run
+
+
+class LogFile:
+    def __init__(self, path: str):
+        """
+        Log of a backup, written to by the upload threads and the limiter at once. Each write is made under a lock,
+        so that lines of different threads never interleave.
+        @param path: Path of log
+        """
+        self.file = open(path, "w")
+        self.lock = Lock()
+
+    def write(self, message: str):
+        with self.lock:
+            self.file.write(message)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
 
 
 class FileManager:
@@ -48,101 +110,248 @@ class FileManager:
         Object to manage backups and files
         @param key_file: path to AES key
         """
+        # Large data is encrypted on a process pool only if configured, see CryptoPool
+        processes = config.crypto_processes or 0
         if key_file:
-            self.c = Cryptologor(key_file=key_file)
+            self.c = Cryptologor(key_file=key_file, processes=processes)
         else:
-            self.c = Cryptologor(key_file=config.key)
-        self.service = get_service(config)
+            self.c = Cryptologor(key_file=config.key, processes=processes)
         self.config = config
-
-    def upload_file(self, path: str, log_file, parent_id, bar=None):
+        self.digest_algorithm = config.digest_algorithm or DIGEST_ALGORITHM
+        # Fails early on an unknown algorithm
+        new_hash(self.digest_algorithm)
+        # Shared by the services of all threads
+        self.limiter = AdaptiveLimiter(max_limit=config.max_jobs or MAX_JOBS,
+                                       max_rate=config.max_request_rate or REQUEST_RATE_MAX)
+        self.storage: Storage = open_storage(config, self.limiter)
+        self.manifest_cache = ManifestCache(get_data_dir() / "cache" / "manifests",
+                                            config.manifest_cache_size or MANIFEST_CACHE_SIZE)
+        self.catalog = BackupCatalog(get_data_dir() / "index" / "catalog.sqlite")
+
+    def upload_file(self, path: str, log_file, parent_id, bar=None, journal: SessionJournal = None):
         """
         Uploads file at path to folder with parent_id
         :param bar: tqdm bar in use in larger backup
         :param path: path to file to be uploaded
         :param parent_id: google drive parent id of directory to be uploaded to
-        :return: SHA1 digest of file, quantity of pieces and total file size, each returned to be stored in JSON file
+        :param journal: Session journal, to record the pieces of files of more than one chunk in, and resume them from
+        :return: Digest of file, with the configured digest algorithm, quantity of pieces and total file size, each
+                 returned to be stored in JSON file
         """
         total_file_size = 0
         pieces = []
-        sha = SHA256.new()
+        sha = new_hash(self.digest_algorithm)
         in_file = open(path, "rb")
-        # Read PIECE_SIZE bytes from file
-        data = in_file.read(PIECE_SIZE)
-        log_file.write("Uploading {}".format(path))
-        piece_counter = 0
+        close_bar = False
+        try:
+            st = os.fstat(in_file.fileno())
+            file_size = st.st_size
+            key = stat_key(st)
+            if file_size <= CHUNK_SIZE:
+                # Uploaded in one request, nothing to resume
+                journal = None
+            resumed = journal.get_pieces(path, key) if journal is not None else {}
+            offset = 0
+            log_file.write("Uploading {}\n".format(path))
+            piece_counter = 0
+
+            # If no bar is supplied, meaning this is a single file upload, we make our own progress bar,
+            # and be sure to close it before returning
+            if bar is None:
+                bar = tqdm(total=file_size, unit="B", unit_scale=True, dynamic_ncols=True)
+                close_bar = True
+
+            # Exit when no more data is left to be read
+            while offset < file_size:
+
+                length = min(PIECE_SIZE, file_size - offset)
+                header, resume_uri, piece = resumed.get(piece_counter, (None, None, None))
+                if header is not None and parse_header(header) is None:
+                    # Partly sent by an older version, in the legacy format
+                    header = resume_uri = None
+                if piece is not None:
+                    # Uploaded before the backup was interrupted, only hashed
+                    in_file.seek(offset)
+                    for position in range(0, length, CHUNK_SIZE):
+                        sha.update(in_file.read(min(CHUNK_SIZE, length - position)))
+                    bar.update(piece["size"])
+                    total_file_size += piece["size"]
+                    pieces.append(piece)
+                    offset += length
+                    piece_counter += 1
+                    continue
+
+                # Piece is read, hashed and encrypted a chunk at a time by a pipeline, a few chunks ahead of the
+                # upload
+                encrypted_stream = self.c.encrypting_reader(in_file, offset, length, sha=sha, header=header,
+                                                            depth=PIPELINE_DEPTH)
+                size = encrypted_stream.size
+
+                log_file.write("Uploading piece {} of size {} bytes\n".format(piece_counter, size))
+
+                total_file_size += size
+                # Application internal info for file is stored in Google Drive file name
+                info = {
+                    "path": path,
+                    "index": piece_counter
+                }
+                on_start = None
+                if journal is not None:
+                    on_start = partial(journal.start_piece, path, piece_counter, key, encrypted_stream.header)
+                try:
+                    piece_id = self.upload_piece(encrypted_stream, size, info, parent_id, bar,
+                                                 resume_uri=resume_uri, on_start=on_start)
+                    # A resumed session which Drive already had whole is not read again
+                    encrypted_stream.finish_hash()
+                finally:
+                    encrypted_stream.close()
+
+                # Keep running list of pieces to return
+                pieces.append({"id": piece_id,
+                               "size": size})
+                if journal is not None:
+                    journal.finish_piece(path, piece_counter, key, pieces[-1])
+                log_file.write("Uploaded piece {} of {} bytes\n".format(piece_counter, size))
+
+                offset += length
+                piece_counter += 1
+        finally:
+            # Also on failure, so that a backup of many failing files does not run out of file descriptors
+            in_file.close()
+            if close_bar:
+                bar.close()
+        return sha.digest(), pieces, total_file_size
+
+    def upload_file_deduplicated(self, path: str, log_file, parent_id, chunks: ChunkStore, bar=None):
+        """
+        Uploads file split into content defined chunks. Chunks found in the chunk store, from this or any earlier
+        backup, are referenced rather than uploaded, new ones are packed into bundles. Each chunk is a piece of the
+        file, a slice of a bundle.
+        :param path: path to file to be uploaded
+        :param parent_id: google drive id of folder of chunks, see ChunkStore.folder
+        :param chunks: Chunk store
+        :param bar: tqdm bar in use in larger backup
+        :return: Same as upload_file
+        """
+        sha = new_hash(self.digest_algorithm)
+        pieces = []
+        # Chunk digest to indices of pieces which wait for the bundle holding the chunk to be uploaded
+        waiting = {}
+        packer = Packer(self.c, self.config.pack_size or PACK_SIZE)
+        log_file.write("Uploading {} deduplicated\n".format(path))
 
-        # If no bar is supplied, meaning this is a single file upload, we make our own progress bar,
-        # and be sure to close it before returning
         if bar is None:
-            bar = tqdm(total=os.path.getsize("path"), unit="B", unit_scale=True, dynamic_ncols=True)
+            bar = tqdm(total=os.path.getsize(path), unit="B", unit_scale=True, dynamic_ncols=True)
             close_bar = True
         else:
             close_bar = False
 
-        # Exit when no more data is left to be read
-        while data:
-
-            # Digest on separate thread for TIME EFFICIENCY
-            hash_thread = Thread(target=sha.update, args=(data,))
-            hash_thread.start()
-            encrypted_data = self.c.encrypt(data)
-            size = len(encrypted_data)
-
-            log_file.write("Uploading piece {} of size {} bytes\n".format(piece_counter, size))
-
-            total_file_size += size
-            media_body = MediaIoBaseUpload(BytesIO(encrypted_data), resumable=True, chunksize=CHUNK_SIZE,
-                                           mimetype="application/octet-stream")
-            # Application internal info for file is stored in Google Drive file name
-            info = {
-                "path": path,
-                "index": piece_counter
-            }
+        def upload(bundle):
+            if bundle is None:
+                return
+            bundle_index, data, members = bundle
+            bundle_id = self.upload_bundle(data, {"path": path, "bundle": bundle_index}, parent_id, bar)
+            stored = []
+            for member in members:
+                piece = {"id": bundle_id, "size": member["size"], "offset": member["offset"]}
+                for i in waiting.pop(member["chunk_digest"]):
+                    pieces[i] = piece
+                stored.append((member["chunk_digest"], piece))
+            chunks.add(stored)
 
-            # Google drive file metadata
-            metadata = {
-                "name": self.c.encrypt_name(json.JSONEncoder().encode(info)),
-                "parents": [parent_id]
-            }
+        try:
+            with open(path, "rb") as in_file:
+                for chunk in chunk_stream(in_file):
+                    sha.update(chunk)
+                    chunk_digest = hashlib.sha256(chunk).hexdigest()
+                    if chunk_digest in waiting:
+                        waiting[chunk_digest].append(len(pieces))
+                        pieces.append(None)
+                        continue
+                    piece, event = chunks.claim(chunk_digest)
+                    while event is not None:
+                        # Another upload has the chunk in its bundle. Ours is uploaded first, so that no two uploads
+                        # ever wait for one another.
+                        upload(packer.flush())
+                        event.wait()
+                        piece, event = chunks.claim(chunk_digest)
+                    if piece is not None:
+                        pieces.append(piece)
+                        bar.update(piece["size"])
+                    else:
+                        waiting[chunk_digest] = [len(pieces)]
+                        pieces.append(None)
+                        upload(packer.add_data(chunk, chunk_digest=chunk_digest))
+            upload(packer.flush())
+        except BaseException:
+            chunks.release(list(waiting))
+            raise
 
-            file = self.service.files().create(body=metadata, media_body=media_body, fields="id")
+        if close_bar:
+            bar.close()
+        return sha.digest(), pieces, sum(piece["size"] for piece in pieces)
 
-            response = None
+    def upload_piece(self, stream, size: int, info: dict, parent_id, bar, resume_uri: str = None, on_start=None):
+        """
+        Uploads one object
+        @param stream: Seekable stream of encrypted data
+        @param size: Size of data
+        @param info: Application internal info, stored encrypted in the name of the object
+        @param parent_id: Id of folder to be uploaded to
+        @param bar: tqdm bar to update with progress
+        @param resume_uri: Resumable upload URI of an earlier attempt at the same data, see Storage.put
+        @param on_start: Function given the resumable upload URI, once the storage gave one
+        @return: Id of object
+        """
+        name = self.c.encrypt_name(json.JSONEncoder().encode(info))
+        # The transfer counts against the limit of transfers in flight while it lasts, retries included
+        with self.limiter.slot():
+            return self.storage.put(stream, size, name, parent_id, bar=bar, resume_uri=resume_uri, on_start=on_start)
 
-            total = 0.0
-            while response is None:
-                try:
-                    # Upload next chunk of file
-                    status, response = file.next_chunk()
-                    if status:
-                        # If we get a response update progress bar (progress is a number between 0-1)
-                        progress = status.progress()
-                        bar.update((progress - total) * size)
-                        total = progress
-                except (httplib2.ServerNotFoundError, BrokenPipeError, TimeoutError, ConnectionResetError, OSError,
-                        timeout, HttpError, TransportError):
-                    seconds = random.randint(30, 91)
-                    bar.write("Having internet troubles, waiting, {} seconds".format(seconds))
-                    time.sleep(seconds)
-            # Keep running list of pieces to return
-            pieces.append({"id": response.get("id"),
-                           "size": size})
-            log_file.write("Uploaded piece {} of {} bytes\n".format(piece_counter, size))
-            # Final update of bar just in case
-            bar.update((1 - total) * size)
-
-            # Read data for next iteration of loop
-            data = in_file.read(PIECE_SIZE)
-            piece_counter += 1
-            hash_thread.join()
+    def upload_bundle(self, data: bytes, info, parent_id, bar):
+        """
+        Uploads a bundle of packed small files or chunks, see Packer
+        @param data: Concatenated ciphers of the files
+        @param info: Application internal info, stored encrypted in the Drive file name
+        @param parent_id: google drive id of backup folder
+        @param bar: tqdm bar to update with progress
+        @return: google drive id of bundle
+        """
+        return self.upload_piece(BytesIO(data), len(data), info, parent_id, bar)
 
-        if close_bar:
-            bar.close()
-        return sha.digest(), pieces, total_file_size
+    def download_piece(self, piece: map, fd, bar=None, bundles: dict = None):
+        """
+        Downloads the cipher of one piece. A piece with an offset is the slice of a
+        bundle, which is fetched with a ranged read unless the bundle was already fetched whole.
+        @param piece: Piece map with id and size, and offset for a slice of a bundle
+        @param fd: Stream to write cipher to
+        @param bar: Progress bar to update
+        @param bundles: Map of bundle id to data of bundles fetched whole
+        """
+        id = piece.get("id")
+        size = piece.get("size") or 0
+        offset = piece.get("offset")
+        if offset is not None and bundles and id in bundles:
+            fd.write(bundles[id][offset:offset + size])
+            if bar is not None:
+                bar.update(size)
+            return
+
+        with self.limiter.slot():
+            self.storage.get(id, fd, offset=offset, size=size if offset is not None else None, bar=bar)
+
+    def fetch_bundle(self, bundle_id) -> bytes:
+        """
+        Downloads a whole bundle, for restoring many of its files at once
+        @param bundle_id: google drive id of bundle
+        @return: Data of bundle
+        """
+        fh = BytesIO()
+        self.download_piece({"id": bundle_id}, fh)
+        return fh.getvalue()
 
     def download_file(self, file: map, restoration_path: str, bar=None,
-                      path=None):
+                      path=None, bundles: dict = None):
         """
         Download and restore file
         @param file: File (map)
@@ -150,6 +359,7 @@ class FileManager:
                                  as source path, otherwise some other path for testing
         @param bar: Progress bar in case of large restoration
         @param path: Path to file in backup (optional)
+        @param bundles: Map of bundle id to data of bundles fetched whole (optional)
         """
 
         restoration_path = os.path.abspath(restoration_path)
@@ -158,25 +368,18 @@ class FileManager:
         if path is None:
             path = file['source']
 
-        if not os.path.exists(restoration_path):
-            os.makedirs(restoration_path)
-        os.chdir(restoration_path)
+        # Resolve against the restoration path rather than changing directory, cwd is shared by all threads
+        path = os.path.join(restoration_path, path)
 
+        algorithm = entry_algorithm(file)
         if os.path.exists(path) and not os.path.isdir(path):
-            sha = SHA256.new()
-            with open(path, "rb") as f:
-                data = f.read(PIECE_SIZE)
-                while(data):
-                    sha.update(data)
-                    data=f.read(PIECE_SIZE)
-            if base64.b64encode(sha.digest()).decode("UTF-8")==file['digest']:
+            if digest(path, algorithm, workers=os.cpu_count() or 1) == file['digest']:
                 if bar is not None:
                     bar.update(file['total_size'])
                 return
 
         # Make dirs leading to path
-        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
 
         # Make own bar if no bar is supplied
         if bar is None:
@@ -184,43 +387,46 @@ class FileManager:
             bar = tqdm(total=file.get("total_size"), unit_scale=True, unit="B", dynamic_ncols=True)
         else:
             close_bar = False
-        out_file = open(path, "wb")
-
-        # Iterate over all pieces in file to download whole file
-        for piece, count in zip(file.get("pieces"), range(len(file.get("pieces")))):
-            id = piece.get("id")
-            size = piece.get("size")
-            request = self.service.files().get_media(fileId=id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request, chunksize=CHUNK_SIZE)
-            done = False
-            total = 0.0
-            while done is False:
-                try:
-                    
-                    status, done = downloader.next_chunk()
-                    if status:
-                        progress = status.progress()
-                        bar.update(size * (progress - total))
-                        total = progress
-                except (httplib2.ServerNotFoundError, BrokenPipeError, TimeoutError, ConnectionResetError, OSError,
-                        timeout, HttpError, TransportError):
-                    seconds = random.randint(30, 91)
-                    bar.write("Having internet troubles, waiting, {} seconds".format(seconds))
-                    time.sleep(seconds)
-                    
-            # Go to start of byteio to begin reading
-            fh.seek(0)
-            data = fh.read()
-            # print(len(data))
-            out_file.write(self.c.decrypt(data))
-            # Final update of bar for piece just in case
-            bar.update(size * (1 - total))
-        if close_bar:
-            bar.close()
+        # Restore into a partial file which only replaces the real one once its digest is verified
+        partial_path = path + ".sbs-partial"
+        out_file = open(partial_path, "wb")
+        sha = new_hash(algorithm)
+
+        try:
+            # Iterate over all pieces in file to download whole file
+            for run in contiguous_runs(file.get("pieces"), bundles):
+                if len(run) == 1:
+                    # Pieces are decrypted straight into the file as their chunks arrive
+                    writer = self.c.decrypting_writer(out_file, sha=sha)
+                    self.download_piece(run[0], writer, bar, bundles=bundles)
+                    writer.finish()
+                    continue
+                # Consecutive slices of one bundle, e.g. chunks of a deduplicated file, are fetched in one read
+                start = run[0]["offset"]
+                fh = BytesIO()
+                self.download_piece({"id": run[0]["id"], "offset": start,
+                                     "size": run[-1]["offset"] + run[-1]["size"] - start}, fh, bar)
+                data = fh.getbuffer()
+                for piece in run:
+                    writer = self.c.decrypting_writer(out_file, sha=sha)
+                    writer.write(data[piece["offset"] - start:piece["offset"] - start + piece["size"]])
+                    writer.finish()
+                del data
+            out_file.close()
+            restored_digest = base64.b64encode(sha.digest()).decode("UTF-8")
+            if file.get('digest') and restored_digest != file['digest']:
+                raise IntegrityError("Digest of restored {} does not match backup".format(path))
+            os.replace(partial_path, path)
+        except BaseException:
+            out_file.close()
+            os.remove(partial_path)
+            raise
+        finally:
+            if close_bar:
+                bar.close()
 
     def backup(self, dir_path, exclude_list, config: Config, do=False, unique=False, limit=5 * 10 ** 9,
-               previous_backup: Backup = None
+               previous_backup: Backup = None, jobs=DEFAULT_JOBS, resume=False
                ):
         """
         Performs backup of particular directory to Google Drive.
@@ -230,26 +436,21 @@ class FileManager:
         @param hash_scan:
         @param limit: Limit of total backup size
         @param parent_id: id of directory containing backups on Google drive
-        @param exclude_list: list of files to exclude (large, dynamic files for example)
+        @param exclude_list: list of paths and globs to exclude (large, dynamic files for example), see ExclusionRules
+        @param jobs: Number of files uploaded concurrently
+        @param resume: Whether to carry on with the interrupted backup of the same directory, if there is one
         """
 
         if not config.parent_id:
-            metadata = {
-                "name": input("Please enter a folder name for your backups [Backups]: ") or "Backups",
-                'mimeType': 'application/vnd.google-apps.folder',
-                'parents': ['appDataFolder']
-
-            }
-
-            file = self.service.files().create(body=metadata, fields="id").execute()
-            config.parent_id = file.get("id")
+            config.parent_id = self.storage.create_folder(
+                input("Please enter a folder name for your backups [Backups]: ") or "Backups")
             config.dump()
         # Generate path to log with datetime and dir
 
         if not os.path.exists(config.log_dir):
             os.makedirs(config.log_dir)
         log_path = os.path.join(config.log_dir, time.ctime())
-        log_file = open(log_path, "w")
+        log_file = LogFile(log_path)
 
         # Create link for latest log for ease of checking logs
         link_path = os.path.join(config.log_dir, "latest")
@@ -258,158 +459,274 @@ class FileManager:
         except FileNotFoundError:
             pass
         os.symlink(log_path, link_path)
-        backups = self.list_backups()
         json_list = []
         dir_path = os.path.abspath(dir_path)
 
         os.chdir(dir_path)
 
-        file_list = []
         file_size = 0
-        if not previous_backup:
-            backup = None
-            for backup in backups:
-                if backup.get_files_list():
-                    break
-            if backup is None or backup.get_files_list() is None:
-                unique = True
-        else:
-            backup=previous_backup
-
-        log_file.write("Beginning file check\n")
-        for root, dirs, files in os.walk(".", ):
-            exclude = False
-            for exclusion in exclude_list:
-
-                commonprefix = os.path.commonprefix([exclusion, root])
-                length = len(commonprefix)
-
-                if length > 2:
-                    # checks if best common prefix is longer than "./", hence the dir is excluded
-                    exclude = True  # continue in loop, skip this root directory
-            # if finish: break
-            if exclude:
-                # make sure we don't go deeper in tree
-                dirs[:] = []
-                files[:] = []
-                continue
-
-            for file in files:
-                full_path = os.path.join(root, file)
-                if os.path.exists(full_path):
-                    if unique:
-                        backup_file = False
-                    else:
-                        excluded = False
-                        # print("Checking {}".format(full_path))
-
-                        backup_file: dict = check_latest_backup_without_hash_scan(backup, full_path)
-                    if backup_file:
-                        # print("Found {} in other backup".format(full_path))
-                        # print(".",end=" ")
-
-                        backup_file['source'] = full_path
-                        if backup_file.get('size'):
-                            backup_file['total_size'] = backup_file['size']
-                            backup_file.pop("size")
-                            log_file.write("Changed size to total_size\n")
-                        json_list.append(backup_file)
-                    else:
-                        # print("!",end=" ")
-                        log_file.write(
-                            "{} not found... adding to backup\n".format(full_path.encode('utf-8', 'replace').decode()))
-                        current_file_size = os.path.getsize(full_path)
-                        if limit and file_size + current_file_size > limit:
-                            finish = True
-                            # break
-                        else:
-                            file_list.append(full_path)
-                            file_size += current_file_size
-
-        # print("Size={Size
-
-        file_list = sorted(file_list,
-                           key=lambda x: random.random())  # randomizes order of file list for security reasons
-        # print(file_list)
-        if do:
+        # Stat of every file in the backup, recorded in the index once the manifest is uploaded
+        stats = {}
+        index = StatIndex(get_data_dir() / "index" / "{}.sqlite".format(config.parent_id), dir_path)
+        # A file which misses the index is missing from the backup it holds the files of as well, the previous
+        # manifest is only fetched when the index holds none
+        indexed_backup = self.get_indexed_backup(index) if previous_backup is None else None
+        backup = previous_backup or indexed_backup
+        looked_for_backup = backup is not None
+
+        rules = ExclusionRules(exclude_list, dir_path, max_file_size=config.max_file_size,
+                               extensions=config.exclude_extensions)
+
+        total_uploaded_bytes = 0
+        json_lock = Lock()
+        # The session is journaled, and saved to Drive as a checkpoint manifest every so many files or bytes, so
+        # that a killed backup can be resumed
+        journal = SessionJournal(get_data_dir() / "sessions" / "{}.sqlite".format(config.parent_id))
+        session = journal.get_session(dir_path) if resume else None
+        folder_id = None
+        checkpoint_id = None
+        checkpoint_lock = Lock()
+        # Whether every file was scanned and every upload finished, else the backup is left to be resumed
+        complete = False
+        # Files which failed to upload, kept as the previous backup has them
+        failed = []
+        files_since_checkpoint = 0
+        bytes_since_checkpoint = 0
+
+        def save_checkpoint():
+            """
+            Uploads a manifest of the files uploaded so far, replacing the last one. Skipped if another thread is
+            already saving one.
+            """
+            nonlocal checkpoint_id, files_since_checkpoint, bytes_since_checkpoint
+            if not checkpoint_lock.acquire(blocking=False):
+                return
             try:
-                total_uploaded_bytes = 0
-                m = {
-                    "dir": dir_path,
-                    "time": time.time()
-                }
-                name = json.encoder.JSONEncoder().encode(m)
-                metadata = {
-                    "name": self.c.encrypt_name(name),
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [config.parent_id]
-                }
-                file = self.service.files().create(body=metadata, fields="id").execute()
-                folder_id = file.get("id")
-
-                bar = tqdm(total=file_size, unit="B", unit_scale=True, dynamic_ncols=True)
-                log_file.write("Beginning backup of size {}\n".format(file_size))
-                for file in file_list:
-                    try:
-                        digest, pieces, size = self.upload_file(file, log_file, folder_id,
-                                                                bar=bar)
-                        json_list.append({
-                            "source": file,
-                            "digest": base64.b64encode(digest).decode("UTF-8"),
-                            "pieces": pieces,
-                            "uploaded": time.time(),
-                            "total_size": size
-                        })
-                        total_uploaded_bytes += size
-                        log_file.write(
-                            "Uploaded {}, of size {} bytes complete, I have uploaded {} bytes in total\n".format(file,
-                                                                                                                 size,
-                                                                                                                 total_uploaded_bytes))
-                    # except Exception:
-                    #     print("Error with {}".format(file))
-                    #     traceback.print_exc()
-                    finally:
-                        pass
-            except KeyboardInterrupt:
-                pass
+                with json_lock:
+                    files = list(json_list)
+                    files_since_checkpoint = 0
+                    bytes_since_checkpoint = 0
+                manifest = {"version": VERSION_CODE, "checkpoint": True, "files": files}
+                data = self.c.encrypt(encode_manifest(manifest, aggregates(files)))
+                new_id = self.upload_named(data, "checkpoint_{}.manifest".format(VERSION_CODE), folder_id,
+                                           quiet=True)
+                journal.set_checkpoint(new_id)
+                if checkpoint_id is not None:
+                    self.delete_objects(folder_id, [checkpoint_id])
+                checkpoint_id = new_id
+                log_file.write("Saved checkpoint of {} files\n".format(len(files)))
             finally:
+                checkpoint_lock.release()
+
+        def collect(files: list, size: int):
+            """
+            Adds uploaded files to the manifest and the journal, saving a checkpoint if one is due
+            """
+            nonlocal total_uploaded_bytes, files_since_checkpoint, bytes_since_checkpoint
+            journal.add_files(files, stats)
+            with json_lock:
+                json_list.extend(files)
+                total_uploaded_bytes += size
+                files_since_checkpoint += len(files)
+                bytes_since_checkpoint += size
+                due = files_since_checkpoint >= (config.session_checkpoint_files or SESSION_CHECKPOINT_FILES) or \
+                    bytes_since_checkpoint >= (config.session_checkpoint_bytes or SESSION_CHECKPOINT_BYTES)
+            if due:
+                save_checkpoint()
+
+        def digest_fields(file: map) -> map:
+            """
+            Records the digest algorithm in a new file map, unless it is the one of entries which name none
+            """
+            if self.digest_algorithm != LEGACY_ALGORITHM:
+                file["digest_algorithm"] = self.digest_algorithm
+            return file
+
+        def on_upload_done(file, future):
+            """
+            Collects the result of one upload, runs on whichever thread finished it.
+            """
+            try:
+                digest, pieces, size = future.result()
+            except CancelledError:
+                return
+            except Exception as e:
+                bar.write("Error with {}: {}".format(file, e))
+                log_file.write("Error with {}: {}\n".format(file, e))
+                with json_lock:
+                    failed.append(file)
+                return
+            collect([digest_fields({
+                "source": file,
+                "digest": base64.b64encode(digest).decode("UTF-8"),
+                "pieces": pieces,
+                "uploaded": time.time(),
+                "total_size": size
+            })], size)
+            log_file.write(
+                "Uploaded {}, of size {} bytes complete, I have uploaded {} bytes in total\n".format(
+                    file, size, total_uploaded_bytes))
+
+        def on_bundle_done(members, future):
+            """
+            Adds the files of a bundle to the manifest once the bundle is uploaded
+            """
+            bundle_slots.release()
+            try:
+                bundle_id = future.result()
+            except CancelledError:
+                return
+            except Exception as e:
+                bar.write("Error with bundle: {}".format(e))
+                log_file.write("Error with bundle of {}: {}\n".format([m["source"] for m in members], e))
+                with json_lock:
+                    failed.extend(member["source"] for member in members)
+                return
+            collect([digest_fields({
+                "source": member["source"],
+                "digest": member["digest"],
+                "pieces": [{"id": bundle_id, "size": member["size"], "offset": member["offset"]}],
+                "uploaded": time.time(),
+                "total_size": member["size"]
+            }) for member in members], sum(member["size"] for member in members))
+            log_file.write("Uploaded bundle of {} files\n".format(len(members)))
+
+        def submit_bundle(bundle):
+            if bundle is not None:
+                bundle_index, data, members = bundle
+                # Waits while enough bundles are held in memory, so the scan and packing do not run ahead of uploads
+                bundle_slots.acquire()
+                future = executor.submit(self.upload_bundle, data, {"bundle": bundle_index}, folder_id, bar)
+                future.add_done_callback(partial(on_bundle_done, members))
+
+        # Files smaller than the pack threshold are packed into bundles
+        packer = Packer(self.c, config.pack_size or PACK_SIZE, digest_algorithm=self.digest_algorithm) \
+            if config.pack_threshold else None
+        # Files from the dedup threshold on are split into chunks, each uploaded once across all backups
+        chunks = ChunkStore(get_data_dir() / "index" / "{}.chunks.sqlite".format(config.parent_id)) \
+            if config.dedup_threshold else None
+        shards = ChunkStore(get_data_dir() / "index" / "{}.shards.sqlite".format(config.parent_id))
+
+        if do and session is not None:
+            folder_id, checkpoint_id = session
+            print("Resuming interrupted backup")
+            log_file.write("Resuming backup in folder {}\n".format(folder_id))
+        elif do:
+            if resume:
+                print("No interrupted backup of {} to resume".format(dir_path))
+            m = {
+                "dir": dir_path,
+                "time": time.time()
+            }
+            name = json.encoder.JSONEncoder().encode(m)
+            folder_id = self.storage.create_folder(self.c.encrypt_name(name), config.parent_id)
+            journal.start(dir_path, folder_id)
+        if do:
+            # Files are uploaded as the scan finds them, so the total of the bar grows with the scan
+            bar = tqdm(total=0, unit="B", unit_scale=True, dynamic_ncols=True)
+            # Uploads start at jobs in flight, the limiter lets more run while throughput rises
+            self.limiter.reset(jobs)
+            self.limiter.log = log_file.write
+            executor = ThreadPoolExecutor(max_workers=max(1, jobs, self.limiter.max_limit))
+            bundle_slots = Semaphore(max(1, jobs) + BUNDLES_AHEAD)
+            chunks_folder = self.shared_folder(chunks, "chunks") if chunks is not None else None
+            log_file.write("Beginning backup with {} jobs\n".format(jobs))
 
-                bar.close()
-                print("Cleaning up")
-                json_map = {"version": VERSION_CODE,
-                            "files": json_list}
-                json_data = json.dumps(json_map)
-                encrypted_json_data = self.c.encrypt(json_data.encode('UTF-8'))
-                media_body = MediaIoBaseUpload(
-                    BytesIO(
-                        encrypted_json_data
-                    ),
-                    resumable=True, chunksize=256 * 1024,
-                    mimetype="application/octet-stream"
-                )
-                metadata = {
-                    "name": self.c.encrypt_name("backup_{}.json".format(VERSION_CODE)),
-                    "parents": [folder_id]
-                }
-                file = self.service.files().create(body=metadata, media_body=media_body, fields="id")
-                response = None
-                enc_json_data_len = len(encrypted_json_data)
-                bar = tqdm(total=enc_json_data_len, dynamic_ncols=True)
-                total = 0.0
-                while response is None:
+        log_file.write("Beginning file check\n")
+        try:
+            # Order of files in each directory is randomized for security reasons
+            for full_path, st in scan_tree(".", jobs=jobs, exclude_dir=rules.excludes_dir,
+                                            exclude_file=rules.excludes_file, shuffle=True):
+                stats[full_path] = stat_key(st)
+                if session is not None:
+                    # Uploaded before the backup was interrupted
+                    backup_file = journal.lookup(full_path, st)
+                    if backup_file is not None:
+                        with json_lock:
+                            json_list.append(backup_file)
+                        continue
+                if unique:
+                    backup_file = None
+                else:
                     try:
-                        status, response = file.next_chunk()
-                        if status:
-                            # uploaded+=CHUNK_SIZE
-                            # bar.update(uploaded)
-                            # bar.
-                            progress = status.progress()
-                            bar.update((progress - total) * enc_json_data_len)
-                            total = progress
-                    except Exception as e:
-                        bar.write(str(e))
-                bar.update((1 - total)*enc_json_data_len)
+                        backup_file = index.lookup(full_path, st)
+                    except OSError as e:
+                        # Hashed as its stat changed, but it vanished or is unreadable since the scan
+                        log_file.write("Error with {}: {}, skipping\n".format(full_path, e))
+                        continue
+                    if backup_file is None:
+                        if not looked_for_backup:
+                            backup = self.find_latest_backup(exclude=folder_id, with_files=True)
+                            looked_for_backup = True
+                        if backup is not None and backup is not indexed_backup:
+                            backup_file: dict = check_latest_backup_without_hash_scan(backup, full_path, st)
+                if backup_file:
+                    # print("Found {} in other backup".format(full_path))
+                    # print(".",end=" ")
+
+                    backup_file['source'] = full_path
+                    if backup_file.get('size'):
+                        backup_file['total_size'] = backup_file['size']
+                        backup_file.pop("size")
+                        log_file.write("Changed size to total_size\n")
+                    with json_lock:
+                        json_list.append(backup_file)
+                else:
+                    # print("!",end=" ")
+                    log_file.write(
+                        "{} not found... adding to backup\n".format(full_path.encode('utf-8', 'replace').decode()))
+                    current_file_size = st.st_size
+                    # Files which would take the backup over its limit are left out
+                    if not limit or file_size + current_file_size <= limit:
+                        file_size += current_file_size
+                        if do:
+                            bar.total += current_file_size
+                            bar.refresh()
+                            if packer is not None and current_file_size < config.pack_threshold:
+                                try:
+                                    submit_bundle(packer.add(full_path))
+                                except OSError as e:
+                                    log_file.write("Error with {}: {}\n".format(full_path, e))
+                            elif chunks is not None and current_file_size >= config.dedup_threshold:
+                                future = executor.submit(self.upload_file_deduplicated, full_path, log_file,
+                                                         chunks_folder, chunks, bar=bar)
+                                future.add_done_callback(partial(on_upload_done, full_path))
+                            else:
+                                future = executor.submit(self.upload_file, full_path, log_file, folder_id, bar=bar,
+                                                         journal=journal)
+                                future.add_done_callback(partial(on_upload_done, full_path))
+            if do:
+                if packer is not None:
+                    submit_bundle(packer.flush())
+                executor.shutdown(wait=True)
+            complete = True
+        except KeyboardInterrupt:
+            if not do:
+                raise
+        finally:
+            if do and not complete:
+                # Let pieces already in flight finish so they make it into the checkpoint
+                executor.shutdown(wait=True, cancel_futures=True)
+                bar.close()
+                # The journal is kept and no final manifest written, so that the backup can be resumed
+                save_checkpoint()
+                print("Backup interrupted, run it again with --resume to carry on")
+                log_file.write("Backup interrupted after uploading {} bytes\n".format(total_uploaded_bytes))
+            elif do:
                 bar.close()
+                print("Cleaning up")
+                if not looked_for_backup:
+                    backup = self.find_latest_backup(exclude=folder_id, with_files=True)
+                if failed and backup is not None:
+                    self.keep_failed_files(failed, backup, json_list, stats, log_file)
+                chain = self.upload_manifest(json_list, folder_id, parent=backup)
+                self.upload_shard_index(self.upload_shards(json_list, self.shared_folder(shards, "shards"), shards),
+                                        folder_id)
+                if checkpoint_id is not None:
+                    self.delete_objects(folder_id, [checkpoint_id])
+                journal.finish()
+                # Only now are the pieces of the manifest safely referenced
+                index.record(json_list, stats, chain)
                 # if verbose:
                 #     for file in json_list:
                 #         print(file.get("source"))
@@ -417,9 +734,269 @@ class FileManager:
                 print("Uploaded {} bytes.".format(total_uploaded_bytes))
                 log_file.write("Uploaded {} bytes / {}".format(total_uploaded_bytes, file_size))
 
-                log_file.close()
+            self.limiter.log = None
+            log_file.close()
+            index.close()
+            journal.close()
+            if chunks is not None:
+                chunks.close()
+            shards.close()
 
+    def keep_failed_files(self, failed: list, previous: Backup, json_list: list, stats: dict, log_file):
+        """
+        Adds the files which failed to upload to the manifest as the previous backup has them, so that a failed upload
+        does not delete the file from the backup. They are left out of the stat index, to be uploaded next time.
+        @param failed: Paths of files which failed to upload
+        @param previous: Previous backup
+        @param json_list: List of file maps of backup
+        @param stats: Map of path to stat key of files of backup, see StatIndex.record
+        """
+        try:
+            files = previous.get_files_list() or {}
+        except MissingParentError:
+            files = {}
+        for path in failed:
+            stats.pop(path, None)
+            if path in files:
+                json_list.append(dict(files[path]))
+                log_file.write("Kept {} as the previous backup has it\n".format(path))
+
+    def upload_manifest(self, json_list: list, folder_id, parent: Backup = None):
+        """
+        Uploads the manifest of a backup, in the binary encoding of manifest.py. With a parent backup, only what
+        changed since the parent is written, unless the chain of deltas since the last full manifest is long enough
+        for a full one to be due (every checkpoint_interval backups). The header of the manifest holds the stats of
+        the whole backup, even for a delta.
+        @param json_list: List of file maps
+        @param folder_id: google drive id of backup folder
+        @param parent: Backup to write a delta to (optional)
+        @return: Chain of manifest, see Backup.chain
+        """
+        checkpoint_interval = self.config.checkpoint_interval or CHECKPOINT_INTERVAL
+        try:
+            parent_files = parent.get_files_list() if parent is not None else None
+        except MissingParentError:
+            # A delta against a backup whose own files are unknown could not be read either
+            parent_files = None
+        if parent_files is not None and parent.depth + 1 < checkpoint_interval:
+            changed, deleted = make_delta(json_list, parent_files)
+            chain = [folder_id] + parent.chain
+            json_map = {"version": VERSION_CODE,
+                        "parent": parent.id,
+                        "depth": parent.depth + 1,
+                        "files": changed,
+                        "deleted": deleted}
+        else:
+            json_map = {"version": VERSION_CODE,
+                        "files": json_list}
+            chain = [folder_id]
+        encrypted_data = self.c.encrypt(encode_manifest(json_map, aggregates(json_list)))
+        self.upload_named(encrypted_data, "backup_{}.manifest".format(VERSION_CODE), folder_id)
+        self.manifest_cache.put(folder_id, encrypted_data)
+        return chain
+
+    def upload_named(self, encrypted_data: bytes, name: str, folder_id, quiet: bool = False):
+        """
+        Uploads a small object the application finds by name, such as a manifest
+        @param encrypted_data: Encrypted data
+        @param name: Name, stored encrypted
+        @param folder_id: google drive id of backup folder
+        @param quiet: Whether to leave out the progress bar
+        @return: google drive id of object
+        """
+        bar = tqdm(total=len(encrypted_data), unit="B", unit_scale=True, dynamic_ncols=True, disable=quiet)
+        try:
+            return self.storage.put(BytesIO(encrypted_data), len(encrypted_data), self.c.encrypt_name(name), folder_id,
+                                    bar=bar)
+        finally:
+            bar.close()
+
+    def upload_shards(self, json_list: list, folder_id, shards: ChunkStore):
+        """
+        Writes the manifest again as a tree of shards, one per directory, so that restores can fetch only the
+        directories they need. A shard holds the file maps of its directory and the pieces of the shards of its sub
+        directories. Shards are written deepest directories first, each depth packed into bundles, so the pieces of
+        sub directories are known by the time their parent is written. Shards are stored by content, so shards of
+        directories which did not change since an earlier backup are reused as they are.
+        @param json_list: List of file maps
+        @param folder_id: google drive id of folder of shards, see ChunkStore.folder
+        @param shards: Shard store
+        @return: Piece of shard of root directory
+        """
+        # Directory path to list of files and set of sub directory paths
+        tree = {".": ([], set())}
+        for file in json_list:
+            directory = os.path.dirname(file["source"]) or "."
+            tree.setdefault(directory, ([], set()))[0].append(file)
+            while directory != ".":
+                parent = os.path.dirname(directory) or "."
+                subdirs = tree.setdefault(parent, ([], set()))[1]
+                if directory in subdirs:
+                    break
+                subdirs.add(directory)
+                directory = parent
+
+        pieces = {}
+        bar = tqdm(total=0, unit="B", unit_scale=True, dynamic_ncols=True)
+        packer = Packer(self.c, self.config.pack_size or PACK_SIZE)
+
+        def upload(bundle):
+            if bundle is None:
+                return
+            bundle_index, data, members = bundle
+            bar.total += len(data)
+            bundle_id = self.upload_bundle(data, {"shards": bundle_index}, folder_id, bar)
+            stored = []
+            for member in members:
+                piece = {"id": bundle_id, "size": member["size"], "offset": member["offset"]}
+                for directory in waiting.pop(member["shard_digest"]):
+                    pieces[directory] = piece
+                stored.append((member["shard_digest"], piece))
+            shards.add(stored)
+
+        depth = lambda directory: directory.count(os.path.sep)
+        for _, directories in groupby(sorted(tree, key=depth, reverse=True), key=depth):
+            # Shard digest to directories waiting for the bundle holding the shard to be uploaded
+            waiting = {}
+            try:
+                for directory in directories:
+                    files, subdirs = tree[directory]
+                    shard = {
+                        "files": sorted(files, key=lambda file: file["source"]),
+                        "dirs": {os.path.basename(subdir): pieces[subdir] for subdir in sorted(subdirs)}
+                    }
+                    data = json.dumps(shard, sort_keys=True).encode("UTF-8")
+                    shard_digest = hashlib.sha256(data).hexdigest()
+                    if shard_digest in waiting:
+                        waiting[shard_digest].append(directory)
+                        continue
+                    piece, _ = shards.claim(shard_digest)
+                    if piece is not None:
+                        pieces[directory] = piece
+                    else:
+                        waiting[shard_digest] = [directory]
+                        upload(packer.add_data(data, shard_digest=shard_digest))
+                upload(packer.flush())
+            except BaseException:
+                shards.release(list(waiting))
+                raise
+        bar.close()
+        return pieces["."]
+
+    def upload_shard_index(self, root: map, folder_id):
+        """
+        Uploads the index of the shards of a backup, see upload_shards
+        @param root: Piece of shard of root directory
+        @param folder_id: google drive id of backup folder
+        """
+        data = self.c.encrypt(json.dumps({"version": VERSION_CODE, "root": root}).encode("UTF-8"))
+        self.upload_named(data, "index_{}.json".format(VERSION_CODE), folder_id)
+        self.manifest_cache.put(folder_id + ".index", data)
+
+    def read_shard(self, piece: map):
+        """
+        Downloads a shard, see upload_shards
+        @param piece: Piece of shard
+        @return: Shard map with files, list of file maps, and dirs, map of name to piece of shard of sub directory
+        """
+        fh = BytesIO()
+        writer = self.c.decrypting_writer(fh)
+        self.download_piece(piece, writer)
+        writer.finish()
+        return json.loads(fh.getvalue().decode("UTF-8"))
+
+    def delete_objects(self, folder_id, file_ids: list):
+        """
+        Deletes objects the application no longer needs, such as a replaced checkpoint manifest. Failing to only
+        leaves them behind, so errors are ignored.
+        @param folder_id: Id of folder holding objects
+        @param file_ids: Ids of objects
+        """
+        self.storage.delete(folder_id, file_ids)
+
+    def shared_folder(self, store: ChunkStore, kind: str) -> str:
+        """
+        Folder a chunk store uploads its bundles to, see ChunkStore.folder. It is kept at the top level, where it is
+        not taken for a backup, with the parent folder of the backups in its encrypted name.
+        @param store: Chunk store
+        @param kind: What the store holds, chunks or shards
+        @return: Id of folder
+        """
+        name = json.JSONEncoder().encode({kind: self.config.parent_id})
+        return store.folder(lambda: self.storage.create_folder(self.c.encrypt_name(name)))
+
+    def get_indexed_backup(self, index: StatIndex):
+        """
+        Backup the stat index holds the files of (see StatIndex.record), with its files as the index holds them, so
+        that a delta may be written against it without downloading its manifest. Only the folders of the backups its
+        manifest is made up of are looked up, to make sure they still exist.
+        @param index: Stat index
+        @return: Backup, or None if the index holds no backup or one of the chain is gone
+        """
+        chain = index.get_snapshot()
+        if chain is None:
+            return None
+        try:
+            files = [self.storage.find(self.config.parent_id, backup_id) for backup_id in chain]
+        except FileNotFoundError:
+            return None
+        backup = Backup(self.storage, files[0], config=self.config, c=self.c, cache=self.manifest_cache,
+                        catalog=self.catalog)
+        backup.set_files_list(index.entries(), chain)
+        return backup
+
+    def find_latest_backup(self, exclude: str = None, with_files: bool = False):
+        """
+        Finds the newest finished backup in the parent folder, see Backup.has_manifest. No manifest is downloaded
+        unless its files are asked for, so that a restore only fetches the shards of the directories it visits.
+        @param exclude: google drive id of a backup to leave out
+        @param with_files: Whether the backup must have files, leaving out those whose delta manifest lost its
+                           parent, e.g. to write a delta against
+        @return: Backup, or None
+        """
+        for backup in self.list_backups():
+            if backup.id == exclude or not backup.has_manifest():
+                continue
+            if not with_files:
+                return backup
+            try:
+                if backup.get_files_list():
+                    return backup
+            except MissingParentError:
+                continue
+        return None
 
     def list_backups(self):
-        files = self.service.files().list(spaces="appDataFolder", q=f"'{self.config.parent_id}' in parents").execute()['files']
-        return [Backup(self.service, file,config=self.config, c=self.c) for file in files]
+        """
+        Lists the backups of the parent folder, all pages of them. Only folders missing from the catalog have their
+        names decrypted, and no manifest is downloaded until it is needed.
+        @return: List of Backup, newest first
+        """
+        files = self.storage.list(self.config.parent_id)
+        self.catalog.prune(self.config.parent_id, (file.get("id") for file in files))
+        backups = [Backup(self.storage, file, config=self.config, c=self.c, cache=self.manifest_cache,
+                          catalog=self.catalog) for file in files]
+        return sorted(backups, key=lambda backup: backup.time or 0, reverse=True)
+
+    def load_stats(self, backups: list, jobs: int = DEFAULT_JOBS):
+        """
+        Reads the stats of backups which are not in the catalog yet, downloading their manifests concurrently. A
+        backup whose manifest fails to download is left without stats.
+        @param backups: List of Backup
+        @param jobs: Number of manifests to download at once
+        """
+        def load(backup: Backup):
+            try:
+                backup.get_stats()
+            except (HttpError, TransportError, OSError, ValueError, IntegrityError):
+                pass
+
+        missing = [backup for backup in backups if backup.get_cached_stats() is None]
+        # Folders are listed at once, in batches on Drive, so that only the manifests themselves take a request each
+        children = self.storage.list_many([backup.id for backup in missing if backup.names is None])
+        for backup in missing:
+            if backup.id in children:
+                backup.set_children(children[backup.id])
+        if missing:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(load, missing))
@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+from threading import Lock, Event
+
+from sbs.sha import digest, LEGACY_ALGORITHM
+
+
+def stat_key(st: os.stat_result) -> tuple:
+    """
+    Part of a stat result which tells whether a file changed since it was last backed up
+    @param st: stat result
+    @return: (inode, size, mtime_ns, ctime_ns)
+    """
+    return st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+
+class StatIndex:
+    def __init__(self, db_path, root: str):
+        """
+        Local index of files backed up from a root directory, keyed by path. It remembers the stat of each file
+        at the time it was uploaded together with its manifest entry, so that unchanged files can be found
+        with a stat call and no manifest download.
+        @param db_path: Path of SQLite database
+        @param root: Absolute path of backed up directory
+        """
+        db_path = str(db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.root = root
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                inode INTEGER,
+                size INTEGER,
+                mtime_ns INTEGER,
+                ctime_ns INTEGER,
+                digest TEXT,
+                pieces TEXT,
+                total_size INTEGER,
+                uploaded REAL,
+                PRIMARY KEY (root, path)
+            )
+        """)
+        if "digest_algorithm" not in [row[1] for row in self.db.execute("PRAGMA table_info(files)")]:
+            # Index of an older version, whose digests are all of the legacy algorithm
+            self.db.execute("ALTER TABLE files ADD COLUMN digest_algorithm TEXT")
+        # Backup whose files the index holds, see record
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                root TEXT PRIMARY KEY,
+                chain TEXT
+            )
+        """)
+
+    def lookup(self, path: str, st: os.stat_result):
+        """
+        Finds manifest entry of file if it is unchanged since it was uploaded. A file whose stat changed but whose
+        size did not is hashed, and counts as unchanged when its digest is the same (e.g. touched files).
+        @param path: Path of file relative to root
+        @param st: Current stat of file
+        @return: File map, or None
+        """
+        row = self.db.execute("SELECT inode, size, mtime_ns, ctime_ns, digest, pieces, total_size, uploaded, "
+                              "digest_algorithm FROM files WHERE root = ? AND path = ?", (self.root, path)).fetchone()
+        if row is None:
+            return None
+        if tuple(row[:4]) != stat_key(st):
+            if row[1] != st.st_size or digest(path, row[8] or LEGACY_ALGORITHM) != row[4]:
+                return None
+            self.db.execute("UPDATE files SET inode = ?, size = ?, mtime_ns = ?, ctime_ns = ? "
+                            "WHERE root = ? AND path = ?", stat_key(st) + (self.root, path))
+        return self.entry(path, row[4:])
+
+    @staticmethod
+    def entry(path: str, row: tuple) -> map:
+        """
+        @param row: digest, pieces, total_size, uploaded and digest_algorithm of a file
+        @return: File map
+        """
+        file = {
+            "source": path,
+            "digest": row[0],
+            "pieces": json.loads(row[1]),
+            "uploaded": row[3],
+            "total_size": row[2]
+        }
+        if row[4]:
+            file["digest_algorithm"] = row[4]
+        return file
+
+    def entries(self) -> map:
+        """
+        @return: Map of path to file map of every file of the root, the files of the backup of get_snapshot
+        """
+        return {row[0]: self.entry(row[0], row[1:]) for row in self.db.execute(
+            "SELECT path, digest, pieces, total_size, uploaded, digest_algorithm FROM files WHERE root = ?",
+            (self.root,))}
+
+    def get_snapshot(self):
+        """
+        @return: Chain of manifest (see Backup.chain) of the backup the index was last recorded with, or None
+        """
+        row = self.db.execute("SELECT chain FROM snapshots WHERE root = ?", (self.root,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def record(self, files: list, stats: dict, chain: list = None):
+        """
+        Records manifest entries of files once their manifest is safely uploaded. The files of the root become
+        exactly those of the backup, so that the index may stand for its manifest.
+        @param files: List of file maps
+        @param stats: Map of path to stat key taken before the file was uploaded
+        @param chain: Chain of manifest of backup, see Backup.chain (optional)
+        """
+        self.db.execute("DELETE FROM files WHERE root = ?", (self.root,))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files (root, path, inode, size, mtime_ns, ctime_ns, digest, pieces, total_size, "
+            "uploaded, digest_algorithm) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((self.root, file["source"]) + stats[file["source"]] +
+             (file["digest"], json.dumps(file["pieces"]), file["total_size"], file.get("uploaded"),
+              file.get("digest_algorithm")) for file in files if file["source"] in stats)
+        )
+        if chain is not None and all(file["source"] in stats for file in files):
+            self.db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (self.root, json.dumps(chain)))
+        else:
+            # A delta against files missing from the index would bring them back
+            self.db.execute("DELETE FROM snapshots WHERE root = ?", (self.root,))
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class ChunkStore:
+    def __init__(self, db_path):
+        """
+        Local index of content defined chunks uploaded to any backup, keyed by the SHA-256 of their plain data, so
+        that a chunk is uploaded only once however many files, backups or places in a file it appears in. Chunks are
+        recorded as the piece (bundle id, offset and size) which holds them. Shared by all upload threads, which claim
+        new chunks so that a chunk found by two uploads at once is still uploaded once.
+        @param db_path: Path of SQLite database
+        """
+        db_path = str(db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = Lock()
+        # Digest of chunks being uploaded to the event set once they are stored
+        self.claims = {}
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                digest TEXT PRIMARY KEY,
+                id TEXT,
+                offset INTEGER,
+                size INTEGER
+            )
+        """)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def folder(self, create) -> str:
+        """
+        Folder the bundles holding the chunks (or shards) are uploaded to, apart from any backup, so that deleting a
+        backup leaves the chunks later backups refer to in place. It is created on first use, and chunks recorded before
+        then, which are in the folders of backups, are forgotten.
+        @param create: Function creating the folder, returning its id
+        @return: Id of folder
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'folder'").fetchone()
+            if row is not None:
+                return row[0]
+            folder_id = create()
+            self.db.execute("DELETE FROM chunks")
+            self.db.execute("INSERT INTO meta VALUES ('folder', ?)", (folder_id,))
+            self.db.commit()
+            return folder_id
+
+    def claim(self, chunk_digest: str):
+        """
+        Finds a chunk, or claims it for upload if it is neither stored nor claimed
+        @param chunk_digest: Hex SHA-256 of chunk
+        @return: (piece map, None) if the chunk is stored, (None, event) if another upload claimed it, to be waited
+                 on before claiming again, (None, None) if the caller claimed it and must add or release it
+        """
+        with self.lock:
+            row = self.db.execute("SELECT id, offset, size FROM chunks WHERE digest = ?",
+                                  (chunk_digest,)).fetchone()
+            if row is not None:
+                return {"id": row[0], "size": row[2], "offset": row[1]}, None
+            if chunk_digest in self.claims:
+                return None, self.claims[chunk_digest]
+            self.claims[chunk_digest] = Event()
+            return None, None
+
+    def add(self, chunks: list):
+        """
+        Records uploaded chunks
+        @param chunks: List of (digest, piece map)
+        """
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?)",
+                                ((chunk_digest, piece["id"], piece["offset"], piece["size"])
+                                 for chunk_digest, piece in chunks))
+            self.db.commit()
+        self.release(chunk_digest for chunk_digest, piece in chunks)
+
+    def release(self, chunk_digests):
+        """
+        Gives up claims, waking whoever waits on them
+        @param chunk_digests: Iterable of digests
+        """
+        with self.lock:
+            for chunk_digest in chunk_digests:
+                event = self.claims.pop(chunk_digest, None)
+                if event is not None:
+                    event.set()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,279 @@
+import base64
+import json
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from sbs.values import MANIFEST_FORMAT
+
+MAGIC = b"SBSM"
+PREAMBLE = struct.Struct(">4sBI")
+COLUMN_LENGTH = struct.Struct(">Q")
+# Keys every file map has, stored in columns. Anything else goes to the extra column as JSON.
+FILE_KEYS = {"source", "digest", "pieces", "uploaded", "total_size", "digest_algorithm"}
+PIECE_KEYS = {"id", "size", "offset"}
+
+
+def pack_array(typecode: str, values) -> bytes:
+    a = array(typecode, values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+
+def unpack_array(typecode: str, data: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+def encode_paths(paths: list):
+    """
+    Prefix compresses sorted paths, each stored as the length of the prefix it shares with the path before it and
+    the rest of it
+    @return: (prefix lengths, suffix lengths, suffixes)
+    """
+    prefixes = []
+    lengths = []
+    suffixes = bytearray()
+    previous = ""
+    for path in paths:
+        shared = len(os.path.commonprefix((previous, path)))
+        suffix = path[shared:].encode("UTF-8", "surrogatepass")
+        prefixes.append(shared)
+        lengths.append(len(suffix))
+        suffixes += suffix
+        previous = path
+    return pack_array("I", prefixes), pack_array("I", lengths), bytes(suffixes)
+
+
+def decode_paths(prefixes: bytes, lengths: bytes, suffixes: bytes) -> list:
+    paths = []
+    previous = ""
+    position = 0
+    for shared, length in zip(unpack_array("I", prefixes), unpack_array("I", lengths)):
+        previous = previous[:shared] + suffixes[position:position + length].decode("UTF-8", "surrogatepass")
+        position += length
+        paths.append(previous)
+    return paths
+
+
+def raw_digest(digest):
+    """
+    @return: Raw bytes of base64 digest, or None if it would not come back the same
+    """
+    if not isinstance(digest, str):
+        return None
+    try:
+        raw = base64.b64decode(digest, validate=True)
+    except ValueError:
+        return None
+    if len(raw) > 255 or base64.b64encode(raw).decode("UTF-8") != digest:
+        return None
+    return raw
+
+
+def aggregates(files) -> map:
+    """
+    Stats of a backup, kept in the header of its manifest so they are known without decoding the files
+    @param files: Iterable of file maps
+    @return: Map with file count, total size and total size per top level directory
+    """
+    count = 0
+    total_size = 0
+    dirs = {}
+    for file in files:
+        size = file.get("total_size") or 0
+        count += 1
+        total_size += size
+        parts = file.get("source").split(os.path.sep)
+        if parts[0] == ".":
+            parts.pop(0)
+        top = parts[0] if len(parts) > 1 else "."
+        dirs[top] = dirs.get(top, 0) + size
+    return {"count": count, "total_size": total_size, "dirs": dirs}
+
+
+def encode_manifest(manifest: map, stats: map) -> bytes:
+    """
+    Encodes a manifest in the binary format. After a preamble (magic, format and header length) comes a JSON header
+    with everything but the files and deleted paths, and the stats of the backup. Then comes the zlib compressed
+    body, a series of length prefixed columns: paths sorted and prefix compressed, raw digests, sizes, upload times
+    and pieces, with piece ids looked up in a table so bundle ids are stored once. Since format 2 the columns end
+    with the digest algorithms of files, looked up in a table too, 0 for the legacy algorithm.
+    @param manifest: Manifest map, with files and optionally deleted
+    @param stats: Stats of the whole backup, see aggregates
+    @return: Encoded manifest
+    """
+    files = sorted(manifest.get("files"), key=lambda file: file.get("source"))
+    header = {key: value for key, value in manifest.items() if key not in ("files", "deleted")}
+    header["format"] = MANIFEST_FORMAT
+    header["stats"] = stats
+
+    digest_lengths = []
+    digests = bytearray()
+    total_sizes = []
+    uploaded = []
+    piece_counts = []
+    piece_ids = []
+    piece_sizes = []
+    piece_offsets = []
+    id_table = {}
+    algorithm_ids = []
+    algorithm_table = {}
+    extra_lengths = []
+    extras = bytearray()
+    for file in files:
+        extra = {key: value for key, value in file.items() if key not in FILE_KEYS}
+        raw = raw_digest(file.get("digest"))
+        if raw is None:
+            if "digest" in file:
+                extra["digest"] = file.get("digest")
+            raw = b""
+        digest_lengths.append(len(raw))
+        digests += raw
+        algorithm = file.get("digest_algorithm")
+        if isinstance(algorithm, str) and "\n" not in algorithm and len(algorithm_table) < 255:
+            algorithm_ids.append(algorithm_table.setdefault(algorithm, len(algorithm_table) + 1))
+        else:
+            if "digest_algorithm" in file:
+                extra["digest_algorithm"] = algorithm
+            algorithm_ids.append(0)
+        total_size = file.get("total_size")
+        if not isinstance(total_size, int) or total_size < 0:
+            if "total_size" in file:
+                extra["total_size"] = total_size
+            total_size = -1
+        total_sizes.append(total_size)
+        upload_time = file.get("uploaded")
+        if not isinstance(upload_time, (int, float)):
+            if "uploaded" in file:
+                extra["uploaded"] = upload_time
+            upload_time = math.nan
+        uploaded.append(upload_time)
+        pieces = file.get("pieces")
+        if isinstance(pieces, list) and all(
+                isinstance(piece, dict) and piece.keys() <= PIECE_KEYS and isinstance(piece.get("id"), str) and
+                isinstance(piece.get("size"), int) and isinstance(piece.get("offset", 0), int)
+                for piece in pieces):
+            piece_counts.append(len(pieces))
+            for piece in pieces:
+                piece_ids.append(id_table.setdefault(piece.get("id"), len(id_table)))
+                piece_sizes.append(piece.get("size"))
+                piece_offsets.append(piece["offset"] if "offset" in piece else -1)
+        else:
+            # Pieces of an odd shape, kept as they are
+            if "pieces" in file:
+                extra["pieces"] = pieces
+            piece_counts.append(0)
+        data = json.dumps(extra).encode("UTF-8") if extra else b""
+        extra_lengths.append(len(data))
+        extras += data
+
+    columns = list(encode_paths([file.get("source") for file in files]))
+    columns += [
+        pack_array("B", digest_lengths), bytes(digests),
+        pack_array("q", total_sizes),
+        pack_array("d", uploaded),
+        pack_array("I", piece_counts), pack_array("I", piece_ids), pack_array("q", piece_sizes),
+        pack_array("q", piece_offsets), "\n".join(id_table).encode("UTF-8"),
+        pack_array("I", extra_lengths), bytes(extras)
+    ]
+    columns += encode_paths(sorted(manifest.get("deleted", [])))
+    columns += [pack_array("B", algorithm_ids), "\n".join(algorithm_table).encode("UTF-8")]
+    body = b"".join(COLUMN_LENGTH.pack(len(column)) + column for column in columns)
+    header_data = json.dumps(header).encode("UTF-8")
+    return PREAMBLE.pack(MAGIC, MANIFEST_FORMAT, len(header_data)) + header_data + zlib.compress(body)
+
+
+def is_binary(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def read_header(data: bytes):
+    """
+    Reads the header of a manifest without decoding its files
+    @param data: Decrypted manifest
+    @return: Header map, or None for a JSON manifest
+    """
+    if not is_binary(data):
+        return None
+    _, manifest_format, header_length = PREAMBLE.unpack_from(data)
+    if manifest_format > MANIFEST_FORMAT:
+        raise ValueError("Manifest format {} is newer than this version supports".format(manifest_format))
+    return json.loads(data[PREAMBLE.size:PREAMBLE.size + header_length].decode("UTF-8"))
+
+
+def decode_manifest(data: bytes) -> map:
+    """
+    Decodes a manifest, binary or JSON
+    @param data: Decrypted manifest
+    @return: Manifest map with files, a list of file maps, and for a delta manifest parent, depth and deleted
+    """
+    header = read_header(data)
+    if header is None:
+        return json.loads(data.decode("UTF-8"))
+    _, _, header_length = PREAMBLE.unpack_from(data)
+    body = zlib.decompress(data[PREAMBLE.size + header_length:])
+    columns = []
+    position = 0
+    while position < len(body):
+        length, = COLUMN_LENGTH.unpack_from(body, position)
+        position += COLUMN_LENGTH.size
+        columns.append(body[position:position + length])
+        position += length
+    (prefixes, lengths, suffixes, digest_lengths, digests, total_sizes, uploaded, piece_counts, piece_ids,
+     piece_sizes, piece_offsets, id_table, extra_lengths, extras, deleted_prefixes, deleted_lengths,
+     deleted_suffixes) = columns[:17]
+    algorithms = [None] * len(unpack_array("I", piece_counts))
+    if len(columns) > 17:
+        table = [None] + columns[18].decode("UTF-8").split("\n")
+        algorithms = [table[i] for i in unpack_array("B", columns[17])]
+
+    ids = id_table.decode("UTF-8").split("\n")
+    piece_ids = unpack_array("I", piece_ids)
+    piece_sizes = unpack_array("q", piece_sizes)
+    piece_offsets = unpack_array("q", piece_offsets)
+    b64encode = base64.b64encode
+    files = []
+    digest_position = 0
+    extra_position = 0
+    piece_position = 0
+    for source, digest_length, total_size, upload_time, piece_count, extra_length, algorithm in zip(
+            decode_paths(prefixes, lengths, suffixes), unpack_array("B", digest_lengths),
+            unpack_array("q", total_sizes), unpack_array("d", uploaded), unpack_array("I", piece_counts),
+            unpack_array("I", extra_lengths), algorithms):
+        file = {"source": source}
+        if digest_length:
+            file["digest"] = b64encode(digests[digest_position:digest_position + digest_length]).decode("UTF-8")
+            digest_position += digest_length
+        if algorithm:
+            file["digest_algorithm"] = algorithm
+        pieces = []
+        for i in range(piece_position, piece_position + piece_count):
+            piece = {"id": ids[piece_ids[i]], "size": piece_sizes[i]}
+            if piece_offsets[i] >= 0:
+                piece["offset"] = piece_offsets[i]
+            pieces.append(piece)
+        piece_position += piece_count
+        file["pieces"] = pieces
+        if not math.isnan(upload_time):
+            file["uploaded"] = upload_time
+        if total_size >= 0:
+            file["total_size"] = total_size
+        if extra_length:
+            file.update(json.loads(extras[extra_position:extra_position + extra_length].decode("UTF-8")))
+            extra_position += extra_length
+        files.append(file)
+
+    manifest = {key: value for key, value in header.items() if key not in ("format", "stats")}
+    manifest["files"] = files
+    deleted = decode_paths(deleted_prefixes, deleted_lengths, deleted_suffixes)
+    if deleted or "parent" in manifest:
+        manifest["deleted"] = deleted
+    return manifest
@@ -2,15 +2,18 @@ from sbs.file import File
 from sbs.colors import *
 from sbs.file_manager import *
 from sbs.backup import *
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 class Navigator:
-    def __init__(self, key_file: str, config):
+    def __init__(self, key_file: str, config, jobs=DEFAULT_JOBS):
         """
         Class to allow navigation of backup in the event of a partial or full restore
         @param key_file: Path to AES key file
+        @param jobs: Number of files to download concurrently when restoring a directory, to start with
         """
         self.fm = FileManager(key_file=key_file,config=config)
+        self.jobs = jobs
 
     def navigate(self, bu: Backup, file_tree=None, restoration_path=None):
         """
@@ -20,8 +23,13 @@ class Navigator:
         @param restoration_path: path to restore to
         """
         if file_tree is None:
-            file_list = bu.get_files_list()
-            file_tree = File.from_path_list([f for f in file_list.keys()])
+            root = bu.get_shard_root()
+            if root is not None:
+                # Only the shards of directories visited are downloaded
+                file_tree = File(True, None, ".", loader=partial(self.load_shard, root))
+            else:
+                file_list = bu.get_files_list()
+                file_tree = File.from_path_list([f for f in file_list.keys()])
         misc_options = [
             "Download whole directory {}".format(color(file_tree.get_full_path(), CYAN)),
             "{} {}".format(color("<--", WARNING), color(file_tree.parent.name, CYAN)) if file_tree.parent else None
@@ -62,7 +70,7 @@ class Navigator:
                 self.navigate(bu, file_tree=child, restoration_path=restoration_path)
             else:
 
-                f = bu.get_files_list().get(child.get_full_path())
+                f = self.get_entry(bu, child)
                 if restoration_path:
                     self.fm.download_file(f, path=child.name, restoration_path=restoration_path)
                 else:
@@ -72,22 +80,117 @@ class Navigator:
         elif i == option_whole_dir:
             self.download_whole_dir(bu, file_tree, restoration_path=restoration_path)
 
-    def download_whole_dir(self, bu: Backup, file_tree: File, restoration_path=None, bar=None):
-        close_bar=False
-        if bar is None:
-            size = self.get_sizes_of_dir(bu, file_tree)
+    def download_whole_dir(self, bu: Backup, file_tree: File, restoration_path=None):
+        """
+        Restores every file in directory concurrently. A file which fails does not stop the others, failures are
+        reported once all files are done.
+        @param bu: Backup obj
+        @param file_tree: Directory to restore
+        @param restoration_path: path to restore to
+        @return: List of (path, exception) for each file which failed
+        """
+        files = self.get_entries(bu, file_tree)
+        bar = tqdm(total=sum(file.get("total_size") for file in files), unit_scale=True, unit="B",
+                   dynamic_ncols=True)
 
-            bar = tqdm(total=size, unit_scale=True, unit="B", dynamic_ncols=True)
-            close_bar=True
-        for child in file_tree.children:
-            if child.is_dir:
-                self.download_whole_dir(bu, child, restoration_path=restoration_path, bar=bar)
+        # Packed files of the same bundle are restored together, see restore_files
+        tasks = []
+        bundled = {}
+        for file in files:
+            pieces = file.get("pieces")
+            if len(pieces) == 1 and pieces[0].get("offset") is not None:
+                bundled.setdefault(pieces[0].get("id"), []).append(file)
             else:
+                tasks.append(([file], None))
+        for bundle_id, members in bundled.items():
+            tasks.append((members, bundle_id))
+
+        errors = []
+        self.fm.limiter.reset(self.jobs)
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs, self.fm.limiter.max_limit)) as executor:
+            futures = [executor.submit(self.restore_files, task_files, restoration_path, bar, bundle_id=bundle_id)
+                       for task_files, bundle_id in tasks]
+            for future in as_completed(futures):
+                errors += future.result()
+        bar.close()
+        if errors:
+            print(color("{} of {} files failed to restore".format(len(errors), len(files)), FAIL))
+            for path, e in errors:
+                print("{}: {}".format(color(path, CYAN), e))
+        return errors
 
-                self.fm.download_file(bu.get_files_list().get(child.get_full_path()), bar=bar,
-                                      restoration_path=restoration_path)
-        if close_bar:
-            bar.close()
+    def restore_files(self, files: list, restoration_path, bar, bundle_id=None):
+        """
+        Restores files one after another. Files packed in the same bundle are restored from one fetch of the whole
+        bundle when they make up a good part of it, otherwise with a ranged read each.
+        @param files: List of file maps
+        @param restoration_path: path to restore to
+        @param bar: Progress bar
+        @param bundle_id: Id of the bundle all files are packed in, if they are
+        @return: List of (path, exception) for each file which failed
+        """
+        errors = []
+        bundles = None
+        if bundle_id is not None and len(files) > 1:
+            needed = sum(file.get("pieces")[0].get("size") for file in files)
+            known_end = max(file.get("pieces")[0].get("offset") + file.get("pieces")[0].get("size") for file in files)
+            if needed * 4 >= known_end:
+                try:
+                    bundles = {bundle_id: self.fm.fetch_bundle(bundle_id)}
+                except Exception as e:
+                    bar.write(color("Failed to fetch bundle: {}".format(e), FAIL))
+        for file in files:
+            try:
+                self.fm.download_file(file, restoration_path, bar=bar, bundles=bundles)
+            except Exception as e:
+                errors.append((file.get("source"), e))
+                bar.write(color("Failed to restore {}: {}".format(file.get("source"), e), FAIL))
+        return errors
+
+    def load_shard(self, piece: map, directory: File):
+        """
+        Adds the children of a directory from its shard, see FileManager.upload_shards
+        @param piece: Piece of shard of directory
+        @param directory: Directory
+        """
+        shard = self.fm.read_shard(piece)
+        for name, child in sorted(shard.get("dirs").items()):
+            directory.children.append(File(True, directory, name, loader=partial(self.load_shard, child)))
+        for file in shard.get("files"):
+            directory.children.append(File(False, directory, os.path.basename(file.get("source")), entry=file))
+
+    def get_entry(self, bu: Backup, file: File):
+        """
+        @param bu: Backup obj
+        @param file: File
+        @return: Manifest entry of file
+        """
+        if file.entry is not None:
+            return file.entry
+        return bu.get_files_list().get(file.get_full_path())
+
+    def get_entries(self, bu: Backup, file_tree: File):
+        """
+        Manifest entries of all files under directory. Directories are walked a level at a time, the shards of each
+        level being downloaded concurrently.
+        @param bu: Backup obj
+        @param file_tree: Directory
+        @return: List of file maps
+        """
+        entries = []
+        level = [file_tree]
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            while level:
+                list(executor.map(lambda directory: directory.children, level))
+                next_level = []
+                for directory in level:
+                    for child in directory.children:
+                        if child.is_dir:
+                            next_level.append(child)
+                        else:
+                            entries.append(self.get_entry(bu, child))
+                level = next_level
+        return entries
 
     def get_sizes_of_dir(self, bu: Backup, file_tree: File):
         total_size = 0
@@ -95,6 +198,6 @@ class Navigator:
             if child.is_dir:
                 total_size += self.get_sizes_of_dir(bu, child)
             else:
-                file_resource = bu.get_files_list().get(child.get_full_path())
+                file_resource = self.get_entry(bu, child)
                 total_size += file_resource.get("total_size")
         return total_size
@@ -0,0 +1,66 @@
+import base64
+
+from sbs.sha import new_hash
+from sbs.stoof import Cryptologor
+
+
+class Packer:
+    def __init__(self, c: Cryptologor, target_size: int, digest_algorithm: str = None):
+        """
+        Packs small files into bundles, so that many files are uploaded as one Drive object. Each file is encrypted
+        on its own and the ciphers are concatenated, so any file of a bundle can be restored from a ranged read of
+        it. In the manifest the file gets a single piece with the id of the bundle, and the offset and size of its
+        cipher within it.
+        @param c: Cryptologor
+        @param target_size: Size from which a bundle is considered full
+        @param digest_algorithm: Algorithm of the digests of files added, see sha.new_hash
+        """
+        self.c = c
+        self.digest_algorithm = digest_algorithm
+        self.target_size = target_size
+        self.buffer = bytearray()
+        self.members = []
+        self.count = 0
+
+    def add(self, path: str):
+        """
+        Adds file to the current bundle
+        @param path: Path of file
+        @return: Full bundle as returned by flush, or None if the bundle is not yet full
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        sha = new_hash(self.digest_algorithm)
+        sha.update(data)
+        return self.add_data(data, source=path, digest=base64.b64encode(sha.digest()).decode("UTF-8"))
+
+    def add_data(self, data: bytes, **info):
+        """
+        Adds data to the current bundle
+        @param data: Plain data
+        @param info: Kept in the member map of the data
+        @return: Full bundle as returned by flush, or None if the bundle is not yet full
+        """
+        cipher = self.c.encrypt(data)
+        member = dict(info)
+        member["offset"] = len(self.buffer)
+        member["size"] = len(cipher)
+        self.members.append(member)
+        self.buffer += cipher
+        if len(self.buffer) >= self.target_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Closes the current bundle
+        @return: (index of bundle, data of bundle, list of member maps with offset, size and the info they were added
+                 with), or None if the bundle is empty
+        """
+        if not self.members:
+            return None
+        bundle = (self.count, bytes(self.buffer), self.members)
+        self.count += 1
+        self.buffer = bytearray()
+        self.members = []
+        return bundle
@@ -0,0 +1,105 @@
+from queue import Queue, Full, Empty
+from threading import Thread, Event
+
+# Marks the end of the items of a stage
+END = object()
+# Seconds between checks of whether the pipeline was closed, while a stage waits on a queue
+POLL_INTERVAL = 0.1
+
+
+class StageError:
+    def __init__(self, error: BaseException):
+        """
+        Error raised in a stage, handed down the pipeline in place of an item and raised by get
+        """
+        self.error = error
+
+
+class Pipeline:
+    def __init__(self, stages: list, depth: int):
+        """
+        Runs stages on threads of their own, connected by bounded queues: the first stage is an iterable of items,
+        each later one a function applied to the items of the stage before, in order. A stage waits while the queue
+        after it is full, so no stage runs more than depth items ahead of the next, down to the consumer calling get.
+        @param stages: Iterable, followed by functions
+        @param depth: Size of queues between stages
+        """
+        self.stopped = Event()
+        # END or StageError once taken out of the last queue, returned again on later calls of get
+        self.last = None
+        self.queues = [Queue(maxsize=depth) for _ in stages]
+        self.threads = [Thread(target=self.run_source, args=(stages[0], self.queues[0]), daemon=True)]
+        for func, inbox, outbox in zip(stages[1:], self.queues, self.queues[1:]):
+            self.threads.append(Thread(target=self.run_stage, args=(func, inbox, outbox), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, queue: Queue, item) -> bool:
+        """
+        Puts item in queue, waiting while it is full
+        @return: Whether the item was put, False if the pipeline was closed meanwhile
+        """
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def take(self, queue: Queue):
+        """
+        @return: Next item of queue, or END if the pipeline was closed meanwhile
+        """
+        while not self.stopped.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                pass
+        return END
+
+    def run_source(self, source, outbox: Queue):
+        try:
+            for item in source:
+                if not self.put(outbox, item):
+                    return
+        except BaseException as e:
+            self.put(outbox, StageError(e))
+            return
+        self.put(outbox, END)
+
+    def run_stage(self, func, inbox: Queue, outbox: Queue):
+        while True:
+            item = self.take(inbox)
+            if item is END or isinstance(item, StageError):
+                self.put(outbox, item)
+                return
+            try:
+                item = func(item)
+            except BaseException as e:
+                self.put(outbox, StageError(e))
+                return
+            if not self.put(outbox, item):
+                return
+
+    def get(self):
+        """
+        @return: Next item out of the last stage
+        @raise EOFError: if all items were taken
+        """
+        item = self.last or self.queues[-1].get()
+        if item is END or isinstance(item, StageError):
+            self.last = item
+        if isinstance(item, StageError):
+            raise item.error
+        if item is END:
+            raise EOFError("Pipeline is exhausted")
+        return item
+
+    def close(self):
+        """
+        Stops all stages, and waits for their threads to end
+        """
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
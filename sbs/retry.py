@@ -0,0 +1,177 @@
+import email.utils
+import json
+import random
+import socket
+import ssl
+import time
+
+import httplib2
+from google.auth.exceptions import TransportError, RefreshError
+from googleapiclient.errors import HttpError
+
+from sbs.values import RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_MAX_ATTEMPTS, RETRY_DEADLINE
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Reasons for which Drive answers 403 when the request may succeed later
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "sharingRateLimitExceeded"}
+RETRYABLE_REASONS = RATE_LIMIT_REASONS | {"backendError"}
+# Errors of the connection rather than of the request
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, ssl.SSLError,
+                    httplib2.HttpLib2Error, TransportError)
+
+
+def error_reasons(content: bytes) -> set:
+    """
+    @param content: Body of an error response
+    @return: Reasons given in it
+    """
+    try:
+        error = json.loads(content.decode("UTF-8")).get("error", {})
+    except (ValueError, AttributeError):
+        return set()
+    if not isinstance(error, dict):
+        return set()
+    return {item.get("reason") for item in error.get("errors", []) if isinstance(item, dict)}
+
+
+def is_throttling(status: int, content: bytes) -> bool:
+    """
+    Whether a response tells that requests are made too fast
+    @param status: Status of response
+    @param content: Body of response
+    """
+    return status == 429 or (status == 403 and bool(error_reasons(content) & RATE_LIMIT_REASONS))
+
+
+def retry_after(e: HttpError):
+    """
+    @return: Seconds to wait as asked by the Retry-After header of an HttpError, or None
+    """
+    value = e.resp.get("retry-after") if e.resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(e: BaseException) -> bool:
+    """
+    Whether a failed Drive call may succeed if made again: server errors, rate limits and connection trouble. Other
+    client errors, failed authentication and local errors are fatal.
+    """
+    if isinstance(e, HttpError):
+        status = e.resp.status if e.resp is not None else None
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status == 403 and bool(error_reasons(e.content) & RETRYABLE_REASONS)
+    if isinstance(e, RefreshError):
+        return False
+    return isinstance(e, RETRYABLE_ERRORS)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = RETRY_MAX_ATTEMPTS, deadline: float = RETRY_DEADLINE,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        """
+        How Drive calls are retried. The wait before attempt n is drawn at random between 0 and
+        min(max_delay, base_delay * 2 ** n) (full jitter), so that workers which failed together do not all come back
+        at once. A Retry-After header is waited out instead.
+        @param max_attempts: Attempts made without progress before giving up
+        @param deadline: Seconds without progress after which no more attempts are made
+        @param base_delay: Wait in seconds before the first retry, at most
+        @param max_delay: Longest wait in seconds between two attempts
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def from_config(config):
+        return RetryPolicy(max_attempts=getattr(config, "retry_max_attempts", None) or RETRY_MAX_ATTEMPTS,
+                           deadline=getattr(config, "retry_deadline", None) or RETRY_DEADLINE)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class Retrier:
+    def __init__(self, policy: RetryPolicy = None, log=None):
+        """
+        Attempts of one operation under a retry policy. Operations made of many calls, such as the chunks of an
+        upload, report each success, so that only failures in a row count towards the limits.
+        @param policy: Retry policy
+        @param log: Function given a message on each retry, e.g. the write of a tqdm bar
+        """
+        self.policy = policy or RetryPolicy()
+        self.log = log
+        self.succeeded()
+
+    def succeeded(self):
+        self.attempts = 0
+        self.started = time.monotonic()
+
+    def failed(self, e: BaseException, retryable: bool = None):
+        """
+        Waits before the next attempt, or raises e if it is fatal or the limits are reached
+        @param e: Error of the attempt
+        @param retryable: Whether e is worth another attempt, for callers which know better than is_retryable
+        """
+        time.sleep(self.next_delay(e, retryable))
+
+    def next_delay(self, e: BaseException, retryable: bool = None) -> float:
+        """
+        Counts a failed attempt without waiting, for callers which wait for many attempts at once
+        @param e: Error of the attempt
+        @param retryable: See failed
+        @return: Seconds to wait before the next attempt
+        @raise e: if it is fatal or the limits are reached
+        """
+        self.attempts += 1
+        if retryable is None:
+            retryable = is_retryable(e)
+        if not retryable or self.attempts >= self.policy.max_attempts:
+            raise e
+        delay = retry_after(e) if isinstance(e, HttpError) else None
+        if delay is None:
+            delay = self.policy.backoff(self.attempts)
+        if time.monotonic() - self.started + delay > self.policy.deadline:
+            raise e
+        if self.log is not None:
+            self.log("{}, retrying in {:.1f} seconds".format(describe(e), delay))
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func until it succeeds
+        @return: What func returns
+        """
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self.failed(e)
+            else:
+                self.succeeded()
+                return result
+
+
+def describe(e: BaseException) -> str:
+    if isinstance(e, HttpError) and e.resp is not None:
+        return "Drive answered {}".format(e.resp.status)
+    return "Connection trouble ({})".format(type(e).__name__)
+
+
+def execute(request, policy: RetryPolicy = None, log=None):
+    """
+    Executes a Drive API request, retrying under the policy
+    @param request: HttpRequest
+    @return: Response of request
+    """
+    return Retrier(policy, log=log).call(request.execute)
@@ -0,0 +1,66 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sbs.values import DEFAULT_JOBS
+
+
+def scan_dir(path: str, shuffle: bool = False, exclude_file=None):
+    """
+    Lists one directory. Uses the stat results of the DirEntry objects, so that only one stat call is made per file
+    and none are made to tell files from directories.
+    @param path: Path of directory
+    @param shuffle: Whether to shuffle the files of the directory
+    @param exclude_file: Function given a file path and stat, returning True if the file should be left out
+    @return: List of (path, stat) of files, list of paths of sub directories
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    # Like os.walk, do not descend into symbolic links to directories
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        if exclude_file is None or not exclude_file(entry.path, st):
+                            files.append((entry.path, st))
+                except OSError:
+                    # Vanished, or a broken link
+                    continue
+    except OSError:
+        return files, dirs
+    if shuffle:
+        random.shuffle(files)
+    return files, dirs
+
+
+def scan_tree(root: str = ".", jobs: int = DEFAULT_JOBS, exclude_dir=None, exclude_file=None, shuffle: bool = False):
+    """
+    Generator of all files under root. Directories are listed concurrently, and the files of each are yielded as
+    soon as it is listed, so that whoever consumes them can start before the whole tree is scanned.
+    @param root: Directory to scan
+    @param jobs: Number of directories listed concurrently
+    @param exclude_dir: Function given a directory path, returning True if it should not be scanned
+    @param exclude_file: Function given a file path and stat, returning True if the file should be left out
+    @param shuffle: Whether to shuffle the files of each directory
+    @return: Generator of (path, stat)
+    """
+    if exclude_dir is not None and exclude_dir(root):
+        return
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        pending = {executor.submit(scan_dir, root, shuffle, exclude_file)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, dirs = future.result()
+                    for path in dirs:
+                        if exclude_dir is None or not exclude_dir(path):
+                            pending.add(executor.submit(scan_dir, path, shuffle, exclude_file))
+                    yield from files
+        finally:
+            for future in pending:
+                future.cancel()
@@ -2,16 +2,22 @@ from __future__ import print_function
 
 import os.path
 import pickle
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-import google.auth.transport.requests as requests
+import uuid
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
 
-import pkg_resources
+from threading import Lock, current_thread
 
 from sbs.config import *
+from sbs.throttle import AdaptiveLimiter, ThrottledHttp
 
 creds = None
 
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+# Parsed once per process, see get_discovery_document
+discovery_document = None
+discovery_lock = Lock()
 
 
 # The file token.pickle stores the user's access and refresh tokens, and is
@@ -19,9 +25,16 @@ creds = None
 # time.
 
 # If modifying these scopes, delete the file token.pickle.
-def get_service(config: Config):
+def get_credentials(config: Config):
+    """
+    Loads the stored Google credentials, refreshing them or running the authorization flow when needed.
+    @param config: Config holding the credentials directory
+    @return: Google credentials
+    """
     SCOPES = ["https://www.googleapis.com/auth/drive.appdata",
               "https://www.googleapis.com/auth/drive.file"]
+    # Only needed to refresh or authorize, and slow to import
+    import google.auth.transport.requests as requests
     token_file = os.path.join(config.credentials_dir, "token.pickle")
     if os.path.exists(token_file):
         with open(token_file, 'rb') as token:
@@ -33,6 +46,8 @@ def get_service(config: Config):
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(requests.Request())
         else:
+            import pkg_resources
+            from google_auth_oauthlib.flow import InstalledAppFlow
             stream: TextIO = pkg_resources.resource_stream(__name__, 'credentials.json')
             client_config = json.loads(stream.read())
             flow = InstalledAppFlow.from_client_config(
@@ -44,4 +59,126 @@ def get_service(config: Config):
         with open(token_file, 'wb') as token:
             pickle.dump(creds, token)
 
-    return build('drive', 'v3', credentials=creds)
+    return creds
+
+
+def get_discovery_document() -> map:
+    """
+    Discovery document of the Drive API, which services are built from. It is the copy bundled with googleapiclient,
+    or for versions without one a copy cached under the application data directory, downloaded the first time only,
+    so that building a service makes no request.
+    @return: Discovery document, shared by all services
+    """
+    global discovery_document
+    with discovery_lock:
+        if discovery_document is None:
+            data = None
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                data = get_static_doc("drive", "v3")
+            except ImportError:
+                pass
+            if data is None:
+                path = get_data_dir() / "cache" / "drive_v3.json"
+                try:
+                    with open(path) as f:
+                        data = f.read()
+                    json.loads(data)
+                except (FileNotFoundError, ValueError):
+                    response, content = build_http().request(DISCOVERY_URL)
+                    if response.status >= 300:
+                        raise ConnectionError("Drive discovery document unavailable ({})".format(response.status))
+                    data = content.decode("UTF-8")
+                    os.makedirs(path.parent, exist_ok=True)
+                    # Written aside and renamed, so that other processes never read half a document
+                    temporary_path = path.parent / ".{}.tmp".format(uuid.uuid4().hex)
+                    with open(temporary_path, "w") as f:
+                        f.write(data)
+                    os.replace(temporary_path, path)
+            discovery_document = json.loads(data)
+        return discovery_document
+
+
+def build_service(creds, limiter: AdaptiveLimiter = None):
+    """
+    Builds a Drive service on its own http connection, services must not be shared between threads.
+    @param creds: Google credentials from get_credentials
+    @param limiter: Limiter to make requests under (optional)
+    @return: Drive service
+    """
+    http = AuthorizedHttp(creds, http=build_http())
+    if limiter is not None:
+        http = ThrottledHttp(http, limiter)
+    return build_from_document(get_discovery_document(), http=http)
+
+
+class SharedCredentials:
+    def __init__(self, creds):
+        """
+        Google credentials shared by the http connections of all threads. Expired credentials are refreshed by one
+        thread while the others wait for it, rather than by every thread which finds them expired.
+        @param creds: Google credentials from get_credentials
+        """
+        self.creds = creds
+        self.lock = Lock()
+
+    def before_request(self, request, method, url, headers):
+        # Taken before the check, as another thread may refresh them in between
+        token = self.creds.token
+        if not self.creds.valid:
+            self.refresh(request, token)
+        self.creds.apply(headers)
+
+    def refresh(self, request, token=None):
+        """
+        Refreshes the credentials unless another thread did since they were found expired
+        @param token: Token the credentials had when found expired, by default the one they have now
+        """
+        if token is None:
+            token = self.creds.token
+        with self.lock:
+            # Another thread may have refreshed them while this one waited
+            if self.creds.token == token:
+                self.creds.refresh(request)
+
+    def __getattr__(self, name):
+        return getattr(self.creds, name)
+
+
+class ServicePool:
+    def __init__(self, creds, limiter: AdaptiveLimiter = None):
+        """
+        Drive services of the threads of a FileManager, one per thread as they must not be shared. The service of a
+        thread which ended goes to the next thread which needs one, so that its http connections, kept alive, are
+        reused rather than opened again with a new TLS handshake.
+        @param creds: Google credentials from get_credentials
+        @param limiter: Limiter to make requests under (optional)
+        """
+        self.creds = SharedCredentials(creds)
+        self.limiter = limiter
+        self.lock = Lock()
+        # Thread to its service
+        self.owners = {}
+        self.idle = []
+
+    def get(self):
+        """
+        @return: Drive service of the calling thread
+        """
+        thread = current_thread()
+        with self.lock:
+            service = self.owners.get(thread)
+            if service is not None:
+                return service
+            for owner in [owner for owner in self.owners if not owner.is_alive()]:
+                self.idle.append(self.owners.pop(owner))
+            service = self.idle.pop() if self.idle else None
+        if service is None:
+            service = build_service(self.creds, self.limiter)
+        with self.lock:
+            self.owners[thread] = service
+        return service
+
+
+def get_service(config: Config):
+    return build_service(get_credentials(config))
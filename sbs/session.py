@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+from threading import Lock
+
+from sbs.index import stat_key
+
+
+class SessionJournal:
+    def __init__(self, db_path):
+        """
+        Local journal of the backup in progress, so that a backup which is killed can be resumed in the same backup
+        folder without uploading again what was already uploaded. It records the manifest entry of every file once
+        it is uploaded, and for large files every piece, with the header and resumable upload URI of the piece being
+        sent, so that even a partly sent piece is resumed where Drive left it. Entries only count while the stat of
+        the file is the same as when it was uploaded. Shared by all upload threads.
+        @param db_path: Path of SQLite database
+        """
+        db_path = str(db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = Lock()
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS session (
+                root TEXT,
+                folder_id TEXT,
+                checkpoint_id TEXT
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                inode INTEGER,
+                size INTEGER,
+                mtime_ns INTEGER,
+                ctime_ns INTEGER,
+                entry TEXT
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pieces (
+                path TEXT,
+                piece_index INTEGER,
+                inode INTEGER,
+                size INTEGER,
+                mtime_ns INTEGER,
+                ctime_ns INTEGER,
+                header BLOB,
+                uri TEXT,
+                piece TEXT,
+                PRIMARY KEY (path, piece_index)
+            )
+        """)
+        if "iv" in [row[1] for row in self.db.execute("PRAGMA table_info(pieces)")]:
+            # Journal of an older version, which named the header after the IV of the legacy format
+            self.db.execute("ALTER TABLE pieces RENAME COLUMN iv TO header")
+
+    def get_session(self, root: str):
+        """
+        @param root: Absolute path of backed up directory
+        @return: (folder id, id of last checkpoint manifest) of the interrupted backup of root, or None
+        """
+        with self.lock:
+            row = self.db.execute("SELECT folder_id, checkpoint_id FROM session WHERE root = ?", (root,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def start(self, root: str, folder_id: str):
+        """
+        Starts a new session, forgetting any earlier one
+        @param root: Absolute path of backed up directory
+        @param folder_id: google drive id of backup folder
+        """
+        with self.lock:
+            self.clear()
+            self.db.execute("INSERT INTO session VALUES (?, ?, NULL)", (root, folder_id))
+            self.db.commit()
+
+    def set_checkpoint(self, checkpoint_id: str):
+        with self.lock:
+            self.db.execute("UPDATE session SET checkpoint_id = ?", (checkpoint_id,))
+            self.db.commit()
+
+    def finish(self):
+        """
+        Forgets the session, once the manifest of the backup is uploaded
+        """
+        with self.lock:
+            self.clear()
+            self.db.commit()
+
+    def clear(self):
+        self.db.execute("DELETE FROM session")
+        self.db.execute("DELETE FROM files")
+        self.db.execute("DELETE FROM pieces")
+
+    def lookup(self, path: str, st: os.stat_result):
+        """
+        @param path: Path of file
+        @param st: Current stat of file
+        @return: File map of file if it was uploaded in this session and is unchanged since, or None
+        """
+        with self.lock:
+            row = self.db.execute("SELECT entry FROM files WHERE path = ? AND inode = ? AND size = ? AND "
+                                  "mtime_ns = ? AND ctime_ns = ?", (path,) + stat_key(st)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def add_files(self, files: list, stats: dict):
+        """
+        Records uploaded files, forgetting their pieces
+        @param files: List of file maps
+        @param stats: Map of path to stat key taken before the file was uploaded
+        """
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                ((file["source"],) + stats[file["source"]] + (json.dumps(file),) for file in files))
+            self.db.executemany("DELETE FROM pieces WHERE path = ?", ((file["source"],) for file in files))
+            self.db.commit()
+
+    def get_pieces(self, path: str, key: tuple):
+        """
+        @param path: Path of file
+        @param key: Current stat key of file
+        @return: Map of index to (header, resumable upload URI, piece map or None if the piece is not fully uploaded) of
+                 the pieces of the file recorded while its stat key was the same
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT piece_index, header, uri, piece FROM pieces WHERE path = ? AND "
+                                   "inode = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ?", (path,) + key).fetchall()
+        return {index: (header, uri, json.loads(piece) if piece else None) for index, header, uri, piece in rows}
+
+    def start_piece(self, path: str, index: int, key: tuple, header: bytes, uri: str):
+        """
+        Records the resumable upload of a piece, once Drive gave it a URI
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pieces VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                            (path, index) + key + (header, uri))
+            self.db.commit()
+
+    def finish_piece(self, path: str, index: int, key: tuple, piece: map):
+        """
+        Records a fully uploaded piece
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pieces VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?)",
+                            (path, index) + key + (json.dumps(piece),))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,13 +1,105 @@
-from Cryptodome.Hash import SHA256
+import hashlib
 import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sbs.values import DIGEST_ALGORITHM, DIGEST_LEAF_SIZE
 
 BUFFER_SIZE = 1000 ** 2
+TREE_SUFFIX = "-tree"
+# Algorithm of manifest entries which do not name theirs, as made before digests were configurable
+LEGACY_ALGORITHM = "sha256"
+# Digest functions content digests may be made with, each also as a tree hash
+HASHES = {
+    "sha256": hashlib.sha256,
+    "blake2b": lambda data=b"": hashlib.blake2b(data, digest_size=32),
+}
+
+
+class TreeHash:
+    def __init__(self, hash_function):
+        """
+        Hash of data cut into leaves of DIGEST_LEAF_SIZE bytes: the digest of the digests of the leaves, each
+        prefixed so a leaf can never pass for a root. Leaves may be hashed in any order and at once, see digest.
+        Streamed with update like the objects of hashlib.
+        @param hash_function: Function returning a new hash object, from HASHES
+        """
+        self.hash_function = hash_function
+        self.leaves = []
+        self.leaf = hash_function(b"\0")
+        self.leaf_length = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            take = min(len(data), DIGEST_LEAF_SIZE - self.leaf_length)
+            self.leaf.update(data[:take])
+            self.leaf_length += take
+            data = data[take:]
+            if self.leaf_length == DIGEST_LEAF_SIZE:
+                self.add_leaf(self.leaf.digest())
+                self.leaf = self.hash_function(b"\0")
+                self.leaf_length = 0
+
+    def add_leaf(self, leaf_digest: bytes):
+        self.leaves.append(leaf_digest)
+
+    def digest(self) -> bytes:
+        leaves = list(self.leaves)
+        if self.leaf_length or not leaves:
+            # Last partial leaf, or the one empty leaf of empty data
+            leaves.append(self.leaf.digest())
+        return self.hash_function(b"\1" + b"".join(leaves)).digest()
+
+
+def entry_algorithm(file: map) -> str:
+    """
+    @param file: File map of a manifest
+    @return: Name of the algorithm its digest was made with
+    """
+    return file.get("digest_algorithm") or LEGACY_ALGORITHM
+
+
+def new_hash(algorithm: str = None):
+    """
+    @param algorithm: Name of digest algorithm, e.g. "sha256", "blake2b" or "blake2b-tree", DIGEST_ALGORITHM if None
+    @return: New hash object
+    @raise ValueError: if the algorithm is unknown
+    """
+    algorithm = algorithm or DIGEST_ALGORITHM
+    if algorithm.endswith(TREE_SUFFIX) and algorithm[:-len(TREE_SUFFIX)] in HASHES:
+        return TreeHash(HASHES[algorithm[:-len(TREE_SUFFIX)]])
+    if algorithm not in HASHES:
+        raise ValueError("Unknown digest algorithm {}".format(algorithm))
+    return HASHES[algorithm]()
+
+
+def digest(path: str, algorithm: str = None, workers: int = 1):
+    """
+    Base64 digest of a file
+    @param path: Path of file
+    @param algorithm: Name of digest algorithm, see new_hash
+    @param workers: Number of threads hashing the leaves of a tree hash at once, hashlib lets go of the GIL while it
+                    hashes
+    """
+    sha = new_hash(algorithm)
+    with open(path, "rb") as f:
+        if isinstance(sha, TreeHash) and workers > 1:
+            size = os.fstat(f.fileno()).st_size
+
+            def hash_leaf(offset: int) -> bytes:
+                leaf = sha.hash_function(b"\0")
+                for position in range(offset, min(size, offset + DIGEST_LEAF_SIZE), BUFFER_SIZE):
+                    leaf.update(os.pread(f.fileno(), min(BUFFER_SIZE, offset + DIGEST_LEAF_SIZE - position),
+                                         position))
+                return leaf.digest()
 
-def digest(path: str):
-    f = open(path, "rb")
-    sha = SHA256.new()
-    data = f.read(BUFFER_SIZE)
-    while data:
-        sha.update(data)
-        data = f.read(BUFFER_SIZE)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for leaf_digest in executor.map(hash_leaf, range(0, size, DIGEST_LEAF_SIZE)):
+                    sha.add_leaf(leaf_digest)
+        else:
+            data = f.read(BUFFER_SIZE)
+            while data:
+                sha.update(data)
+                data = f.read(BUFFER_SIZE)
     return base64.b64encode(sha.digest()).decode("utf-8")
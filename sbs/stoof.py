@@ -1,9 +1,15 @@
+import io
 import os.path
 
 from Cryptodome import Random
 import pickle
 from Cryptodome.Cipher import AES
 import base64
+from sbs.aead import IntegrityError, HEADER, TAG_SIZE, SALT_SIZE, make_header, parse_header, sealed_size, \
+    seal_segments, open_segments
+from sbs.crypto_pool import CryptoPool
+from sbs.pipeline import Pipeline
+from sbs.values import CHUNK_SIZE, SEGMENT_SIZE, CRYPTO_POOL_MIN_SIZE, CRYPTO_POOL_PART_SIZE
 
 
   # name of file in which key is stored
@@ -32,21 +38,268 @@ def pad(data: bytes, bs: int = BLOCK_SIZE) -> bytes:  # function to pad data to
 
 def unpad(data: bytes):
     padding_length = data[-1]
-    padded = True
-    for byte in data[-padding_length:]:
-        if byte != padding_length:
-            padded = False
-    if padded:
+    padding = data[-padding_length:]
+    if padding.count(padding_length) == len(padding):
         return data[:-padding_length]
     else:
         return data
 
 
+class FileChangedError(Exception):
+    """
+    Raised when a file changes size while being encrypted from disk
+    """
+
+
+def encrypted_size(length: int, segment_size: int = SEGMENT_SIZE) -> int:
+    """
+    Size of the object produced by Cryptologor.encrypt for data of a given length, header and tags included.
+    @param length: length of data
+    @param segment_size: segment size
+    @return: length of object
+    """
+    return sealed_size(length, segment_size)
+
+
+class EncryptingReader(io.RawIOBase):
+    def __init__(self, c, in_file, offset: int, length: int, sha=None, keep: int = CHUNK_SIZE, header: bytes = None,
+                 depth: int = 0):
+        """
+        Read only stream of the object sealing a range of a file, as Cryptologor.encrypt would make it, produced
+        CHUNK_SIZE bytes at a time so that whole pieces are never held in memory. It is seekable so that uploads
+        may rewind on retries or carry on from where Drive left them. The last keep bytes are kept, seeking further
+        sets out again from the chunk holding the position, as segments are sealed independently.
+        With a depth, the range is read and sealed ahead of the reader by a pipeline of two threads, a reader of
+        the disk and a hasher and encryptor, each handing chunks to the next through a queue of depth chunks. Disk
+        reads, hashing and encryption of the next chunks then overlap the sending of the current one, and a slow
+        consumer holds the stages back once the queues are full. close stops the pipeline.
+        @param c: Cryptologor holding the key
+        @param in_file: File opened in binary mode, not to be used by anyone else until the stream is closed
+        @param offset: Offset of range in file
+        @param length: Length of range
+        @param sha: Hash object updated with the plain data, each byte exactly once
+        @param keep: Number of bytes kept behind the current position
+        @param header: Object header, new if not given. With the header of an earlier upload the object is the same
+                       as it was.
+        @param depth: Chunks queued between stages of the pipeline, 0 to read and encrypt on the calling thread
+        """
+        super().__init__()
+        self.c = c
+        self.in_file = in_file
+        self.offset = offset
+        self.length = length
+        self.sha = sha
+        self.keep = keep
+        self.header = header or c.new_header()
+        segment_size = parse_header(self.header)[0]
+        # Chunks are whole segments
+        self.chunk_size = max(1, CHUNK_SIZE // segment_size) * segment_size
+        self.chunk_stride = encrypted_size(self.chunk_size, segment_size) - HEADER.size
+        self.size = encrypted_size(length, segment_size)
+        self.depth = depth
+        self.pipeline = None
+        self.position = 0
+        self.hashed = 0
+        self.restart(0)
+
+    def restart(self, position: int):
+        """
+        Sets out from the chunk holding position, or from the first chunk not yet hashed if that is before it
+        """
+        self.stop()
+        chunk = max(0, (position - HEADER.size) // self.chunk_stride)
+        chunk = min(chunk, self.hashed // self.chunk_size)
+        self.plain_read = chunk * self.chunk_size
+        self.done = False
+        self.buffer = bytearray() if chunk else bytearray(self.header)
+        self.buffer_start = HEADER.size + chunk * self.chunk_stride if chunk else 0
+        if self.depth:
+            self.pipeline = Pipeline([self.read_chunks(self.plain_read), self.encrypt_chunk], self.depth)
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.pipeline = None
+
+    def read_chunks(self, first: int):
+        """
+        @param first: Offset in range of first chunk
+        @return: Generator of the plain chunks of the range, read from disk
+        """
+        # An empty range still has a chunk, its one empty segment
+        for start in range(first, max(self.length, 1), self.chunk_size):
+            want = min(self.chunk_size, self.length - start)
+            self.in_file.seek(self.offset + start)
+            data = self.in_file.read(want)
+            if len(data) != want:
+                raise FileChangedError("File shrank while being read")
+            yield data
+
+    def encrypt_chunk(self, data: bytes) -> bytes:
+        """
+        Hashes and seals the next plain chunk of the range
+        @return: Segments of chunk
+        """
+        if self.sha is not None and self.plain_read + len(data) > self.hashed:
+            self.sha.update(data[self.hashed - self.plain_read:])
+            self.hashed = self.plain_read + len(data)
+        index = self.plain_read // parse_header(self.header)[0]
+        self.plain_read += len(data)
+        return self.c.seal(self.header, index, data, self.plain_read == self.length)
+
+    def produce(self):
+        """
+        Reads and encrypts the next chunk of the range into the buffer
+        """
+        if self.pipeline is not None:
+            cipher = self.pipeline.get()
+        else:
+            want = min(self.chunk_size, self.length - self.plain_read)
+            self.in_file.seek(self.offset + self.plain_read)
+            data = self.in_file.read(want)
+            if len(data) != want:
+                raise FileChangedError("File shrank while being read")
+            cipher = self.encrypt_chunk(data)
+        self.buffer += cipher
+        self.done = self.buffer_start + len(self.buffer) == self.size
+
+        # Forget what is too far behind the current position. After a forward seek, the position may be beyond the
+        # end of the buffer, which is then forgotten whole but no further, as the next chunk follows it.
+        excess = min(self.position - self.buffer_start - self.keep, len(self.buffer))
+        if excess > 0:
+            del self.buffer[:excess]
+            self.buffer_start += excess
+
+    def readinto(self, b) -> int:
+        if self.position < self.buffer_start or \
+                self.position > self.buffer_start + len(self.buffer) + self.chunk_stride:
+            self.restart(self.position)
+        # Fill the whole request, short reads would truncate the chunks sent by the uploader
+        while not self.done and self.buffer_start + len(self.buffer) < self.position + len(b):
+            self.produce()
+        start = self.position - self.buffer_start
+        data = self.buffer[start:start + len(b)]
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def finish_hash(self):
+        """
+        Hashes what of the range was not read yet, for when the object was stored without reading it all, e.g. by
+        an upload session which Drive already had whole
+        """
+        self.stop()
+        if self.sha is None:
+            return
+        while self.hashed < self.length:
+            self.in_file.seek(self.offset + self.hashed)
+            data = self.in_file.read(min(self.chunk_size, self.length - self.hashed))
+            if not data:
+                raise FileChangedError("File shrank while being read")
+            self.sha.update(data)
+            self.hashed += len(data)
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+class DecryptingWriter(io.RawIOBase):
+    def __init__(self, c, out_file, sha=None):
+        """
+        Write only stream which decrypts an object made by Cryptologor.encrypt, or a legacy CBC cipher, as it is
+        written, and writes the plain data to out_file. The last segment, or block of a legacy cipher, is held back
+        until finish is called, as only then is it known to be the last.
+        @param c: Cryptologor holding the key
+        @param out_file: File to write plain data to
+        @param sha: Hash object updated with the plain data
+        """
+        self.c = c
+        self.out_file = out_file
+        self.sha = sha
+        self.header = None
+        self.index = 0
+        # Last cipher block of a legacy cipher, from which the next one is chained, the IV to begin with
+        self.chain = None
+        self.pending = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.pending += data
+        if self.header is None and self.chain is None:
+            # The smallest object and legacy cipher are both longer than a header
+            if len(self.pending) < HEADER.size:
+                return len(data)
+            if parse_header(self.pending) is not None:
+                self.header = bytes(self.pending[:HEADER.size])
+                self.stride = parse_header(self.header)[0] + TAG_SIZE
+                del self.pending[:HEADER.size]
+            else:
+                self.chain = bytes(self.pending[:BLOCK_SIZE])
+                del self.pending[:BLOCK_SIZE]
+        if self.header is not None:
+            # Open all whole segments but the last one
+            count = (len(self.pending) - 1) // self.stride
+            if count > 0:
+                self.emit(self.c.open(self.header, self.index, bytes(self.pending[:count * self.stride]), False))
+                self.index += count
+                del self.pending[:count * self.stride]
+        else:
+            # Decrypt all whole blocks but the last one
+            ready = (len(self.pending) - 1) // BLOCK_SIZE * BLOCK_SIZE
+            if ready > 0:
+                cipher = bytes(self.pending[:ready])
+                self.emit(self.c.decrypt_cbc(self.chain, cipher))
+                self.chain = cipher[-BLOCK_SIZE:]
+                del self.pending[:ready]
+        return len(data)
+
+    def emit(self, data: bytes):
+        if self.sha is not None:
+            self.sha.update(data)
+        self.out_file.write(data)
+
+    def finish(self):
+        """
+        Decrypts the last segment, or block of a legacy cipher, to be called once the whole object is written
+        @raise IntegrityError: if the object is truncated or was tampered with
+        """
+        if self.header is not None:
+            self.emit(self.c.open(self.header, self.index, bytes(self.pending), True))
+        elif self.chain is None or len(self.pending) != BLOCK_SIZE:
+            raise IntegrityError("Cipher is truncated")
+        else:
+            self.emit(unpad(self.c.decrypt_cbc(self.chain, bytes(self.pending))))
+        self.pending = bytearray()
+
+
 class Cryptologor:
-    def __init__(self, key_file):
+    def __init__(self, key_file, processes: int = 0):
         """
         Class to deal with encryption stuff, please fork me and think of a better name.
         @param key_file: Path to key file
+        @param processes: Number of processes of a CryptoPool to encrypt and decrypt large data on, none if less
+                          than 2
         """
         self.rand = Random.new()
         try:
@@ -61,33 +314,90 @@ class Cryptologor:
             self.key = self.rand.read(KEY_LENGTH)
             with open(key_file, "wb") as f:
                 pickle.dump(self.key, f)
+        self.pool = CryptoPool(self.key, processes, CRYPTO_POOL_PART_SIZE) if processes > 1 else None
+
+    def new_header(self) -> bytes:
+        """
+        @return: Header of a new object, with a random salt
+        """
+        return make_header(SEGMENT_SIZE, self.rand.read(SALT_SIZE))
+
+    def seal(self, header: bytes, index: int, data, final: bool) -> bytes:
+        """
+        Seals segments of an object, see aead.seal_segments, on the crypto pool if there is one and data is large
+        enough to be worth handing over
+        """
+        if self.pool is not None and len(data) >= CRYPTO_POOL_MIN_SIZE:
+            return self.pool.seal(header, index, data, final)
+        return seal_segments(self.key, header, index, data, final)
+
+    def open(self, header: bytes, index: int, data, final: bool) -> bytes:
+        """
+        Opens segments of an object, see aead.open_segments and seal
+        """
+        if self.pool is not None and len(data) >= CRYPTO_POOL_MIN_SIZE:
+            return self.pool.open(header, index, data, final)
+        return open_segments(self.key, header, index, data, final)
+
+    def decrypt_cbc(self, iv: bytes, data) -> bytes:
+        """
+        AES-CBC decryption of legacy ciphers, on the crypto pool if there is one, see seal
+        @param iv: IV, or last cipher block when carrying on a cipher
+        @param data: Cipher of length a multiple of the block size
+        """
+        if self.pool is not None and len(data) >= CRYPTO_POOL_MIN_SIZE:
+            return self.pool.decrypt_cbc(iv, data)
+        return AES.new(self.key, AES.MODE_CBC, iv).decrypt(data)
 
     def encrypt(self, data: bytes) -> bytes:
         """
-        Shmoosey's revolutionary encryption function, returned bytes include the initialization vector (IV)
-        as first 16 bytes. The IV is randomly generated for each cipher and serves as a sort of salt for
-        the encryption algorithm. This will be separated automagically in the decryption function.
+        Shmoosey's revolutionary encryption function. The returned object starts with a header holding a random
+        salt, from which the key of the object is derived, followed by the data sealed in segments with AES-GCM, see
+        aead.py. Segments may be decrypted on their own and every one of them is authenticated.
         @param data: data to encrypt
         @return: encrypted data
         """
-
-        iv = self.rand.read(BLOCK_SIZE)
-        aes = AES.new(self.key, AES.MODE_CBC, iv)
-        encrypted_data = aes.encrypt(pad(data))
-        return iv + encrypted_data
+        header = self.new_header()
+        return header + self.seal(header, 0, data, True)
 
     def decrypt(self, data: bytes) -> bytes:
         """
-        Shmoosey's revolutionary decryption function. It does it all. It does the IV separation, it does
-        the decryption, it does the unpadding.
+        Shmoosey's revolutionary decryption function. It does it all. It reads the header, it opens and
+        authenticates the segments. Legacy alpha2.0 objects, an IV followed by an AES-CBC cipher, are told apart by
+        their lack of header, and decrypted and unpadded.
         @param data: data to decrypt
         @return: decrypted data
+        @raise IntegrityError: if the object was tampered with
         """
+        if parse_header(data) is not None:
+            return bytes(self.open(bytes(data[:HEADER.size]), 0, memoryview(data)[HEADER.size:], True))
         iv = data[:BLOCK_SIZE]  # separate out IV
         encrypted_data = data[BLOCK_SIZE:]
 
-        aes = AES.new(self.key, AES.MODE_CBC, iv)
-        return unpad(aes.decrypt(encrypted_data))
+        return unpad(self.decrypt_cbc(iv, encrypted_data))
+
+    def encrypting_reader(self, in_file, offset: int, length: int, sha=None, header: bytes = None,
+                          depth: int = 0) -> EncryptingReader:
+        """
+        Stream of the object sealing a range of a file, identical in format to encrypt, see EncryptingReader.
+        @param in_file: File opened in binary mode
+        @param offset: Offset of range in file
+        @param length: Length of range
+        @param sha: Hash object to update with the plain data
+        @param header: Object header, new if not given
+        @param depth: Chunks read and encrypted ahead by a pipeline, 0 for none
+        @return: EncryptingReader
+        """
+        return EncryptingReader(self, in_file, offset, length, sha=sha, header=header, depth=depth)
+
+    def decrypting_writer(self, out_file, sha=None) -> DecryptingWriter:
+        """
+        Stream which decrypts what is written to it into out_file, see DecryptingWriter.
+        @param out_file: File to write plain data to
+        @param sha: Hash object to update with the plain data
+        @return: DecryptingWriter
+        """
+        return DecryptingWriter(self, out_file, sha=sha)
 
     def encrypt_name(self, name: str):
         """
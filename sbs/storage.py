@@ -0,0 +1,408 @@
+import json
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+
+from sbs.batch import execute_batch
+from sbs.retry import RetryPolicy, Retrier, execute
+from sbs.service_getter import get_credentials, ServicePool
+from sbs.throttle import AdaptiveLimiter
+from sbs.values import CHUNK_SIZE, LIST_PAGE_SIZE, BATCH_SIZE
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+class Storage(ABC):
+    """
+    Where backups are kept: folders of objects, each object with a name the application gives it and an id the
+    storage gives it. Backups only ever refer to objects by id. Shared by all threads of a FileManager.
+    """
+
+    @abstractmethod
+    def create_folder(self, name: str, parent: str = None) -> str:
+        """
+        @param name: Name of folder
+        @param parent: Id of parent folder, None for the top level of the application
+        @return: Id of folder
+        """
+
+    @abstractmethod
+    def put(self, stream, size: int, name: str, parent: str, bar=None, resume_uri: str = None,
+            on_start=None) -> str:
+        """
+        Stores an object
+        @param stream: Stream of data
+        @param size: Size of data
+        @param name: Name of object
+        @param parent: Id of folder
+        @param bar: tqdm bar to update with bytes stored (optional)
+        @param resume_uri: Where an earlier attempt at storing the same data left off, for storages which resume
+        @param on_start: Function given where the attempt may be resumed from, once the storage tells
+        @return: Id of object
+        """
+
+    @abstractmethod
+    def get(self, object_id: str, fd, offset: int = None, size: int = None, bar=None):
+        """
+        Reads an object, or a range of it
+        @param object_id: Id of object
+        @param fd: Stream to write data to
+        @param offset: Offset of range (optional)
+        @param size: Size of range, required with offset
+        @param bar: tqdm bar to update with bytes read (optional)
+        """
+
+    @abstractmethod
+    def list(self, folder_id: str) -> list:
+        """
+        @param folder_id: Id of folder
+        @return: List of maps with id and name of the objects of folder
+        """
+
+    def list_many(self, folder_ids: list) -> map:
+        """
+        @param folder_ids: Ids of folders
+        @return: Map of folder id to list of the objects of folder, see list, without the folders which failed to
+                 be listed
+        """
+        return {folder_id: self.list(folder_id) for folder_id in folder_ids}
+
+    @abstractmethod
+    def find(self, folder_id: str, object_id: str) -> map:
+        """
+        @param folder_id: Id of folder holding object
+        @param object_id: Id of object
+        @return: Map with id and name of object
+        @raise FileNotFoundError: if there is no such object
+        """
+
+    @abstractmethod
+    def delete(self, folder_id: str, object_ids: list):
+        """
+        Deletes objects, ignoring those which fail to be deleted
+        @param folder_id: Id of folder holding objects
+        @param object_ids: Ids of objects
+        """
+
+
+class DriveStorage(Storage):
+    def __init__(self, creds, limiter: AdaptiveLimiter = None, retry_policy: RetryPolicy = None,
+                 batch_size: int = BATCH_SIZE):
+        """
+        Storage in the application data folder of Google Drive. Objects are uploaded resumably, and metadata
+        requests for many objects are batched, see execute_batch.
+        @param creds: Google credentials from get_credentials
+        @param limiter: Limiter to make requests under (optional)
+        @param retry_policy: RetryPolicy of requests
+        @param batch_size: Most requests per batch
+        """
+        self.services = ServicePool(creds, limiter)
+        self.retry_policy = retry_policy
+        self.batch_size = batch_size
+
+    @property
+    def service(self):
+        """
+        Drive service of the calling thread. httplib2 is not thread safe, so every worker thread has its own, see
+        ServicePool.
+        """
+        return self.services.get()
+
+    def create_folder(self, name: str, parent: str = None) -> str:
+        metadata = {
+            "name": name,
+            "mimeType": FOLDER_MIME_TYPE,
+            "parents": [parent or "appDataFolder"]
+        }
+        return execute(self.service.files().create(body=metadata, fields="id"), self.retry_policy).get("id")
+
+    def put(self, stream, size: int, name: str, parent: str, bar=None, resume_uri: str = None,
+            on_start=None) -> str:
+        """
+        Uploads an object, retrying on connection trouble. Uploads are resumable: on_start is given the resumable
+        upload URI, from which an upload of the same data may carry on from where Drive left it.
+        """
+        media_body = MediaIoBaseUpload(stream, resumable=True, chunksize=CHUNK_SIZE,
+                                       mimetype="application/octet-stream")
+        metadata = {
+            "name": name,
+            "parents": [parent]
+        }
+
+        file = self.service.files().create(body=metadata, media_body=media_body, fields="id")
+        # The request first asks Drive how much of the data of the earlier session it has
+        file.resumable_uri = resume_uri
+        query = bool(resume_uri)
+        started_uri = resume_uri
+
+        response = None
+        retrier = Retrier(self.retry_policy, log=bar.write if bar is not None else None)
+        total = 0.0
+        while response is None:
+            try:
+                if query:
+                    response = query_upload(file, size)
+                    query = False
+                else:
+                    # Upload next chunk of file
+                    status, response = file.next_chunk()
+                    if status and bar is not None:
+                        # If we get a response update progress bar (progress is a number between 0-1)
+                        progress = status.progress()
+                        bar.update((progress - total) * size)
+                        total = progress
+                retrier.succeeded()
+            except HttpError as e:
+                if file.resumable_uri and e.resp.status in (404, 410):
+                    # Upload session expired, start over in a new one. Counted as a failed attempt, so that a session
+                    # which keeps expiring does not restart forever.
+                    file = self.service.files().create(body=metadata, media_body=media_body, fields="id")
+                    query = False
+                    retrier.failed(e, retryable=True)
+                else:
+                    retrier.failed(e)
+            except Exception as e:
+                retrier.failed(e)
+            finally:
+                if on_start is not None and file.resumable_uri and file.resumable_uri != started_uri:
+                    started_uri = file.resumable_uri
+                    on_start(started_uri)
+        # Final update of bar just in case
+        if bar is not None:
+            bar.update((1 - total) * size)
+        return response.get("id")
+
+    def get(self, object_id: str, fd, offset: int = None, size: int = None, bar=None):
+        """
+        Downloads an object, retrying on connection trouble, in chunks, or a range of it in one request
+        """
+        request = self.service.files().get_media(fileId=object_id)
+        if offset is not None:
+            request.headers["range"] = "bytes={}-{}".format(offset, offset + size - 1)
+            downloader = None
+        else:
+            downloader = MediaIoBaseDownload(fd, request, chunksize=CHUNK_SIZE)
+        done = False
+        total = 0
+        retrier = Retrier(self.retry_policy, log=bar.write if bar is not None else None)
+        while done is False:
+            try:
+                if downloader is None:
+                    data = request.execute()
+                    done = True
+                else:
+                    status, done = downloader.next_chunk()
+                    if status and bar is not None:
+                        bar.update(status.resumable_progress - total)
+                        total = status.resumable_progress
+                retrier.succeeded()
+            except Exception as e:
+                retrier.failed(e)
+        if downloader is None:
+            fd.write(data)
+            if bar is not None:
+                bar.update(len(data))
+
+    def list_request(self, folder_id: str, page_token: str = None):
+        """
+        @return: HttpRequest listing a page of the objects of a folder
+        """
+        return self.service.files().list(spaces="appDataFolder", q="'{}' in parents".format(folder_id),
+                                         pageSize=LIST_PAGE_SIZE, pageToken=page_token,
+                                         fields="nextPageToken, files(id, name)")
+
+    def list(self, folder_id: str) -> list:
+        """
+        Lists the objects of a folder, following pages until Drive has no more
+        """
+        files = []
+        page_token = None
+        while True:
+            response = execute(self.list_request(folder_id, page_token), self.retry_policy)
+            files += response.get("files", [])
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return files
+
+    def list_many(self, folder_ids: list) -> map:
+        """
+        Lists the objects of many folders, the next page of each folder being a request of one batch
+        """
+        children = {folder_id: [] for folder_id in folder_ids}
+        page_tokens = {folder_id: None for folder_id in children}
+        while page_tokens:
+            folders = list(page_tokens)
+            responses = execute_batch(self.service, [self.list_request(folder_id, page_tokens[folder_id])
+                                                     for folder_id in folders],
+                                      self.retry_policy, self.batch_size, return_exceptions=True)
+            page_tokens = {}
+            for folder_id, response in zip(folders, responses):
+                if isinstance(response, Exception):
+                    del children[folder_id]
+                    continue
+                children[folder_id] += response.get("files", [])
+                if response.get("nextPageToken"):
+                    page_tokens[folder_id] = response.get("nextPageToken")
+        return children
+
+    def find(self, folder_id: str, object_id: str) -> map:
+        try:
+            file = execute(self.service.files().get(fileId=object_id, fields="id, name, trashed"), self.retry_policy)
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise FileNotFoundError("No object {}".format(object_id)) from e
+            raise
+        if file.get("trashed"):
+            raise FileNotFoundError("Object {} is in the trash".format(object_id))
+        return {"id": file.get("id"), "name": file.get("name")}
+
+    def delete(self, folder_id: str, object_ids: list):
+        """
+        Deletes objects in batches
+        """
+        try:
+            execute_batch(self.service, [self.service.files().delete(fileId=object_id) for object_id in object_ids],
+                          self.retry_policy, self.batch_size, return_exceptions=True)
+        except (HttpError, OSError):
+            pass
+
+
+def query_upload(request, size: int):
+    """
+    Asks Drive how much of the data of the resumable upload session of a request it has, so that the request carries
+    on from there
+    @param request: HttpRequest of a resumable upload, with its resumable_uri set
+    @param size: Size of data
+    @return: Response of upload if Drive has all of the data, else None
+    @raise HttpError: if Drive answers with an error, 404 or 410 if the session expired
+    """
+    resp, content = request.http.request(request.resumable_uri, "PUT",
+                                         headers={"Content-Range": "bytes */{}".format(size), "content-length": "0"})
+    if resp.status in (200, 201):
+        return json.loads(content.decode("UTF-8"))
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=request.resumable_uri)
+    # Range of bytes Drive has, missing if it has none
+    request.resumable_progress = int(resp["range"].rsplit("-", 1)[1]) + 1 if "range" in resp else 0
+    return None
+
+
+class LocalStorage(Storage):
+    def __init__(self, root):
+        """
+        Storage in a directory of a local disk or a NAS. Each object is a file named by its id, written aside and
+        renamed into place, so that an object is either whole or missing. Each folder is a directory holding, for
+        each of its objects, a file named by the id of the object and holding its name:
+            objects/<first two characters of id>/<id>
+            folders/<folder id>/<object id>
+        Objects are not resumed, an interrupted object is written again.
+        @param root: Path of directory
+        """
+        self.root = os.path.abspath(str(root))
+        os.makedirs(self.folder_path("root"), exist_ok=True)
+
+    def object_path(self, object_id: str) -> str:
+        # Ids come from manifests, which must never lead outside the storage
+        if not re.fullmatch(r"[0-9a-f]{32}", object_id):
+            raise ValueError("Invalid object id {}".format(object_id))
+        return os.path.join(self.root, "objects", object_id[:2], object_id)
+
+    def folder_path(self, folder_id: str) -> str:
+        if folder_id != "root" and not re.fullmatch(r"[0-9a-f]{32}", folder_id):
+            raise ValueError("Invalid folder id {}".format(folder_id))
+        return os.path.join(self.root, "folders", folder_id)
+
+    def write_atomic(self, path: str, write):
+        """
+        Writes a file aside, then renames it into place
+        @param write: Function given the open file
+        """
+        temporary_path = os.path.join(os.path.dirname(path), ".{}.tmp".format(uuid.uuid4().hex))
+        try:
+            with open(temporary_path, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def add_entry(self, parent: str, object_id: str, name: str):
+        self.write_atomic(os.path.join(self.folder_path(parent), object_id), lambda f: f.write(name.encode("UTF-8")))
+
+    def create_folder(self, name: str, parent: str = None) -> str:
+        folder_id = uuid.uuid4().hex
+        os.makedirs(self.folder_path(folder_id))
+        self.add_entry(parent or "root", folder_id, name)
+        return folder_id
+
+    def put(self, stream, size: int, name: str, parent: str, bar=None, resume_uri: str = None,
+            on_start=None) -> str:
+        object_id = uuid.uuid4().hex
+        path = self.object_path(object_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        def write(f):
+            data = stream.read(CHUNK_SIZE)
+            while data:
+                f.write(data)
+                if bar is not None:
+                    bar.update(len(data))
+                data = stream.read(CHUNK_SIZE)
+
+        self.write_atomic(path, write)
+        # The object is only listed once it is whole
+        self.add_entry(parent, object_id, name)
+        return object_id
+
+    def get(self, object_id: str, fd, offset: int = None, size: int = None, bar=None):
+        with open(self.object_path(object_id), "rb") as f:
+            position = offset or 0
+            end = position + size if offset is not None else os.fstat(f.fileno()).st_size
+            while position < end:
+                data = os.pread(f.fileno(), min(CHUNK_SIZE, end - position), position)
+                if not data:
+                    raise EOFError("Object {} is shorter than expected".format(object_id))
+                fd.write(data)
+                position += len(data)
+                if bar is not None:
+                    bar.update(len(data))
+
+    def list(self, folder_id: str) -> list:
+        files = []
+        for entry in os.scandir(self.folder_path(folder_id)):
+            if entry.is_file() and not entry.name.startswith("."):
+                files.append(self.find(folder_id, entry.name))
+        return files
+
+    def find(self, folder_id: str, object_id: str) -> map:
+        with open(os.path.join(self.folder_path(folder_id), object_id), "rb") as f:
+            return {"id": object_id, "name": f.read().decode("UTF-8")}
+
+    def delete(self, folder_id: str, object_ids: list):
+        for object_id in object_ids:
+            for path in (os.path.join(self.folder_path(folder_id), object_id), self.object_path(object_id)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def open_storage(config, limiter: AdaptiveLimiter = None) -> Storage:
+    """
+    @param config: Config, with storage_path for a LocalStorage, else backups are kept on Drive
+    @param limiter: Limiter to make Drive requests under (optional)
+    @return: Storage
+    """
+    if config.storage_path:
+        return LocalStorage(config.storage_path)
+    return DriveStorage(get_credentials(config), limiter, RetryPolicy.from_config(config),
+                        config.batch_size or BATCH_SIZE)
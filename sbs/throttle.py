@@ -0,0 +1,154 @@
+import time
+from contextlib import contextmanager
+from threading import Condition
+
+from sbs.retry import is_throttling
+from sbs.values import DEFAULT_JOBS, MAX_JOBS, REQUEST_RATE_START, REQUEST_RATE_MAX, REQUEST_RATE_STEP, \
+    THROTTLE_WINDOW
+
+
+class AdaptiveLimiter:
+    def __init__(self, limit: int = DEFAULT_JOBS, max_limit: int = MAX_JOBS, rate: float = REQUEST_RATE_START,
+                 max_rate: float = REQUEST_RATE_MAX, window: float = THROTTLE_WINDOW, log=None):
+        """
+        Limits the transfers in flight and the rate of Drive requests, adapting both AIMD style: every window without
+        throttling, the request rate grows by a step, and the number of transfers by one if the throughput of the
+        window rose. When Drive throttles (429, or 403 with a rate limit reason), both are halved, at most once per
+        window, as a burst of requests is throttled all together.
+        @param limit: Transfers in flight to start with
+        @param max_limit: Most transfers in flight
+        @param rate: Requests per second to start with
+        @param max_rate: Most requests per second
+        @param window: Seconds between adjustments
+        @param log: Function given a message on each adjustment, e.g. the write of a log file
+        """
+        self.condition = Condition()
+        self.limit = float(min(limit, max_limit))
+        self.max_limit = max_limit
+        self.rate = float(min(rate, max_rate))
+        self.max_rate = max_rate
+        self.window = window
+        self.log = log
+        self.in_flight = 0
+        # Token bucket of requests
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        # Stats of the current window
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_requests = 0
+        self.window_throttled = 0
+        self.decreased = False
+        self.throughput = 0.0
+
+    def reset(self, limit: int):
+        """
+        Starts over with a number of transfers in flight, e.g. the number of jobs asked for
+        """
+        with self.condition:
+            self.limit = float(max(1, min(limit, self.max_limit)))
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """
+        Context of one transfer, waiting while the limit of transfers in flight is reached
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def acquire(self):
+        """
+        Waits until a request may be made under the request rate
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.condition.wait((1 - self.tokens) / self.rate)
+
+    def record(self, size: int, throttled: bool):
+        """
+        Records a finished request
+        @param size: Bytes sent and received
+        @param throttled: Whether Drive throttled the request
+        """
+        with self.condition:
+            self.window_bytes += size
+            self.window_requests += 1
+            if throttled:
+                self.window_throttled += 1
+                if not self.decreased:
+                    # Multiplicative decrease, right away
+                    self.decreased = True
+                    self.limit = max(1.0, self.limit / 2)
+                    self.rate = max(1.0, self.rate / 2)
+                    self.report("Throttled by Drive")
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.adjust(now)
+
+    def adjust(self, now: float):
+        """
+        Ends the current window, increasing the limits if it went without throttling
+        """
+        throughput = self.window_bytes / (now - self.window_start)
+        if not self.window_throttled:
+            # Additive increase
+            self.rate = min(self.max_rate, self.rate + REQUEST_RATE_STEP)
+            if throughput > self.throughput:
+                self.limit = min(float(self.max_limit), self.limit + 1)
+            self.condition.notify_all()
+        self.report("{} requests, {} throttled".format(self.window_requests, self.window_throttled),
+                    throughput)
+        self.throughput = throughput
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_requests = 0
+        self.window_throttled = 0
+        self.decreased = False
+
+    def report(self, message: str, throughput: float = None):
+        if self.log is None:
+            return
+        if throughput is not None:
+            message += ", throughput {:.2f} MB/s".format(throughput / 1000 ** 2)
+        self.log("{}: {} transfers in flight at most, {:.1f} requests per second\n".format(
+            message, int(self.limit), self.rate))
+
+
+class ThrottledHttp:
+    def __init__(self, http, limiter: AdaptiveLimiter):
+        """
+        Http object which makes requests under an AdaptiveLimiter, and tells it how they went
+        @param http: Http object to wrap, e.g. AuthorizedHttp
+        @param limiter: Limiter
+        """
+        self.http = http
+        self.limiter = limiter
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        self.limiter.acquire()
+        resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        if isinstance(body, (bytes, str)):
+            sent = len(body)
+        else:
+            # Streamed upload chunk
+            sent = int({key.lower(): value for key, value in (headers or {}).items()}.get("content-length", 0))
+        self.limiter.record(sent + len(content or b""), is_throttling(resp.status, content))
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
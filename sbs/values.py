@@ -6,3 +6,48 @@ CHUNK_SIZE = 256 * 1024 * CHUNK_THICCNESS
 PIECE_SIZE = 256 * 1000 ** 2 - 1
 
 VERSION_CODE = "alpha2.0"
+MANIFEST_FORMAT = 2  # version of binary manifest encoding, see manifest.py
+CHECKPOINT_INTERVAL = 10  # a full manifest every this many backups, deltas in between
+
+# An interrupted backup is saved to Drive every this many files or bytes uploaded
+SESSION_CHECKPOINT_FILES = 1000
+SESSION_CHECKPOINT_BYTES = 1000 ** 3
+
+# Retries of Drive calls, see retry.py
+RETRY_MAX_ATTEMPTS = 10  # failures in a row
+RETRY_DEADLINE = 15 * 60  # seconds without progress
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+DEFAULT_JOBS = 4  # concurrent transfers to start with
+LIST_PAGE_SIZE = 1000  # objects listed per request, the most Drive allows
+BATCH_SIZE = 100  # metadata requests per batch request, the most Drive allows
+# Transfers and requests adapt to the throttling of Drive, see throttle.py
+MAX_JOBS = 16
+REQUEST_RATE_START = 25  # requests per second
+REQUEST_RATE_MAX = 200
+REQUEST_RATE_STEP = 5
+THROTTLE_WINDOW = 2  # seconds
+
+SEGMENT_SIZE = 64 * 1024  # objects are sealed in segments of this much plain data, see aead.py
+
+# Large data is encrypted and decrypted on a process pool, see crypto_pool.py
+CRYPTO_POOL_MIN_SIZE = 256 * 1024
+CRYPTO_POOL_PART_SIZE = 512 * 1024  # data handed to one worker at a time
+
+# Content digests, see sha.py
+DIGEST_ALGORITHM = "sha256"
+DIGEST_LEAF_SIZE = 4 * 1024 ** 2  # leaves of tree hashes, part of their definition so never to be changed
+
+PIPELINE_DEPTH = 2  # chunks read and encrypted ahead of each upload, see pipeline.py
+BUNDLES_AHEAD = 2  # bundles packed ahead of the uploads, beyond one per job
+
+PACK_SIZE = 64 * 1000 ** 2  # target size of bundles of small files
+RANGE_LIMIT = 4 * CHUNK_SIZE  # largest ranged read of consecutive slices of a bundle
+
+MANIFEST_CACHE_SIZE = 2 * 1000 ** 3  # bytes of manifests kept on disk
+
+# Content defined chunking for deduplication
+CDC_MIN_SIZE = 256 * 1024
+CDC_AVERAGE_SIZE = 1024 ** 2
+CDC_MAX_SIZE = 4 * 1024 ** 2
@@ -0,0 +1,56 @@
+import pytest
+
+from sbs.config import Config
+from sbs.storage import LocalStorage
+
+import fakedrive
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """
+    Application data of every test under a home of its own. FileManager.backup changes directory, which is undone
+    after the test.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "home"
+
+
+def make_config(tmp_path) -> Config:
+    config = Config()
+    config.key = str(tmp_path / "key")
+    config.log_dir = str(tmp_path / "logs")
+    config.credentials_dir = str(tmp_path / "creds")
+    config.backup_path = str(tmp_path / "src")
+    config.exclude = []
+    return config
+
+
+@pytest.fixture
+def local_config(tmp_path) -> Config:
+    """
+    Config keeping backups in a LocalStorage
+    """
+    config = make_config(tmp_path)
+    config.storage_path = str(tmp_path / "storage")
+    config.parent_id = LocalStorage(config.storage_path).create_folder("Backups")
+    return config
+
+
+@pytest.fixture
+def drive(monkeypatch) -> fakedrive.FakeDrive:
+    drive = fakedrive.FakeDrive()
+    fakedrive.install(monkeypatch, drive)
+    return drive
+
+
+@pytest.fixture
+def drive_config(tmp_path, drive) -> Config:
+    """
+    Config keeping backups on a FakeDrive
+    """
+    config = make_config(tmp_path)
+    config.parent_id = drive.add_folder("Backups")
+    config.retry_max_attempts = 5
+    return config
@@ -0,0 +1,225 @@
+import json
+import re
+import uuid
+from email.parser import Parser
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+
+import sbs.service_getter
+import sbs.storage
+from sbs.service_getter import get_discovery_document
+from sbs.throttle import ThrottledHttp
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+def response(status: int, body=b"", headers: map = None):
+    """
+    @return: (httplib2.Response, content) as Http.request returns them
+    """
+    resp = httplib2.Response(dict(headers or {}, status=str(status)))
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode("UTF-8")
+    return resp, body
+
+
+def error(status: int, reason: str = None, headers: map = None):
+    errors = [{"reason": reason}] if reason else []
+    return response(status, {"error": {"code": status, "errors": errors, "message": reason or "error"}}, headers)
+
+
+class FakeDrive:
+    def __init__(self):
+        """
+        In memory Drive, answering the requests googleapiclient makes for sbs: folders, resumable uploads, chunked and
+        ranged downloads, paged listings, deletes and batches. Shared by all FakeHttp of a test.
+        """
+        self.lock = Lock()
+        # Id to map with id, name, parents and data
+        self.files = {}
+        # Resumable upload sessions, id to map with metadata and data received
+        self.sessions = {}
+        # (method, kind) of every request answered, those of batches included
+        self.log = []
+        # HTTP round trips, a batch counting once
+        self.round_trips = 0
+        # Functions given (method, uri, headers), returning a response to answer in place of Drive, or None
+        self.faults = []
+
+    def add_folder(self, name: str, parent: str = "appDataFolder") -> str:
+        folder_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[folder_id] = {"id": folder_id, "name": name, "parents": [parent], "data": b"",
+                                     "mimeType": FOLDER_MIME_TYPE}
+        return folder_id
+
+    def children(self, folder_id: str) -> list:
+        with self.lock:
+            return [file for file in self.files.values() if folder_id in file["parents"]]
+
+    def count(self, kind: str) -> int:
+        """
+        @return: Number of requests of a kind answered, see kind_of
+        """
+        return sum(1 for _, logged in self.log if logged == kind)
+
+    def http(self):
+        return FakeHttp(self)
+
+    def request(self, uri: str, method: str, body, headers: map, in_batch: bool = False):
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        url = urlparse(uri)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if not in_batch:
+            with self.lock:
+                self.round_trips += 1
+        if url.path.startswith("/batch/"):
+            return self.batch(body, headers)
+        with self.lock:
+            self.log.append((method, kind_of(method, url.path, query)))
+        for fault in list(self.faults):
+            answer = fault(method, uri, headers)
+            if answer is not None:
+                return answer
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+
+        if url.path.startswith("/upload/sessions/"):
+            return self.upload_chunk(url.path.rsplit("/", 1)[1], body or b"", headers)
+        if url.path.startswith("/upload/") and method == "POST":
+            session_id = uuid.uuid4().hex
+            with self.lock:
+                self.sessions[session_id] = {"metadata": json.loads(body), "data": bytearray()}
+            return response(200, headers={"location": "https://www.googleapis.com/upload/sessions/" + session_id})
+        if url.path.endswith("/files") and method == "POST":
+            return response(200, {"id": self.create(json.loads(body), b"")})
+        if url.path.endswith("/files") and method == "GET":
+            return self.list(query)
+        match = re.fullmatch(r".*/files/([^/]+)", url.path)
+        if match is None:
+            raise NotImplementedError((method, uri))
+        file_id = match.group(1)
+        with self.lock:
+            file = self.files.get(file_id)
+            if file is not None and method == "DELETE":
+                del self.files[file_id]
+        if file is None:
+            return error(404, "notFound")
+        if method == "DELETE":
+            return response(204)
+        if query.get("alt") == "media":
+            data = file["data"]
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("range", ""))
+            if match is None:
+                return response(200, data)
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            return response(206, data[start:end + 1],
+                            {"content-range": "bytes {}-{}/{}".format(start, end, len(data))})
+        return response(200, {"id": file["id"], "name": file["name"]})
+
+    def create(self, metadata: map, data: bytes) -> str:
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = {"id": file_id, "name": metadata.get("name"),
+                                   "parents": metadata.get("parents") or ["appDataFolder"], "data": bytes(data),
+                                   "mimeType": metadata.get("mimeType")}
+        return file_id
+
+    def upload_chunk(self, session_id: str, body: bytes, headers: map):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            return error(404, "notFound")
+        if "id" in session:
+            # Complete, Drive answers with the object again
+            return response(200, {"id": session["id"]})
+        content_range = headers.get("content-range", "")
+        match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        if match is not None:
+            del session["data"][int(match.group(1)):]
+            session["data"] += body
+            total = match.group(3)
+        else:
+            # Status query
+            total = re.fullmatch(r"bytes \*/(\d+|\*)", content_range).group(1)
+        if total != "*" and len(session["data"]) >= int(total):
+            session["id"] = self.create(session["metadata"], session["data"])
+            return response(200, {"id": session["id"]})
+        if not session["data"]:
+            return response(308)
+        return response(308, headers={"range": "bytes=0-{}".format(len(session["data"]) - 1)})
+
+    def list(self, query: map):
+        match = re.fullmatch(r"'([^']+)' in parents", query.get("q", ""))
+        files = sorted(self.children(match.group(1)), key=lambda file: file["id"])
+        start = int(query.get("pageToken", 0))
+        end = start + int(query.get("pageSize", 100))
+        result = {"files": [{"id": file["id"], "name": file["name"]} for file in files[start:end]]}
+        if end < len(files):
+            result["nextPageToken"] = str(end)
+        return response(200, result)
+
+    def batch(self, body: str, headers: map):
+        """
+        Answers each request of a multipart batch on its own
+        """
+        message = Parser().parsestr("content-type: {}\r\n\r\n{}".format(headers["content-type"], body))
+        parts = []
+        for part in message.get_payload():
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.split(" ")
+            head, _, inner_body = rest.replace("\r\n", "\n").partition("\n\n")
+            inner_headers = dict(line.split(":", 1) for line in head.splitlines() if ":" in line)
+            resp, content = self.request("https://www.googleapis.com" + path, method, inner_body or None,
+                                         {key.strip(): value.strip() for key, value in inner_headers.items()},
+                                         in_batch=True)
+            parts.append("--BATCH\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n"
+                         "HTTP/1.1 {} Status\r\nContent-Type: application/json\r\n\r\n{}\r\n"
+                         .format(part["Content-ID"][1:-1], resp.status, content.decode("UTF-8")))
+        return response(200, ("".join(parts) + "--BATCH--").encode("UTF-8"),
+                        {"content-type": "multipart/mixed; boundary=BATCH"})
+
+
+def kind_of(method: str, path: str, query: map) -> str:
+    """
+    @return: upload, media, list or meta
+    """
+    if path.startswith("/upload/"):
+        return "upload"
+    if query.get("alt") == "media":
+        return "media"
+    if path.endswith("/files") and method == "GET":
+        return "list"
+    return "meta"
+
+
+class FakeHttp:
+    def __init__(self, drive: FakeDrive):
+        """
+        httplib2.Http answered by a FakeDrive
+        """
+        self.drive = drive
+        self.timeout = None
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        return self.drive.request(uri, method, body, headers)
+
+
+def install(monkeypatch, drive: FakeDrive):
+    """
+    Makes DriveStorage talk to drive, with no credentials
+    """
+    def build_service(creds, limiter=None):
+        http = drive.http()
+        if limiter is not None:
+            http = ThrottledHttp(http, limiter)
+        return build_from_document(get_discovery_document(), http=http)
+
+    monkeypatch.setattr(sbs.storage, "get_credentials", lambda config: None)
+    monkeypatch.setattr(sbs.service_getter, "build_service", build_service)
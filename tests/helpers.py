@@ -0,0 +1,69 @@
+import os
+import random
+
+from sbs.config import Config
+from sbs.file import File
+from sbs.file_manager import FileManager
+from sbs.navigator import Navigator
+
+
+def write_tree(root, files: map):
+    """
+    @param root: Directory to write files under
+    @param files: Map of relative path to data
+    """
+    for path, data in files.items():
+        path = os.path.join(str(root), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def random_tree(seed: int = 0, directories: int = 4, files: int = 6, max_size: int = 50000) -> map:
+    """
+    @return: Map of relative path to random data, of a few directories of small files
+    """
+    rand = random.Random(seed)
+    tree = {}
+    for d in range(directories):
+        for i in range(files):
+            directory = os.path.join("d{}".format(d), "sub") if i % 2 else "d{}".format(d)
+            tree[os.path.join(directory, "f{}".format(i))] = rand.randbytes(rand.randint(0, max_size))
+    return tree
+
+
+def read_tree(root) -> map:
+    """
+    @return: Map of relative path to data of every file under root
+    """
+    tree = {}
+    for directory, _, names in os.walk(str(root)):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                tree[os.path.relpath(path, str(root))] = f.read()
+    return tree
+
+
+def run_backup(config: Config, **kwargs) -> FileManager:
+    fm = FileManager(config=config)
+    fm.backup(config.backup_path, exclude_list=config.exclude, config=config, do=True, limit=None, **kwargs)
+    return fm
+
+
+def restore_latest(config: Config, destination, shards: bool = False):
+    """
+    Restores the whole of the newest backup, as the restore menu does
+    @param shards: Whether to walk the shards of the backup rather than its manifest
+    @return: Backup restored
+    """
+    navigator = Navigator(config.key, config)
+    backup = navigator.fm.find_latest_backup()
+    if shards:
+        root = backup.get_shard_root()
+        tree = File(True, None, ".", loader=lambda directory: navigator.load_shard(root, directory))
+    else:
+        tree = File.from_path_list(list(backup.get_files_list()))
+    errors = navigator.download_whole_dir(backup, tree, restoration_path=str(destination))
+    assert not errors, errors
+    return backup
@@ -0,0 +1,47 @@
+from collections import Counter
+
+from sbs.retry import RetryPolicy
+from sbs.storage import DriveStorage
+from fakedrive import error
+
+
+def make_folders(drive, count: int, files: int = 2) -> list:
+    folder_ids = [drive.add_folder("folder{}".format(i)) for i in range(count)]
+    for folder_id in folder_ids:
+        for i in range(files):
+            drive.create({"name": "object{}".format(i), "parents": [folder_id]}, b"")
+    return folder_ids
+
+
+def test_listing_many_folders_takes_a_round_trip_per_batch(drive):
+    storage = DriveStorage(None, retry_policy=RetryPolicy(base_delay=0), batch_size=100)
+    folder_ids = make_folders(drive, 300)
+
+    children = storage.list_many(folder_ids)
+
+    assert drive.round_trips == 3
+    assert sorted(children) == sorted(folder_ids)
+    assert all(len(files) == 2 for files in children.values())
+
+
+def test_failed_request_of_batch_is_retried_alone(drive):
+    storage = DriveStorage(None, retry_policy=RetryPolicy(base_delay=0))
+    folder_ids = make_folders(drive, 5)
+    failing = folder_ids[2]
+    sent = Counter()
+
+    def fault(method, uri, headers):
+        folder_id = next((folder_id for folder_id in folder_ids if folder_id in uri), None)
+        sent[folder_id] += 1
+        if folder_id == failing and sent[folder_id] == 1:
+            return error(503, "backendError")
+        return None
+
+    drive.faults.append(fault)
+    children = storage.list_many(folder_ids)
+
+    assert sorted(children) == sorted(folder_ids)
+    assert sent[failing] == 2
+    assert all(sent[folder_id] == 1 for folder_id in folder_ids if folder_id != failing)
+    # The first batch, then one holding the failed request alone
+    assert drive.round_trips == 2
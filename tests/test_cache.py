@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from sbs.cache import DIGEST_SIZE, ManifestCache
+
+SIZE = 1000
+
+
+@pytest.fixture
+def cache(tmp_path) -> ManifestCache:
+    # Room for three manifests of SIZE bytes
+    return ManifestCache(tmp_path / "cache", 3 * (SIZE + DIGEST_SIZE))
+
+
+def last_used(cache: ManifestCache, backup_id: str, when: int):
+    os.utime(cache.path(backup_id), (when, when))
+
+
+def test_get_returns_what_was_put(cache):
+    data = os.urandom(SIZE)
+    cache.put("a", data)
+
+    assert cache.get("a") == data
+    assert cache.get("b") is None
+
+
+def test_least_recently_used_are_evicted(cache):
+    for when, backup_id in enumerate("abc"):
+        cache.put(backup_id, os.urandom(SIZE))
+        last_used(cache, backup_id, 1000 + when)
+    # Using a makes b the least recently used
+    assert cache.get("a") is not None
+
+    cache.put("d", os.urandom(SIZE))
+
+    assert sorted(os.listdir(cache.directory)) == ["a", "c", "d"]
+    # Two manifests as large as three evict the two least recently used
+    last_used(cache, "d", 2000)
+    cache.put("e", os.urandom(2 * SIZE))
+
+    assert sorted(os.listdir(cache.directory)) == ["a", "e"]
+
+
+def test_manifest_larger_than_cache_is_not_kept(cache):
+    cache.put("a", os.urandom(SIZE))
+    cache.put("big", os.urandom(3 * SIZE + 2 * DIGEST_SIZE + 1))
+
+    assert cache.get("big") is None
+    assert cache.get("a") is not None
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:-1] + bytes([data[-1] ^ 1]),
+    lambda data: bytes([data[0] ^ 1]) + data[1:],
+    lambda data: data[:SIZE // 2],
+    lambda data: data[:DIGEST_SIZE - 1],
+    lambda data: b"",
+])
+def test_damaged_manifest_is_dropped(cache, damage):
+    cache.put("a", os.urandom(SIZE))
+    with open(cache.path("a"), "rb") as f:
+        data = f.read()
+    with open(cache.path("a"), "wb") as f:
+        f.write(damage(data))
+
+    assert cache.get("a") is None
+    assert not os.path.exists(cache.path("a"))
+
+
+@pytest.mark.parametrize("error", [OSError, KeyboardInterrupt])
+def test_failed_put_leaves_no_temporary_file(cache, monkeypatch, error):
+    cache.put("a", os.urandom(SIZE))
+
+    def replace(*args):
+        raise error()
+
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(error):
+        cache.put("b", os.urandom(SIZE))
+
+    assert os.listdir(cache.directory) == ["a"]
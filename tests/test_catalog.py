@@ -0,0 +1,106 @@
+import json
+
+from sbs.catalog import BackupCatalog
+from sbs.config import get_data_dir
+from sbs.file_manager import FileManager
+from sbs.stoof import Cryptologor
+
+from helpers import random_tree, run_backup, write_tree
+
+
+def add_backups(drive, config, times: list) -> list:
+    """
+    Adds empty backup folders, as FileManager.backup names them
+    @return: Ids of folders
+    """
+    c = Cryptologor(key_file=config.key)
+    return [drive.add_folder(c.encrypt_name(json.dumps({"dir": config.backup_path, "time": time})), config.parent_id)
+            for time in times]
+
+
+def count_decryptions(monkeypatch) -> list:
+    """
+    @return: List to which every name decrypted is appended
+    """
+    decrypted = []
+    decrypt_name = Cryptologor.decrypt_name
+
+    def counting(self, name):
+        decrypted.append(name)
+        return decrypt_name(self, name)
+
+    monkeypatch.setattr(Cryptologor, "decrypt_name", counting)
+    return decrypted
+
+
+def test_catalogued_names_are_not_decrypted(drive, drive_config, monkeypatch):
+    ids = add_backups(drive, drive_config, [1000.0, 3000.0, 2000.0])
+    decrypted = count_decryptions(monkeypatch)
+
+    backups = FileManager(config=drive_config).list_backups()
+    assert len(decrypted) == 3
+    assert [(backup.id, backup.time) for backup in backups] == [(ids[1], 3000.0), (ids[2], 2000.0), (ids[0], 1000.0)]
+
+    decrypted.clear()
+    backups = FileManager(config=drive_config).list_backups()
+
+    assert decrypted == []
+    assert [(backup.id, backup.time, backup.source) for backup in backups] == [
+        (ids[1], 3000.0, drive_config.backup_path), (ids[2], 2000.0, drive_config.backup_path),
+        (ids[0], 1000.0, drive_config.backup_path)]
+
+
+def test_renamed_folder_is_decrypted_again(drive, drive_config, monkeypatch):
+    folder_id, = add_backups(drive, drive_config, [1000.0])
+    FileManager(config=drive_config).list_backups()
+    c = Cryptologor(key_file=drive_config.key)
+    drive.files[folder_id]["name"] = c.encrypt_name(json.dumps({"dir": "/elsewhere", "time": 5000.0}))
+    decrypted = count_decryptions(monkeypatch)
+
+    backup, = FileManager(config=drive_config).list_backups()
+
+    assert len(decrypted) == 1
+    assert (backup.source, backup.time) == ("/elsewhere", 5000.0)
+
+
+def test_listing_follows_every_page(drive, drive_config, monkeypatch):
+    monkeypatch.setattr("sbs.storage.LIST_PAGE_SIZE", 2)
+    ids = add_backups(drive, drive_config, [float(time) for time in range(7)])
+
+    backups = FileManager(config=drive_config).list_backups()
+
+    assert [backup.id for backup in backups] == ids[::-1]
+    assert drive.count("list") == 4
+
+
+def test_gone_backups_are_pruned(drive, drive_config):
+    ids = add_backups(drive, drive_config, [1000.0, 2000.0, 3000.0])
+    FileManager(config=drive_config).list_backups()
+    catalog = BackupCatalog(get_data_dir() / "index" / "catalog.sqlite")
+    # Backups of another parent folder are not this one's to prune
+    catalog.add("other", {"id": "elsewhere", "name": "name"}, {"dir": "/", "time": 1.0})
+    del drive.files[ids[1]]
+
+    backups = FileManager(config=drive_config).list_backups()
+
+    assert [backup.id for backup in backups] == [ids[2], ids[0]]
+    assert catalog.file(ids[1]) is None
+    assert catalog.file(ids[0]) is not None
+    assert catalog.file("elsewhere") is not None
+
+
+def test_stats_are_read_once(drive, drive_config, tmp_path):
+    write_tree(tmp_path / "src", random_tree(seed=21))
+    run_backup(drive_config)
+    fm = FileManager(config=drive_config)
+    backup, = fm.list_backups()
+    fm.load_stats([backup])
+    stats = backup.get_stats()
+    assert stats["count"] == 24
+
+    media = drive.count("media")
+    backup, = FileManager(config=drive_config).list_backups()
+
+    assert backup.get_cached_stats() == stats
+    assert backup.get_stats() == stats
+    assert drive.count("media") == media
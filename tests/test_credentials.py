@@ -0,0 +1,33 @@
+from sbs.service_getter import SharedCredentials
+
+
+class RacedCredentials:
+    """
+    Credentials which another thread refreshes right as they are found expired
+    """
+    def __init__(self):
+        self.token = "old"
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        valid = self.token != "old"
+        self.token = "new"
+        return valid
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = "newer"
+
+    def apply(self, headers):
+        headers["authorization"] = "Bearer " + self.token
+
+
+def test_credentials_refreshed_meanwhile_are_not_refreshed_again():
+    creds = RacedCredentials()
+    headers = {}
+
+    SharedCredentials(creds).before_request(None, "GET", "https://www.googleapis.com/", headers)
+
+    assert creds.refreshes == 0
+    assert headers["authorization"] == "Bearer new"
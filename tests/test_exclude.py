@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+import sbs.scanner
+from sbs.exclude import ExclusionRules
+from sbs.scanner import scan_tree
+
+from helpers import write_tree
+
+ROOT = os.path.abspath("/backup/root")
+
+
+def stat(size: int) -> os.stat_result:
+    return os.stat_result((0o100644, 0, 0, 1, 0, 0, size, 0, 0, 0))
+
+
+def excluded(rules: ExclusionRules, path: str) -> bool:
+    """
+    @return: Whether a file at path would be left out of a scan, by its own rules or those of a directory above it
+    """
+    if rules.excludes_file(path):
+        return True
+    while os.path.dirname(path) not in ("", "."):
+        path = os.path.dirname(path)
+        if rules.excludes_dir(path):
+            return True
+    return False
+
+
+@pytest.mark.parametrize("entry, excluded_paths, kept", [
+    # A plain name, at any depth
+    ("node_modules", ["./node_modules", "./a/b/node_modules", "./node_modules/x"], ["./a/node_modules2", "./a"]),
+    # Anchored to the root of the backup
+    ("./build", ["./build", "./build/x"], ["./a/build", "./builds"]),
+    ("a/b", ["./a/b", "./a/b/c"], ["./x/a/b", "./a", "./a/bc"]),
+    ("a/./b/../b", ["./a/b"], ["./x/a/b"]),
+    (os.path.join(ROOT, "a", "b"), ["./a/b", "./a/b/c"], ["./x/a/b", "./a"]),
+    # Outside of the backup, so excludes nothing
+    (os.path.join(os.path.dirname(ROOT), "a"), [], ["./a", "./root/a"]),
+    (ROOT, [], ["./a"]),
+    # Name globs, at any depth
+    ("*.log", ["./x.log", "./a/b/c.log"], ["./a/log", "./x.log.1"]),
+    ("f?", ["./f1", "./a/fx"], ["./f", "./f12"]),
+    ("[ab].txt", ["./a.txt", "./d/b.txt"], ["./c.txt"]),
+    ("[!ab].txt", ["./c.txt"], ["./a.txt", "./b.txt"]),
+    # Path globs, anchored, "*" not crossing directories
+    ("a/*/c", ["./a/x/c"], ["./a/x/y/c", "./b/x/c", "./a/c"]),
+    ("./*.tmp", ["./x.tmp"], ["./a/x.tmp"]),
+    ("**/cache/*.bin", ["./cache/x.bin", "./a/b/cache/x.bin"], ["./cache/a/x.bin", "./x.bin"]),
+    ("a/**", ["./a/x", "./a/x/y"], ["./b/a/x"]),
+    ("a/**/z", ["./a/z", "./a/x/y/z"], ["./a/x/zz"]),
+])
+def test_rules(entry, excluded_paths, kept):
+    rules = ExclusionRules([entry], ROOT)
+
+    for path in excluded_paths:
+        assert excluded(rules, path), path
+    for path in kept:
+        assert not excluded(rules, path) and not rules.excludes_dir(path), path
+
+
+def test_directory_only_rules():
+    rules = ExclusionRules(["build/", "./out/", "*.d/"], ROOT)
+
+    assert rules.excludes_dir("./build") and rules.excludes_dir("./a/build")
+    assert not rules.excludes_file("./build") and not rules.excludes_file("./a/build")
+    assert rules.excludes_dir("./out") and not rules.excludes_dir("./a/out") and not rules.excludes_file("./out")
+    assert rules.excludes_dir("./a/x.d") and not rules.excludes_file("./a/x.d")
+
+
+def test_size_and_extension_rules():
+    rules = ExclusionRules([], ROOT, max_file_size=100, extensions=["iso", ".VMDK"])
+
+    assert rules.excludes_file("./big", stat(101))
+    assert not rules.excludes_file("./small", stat(100))
+    assert rules.excludes_file("./a/disk.iso", stat(0)) and rules.excludes_file("./disk.vmdk", stat(0))
+    assert not rules.excludes_file("./iso", stat(0))
+    # Not rules of directories
+    assert not rules.excludes_dir("./x.iso")
+
+
+def test_no_rules():
+    rules = ExclusionRules(None, ROOT)
+
+    assert not rules.excludes_dir(".") and not rules.excludes_file("./a", stat(10 ** 12))
+
+
+def test_pruned_directories_are_not_scanned(tmp_path, monkeypatch):
+    write_tree(tmp_path / "root", {path: b"x" for path in [
+        "keep/a", "keep/node_modules/pkg/b", "build/c", "keep/build/d", "cache/x/e.bin", "keep/f.log", "g"
+    ]})
+    monkeypatch.chdir(tmp_path / "root")
+    rules = ExclusionRules(["node_modules", "./build/", "cache/*/", "*.log"], str(tmp_path / "root"))
+    scanned = []
+
+    def scan_dir(path, *args):
+        scanned.append(path)
+        return list_dir(path, *args)
+
+    list_dir = sbs.scanner.scan_dir
+    monkeypatch.setattr(sbs.scanner, "scan_dir", scan_dir)
+    files = [path for path, _ in scan_tree(".", jobs=2, exclude_dir=rules.excludes_dir,
+                                           exclude_file=rules.excludes_file)]
+
+    assert sorted(files) == ["./g", "./keep/a", "./keep/build/d"]
+    assert sorted(scanned) == [".", "./cache", "./keep", "./keep/build"]
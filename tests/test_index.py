@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import pytest
+
+import sbs.file_manager
+from sbs.config import get_data_dir
+from sbs.manifest import decode_manifest
+from helpers import write_tree, random_tree, read_tree, run_backup, restore_latest
+
+
+def vanishing_scan(monkeypatch, paths: set):
+    """
+    Makes files vanish right after the scan found them
+    """
+    scan_tree = sbs.file_manager.scan_tree
+
+    def scan(*args, **kwargs):
+        for path, st in scan_tree(*args, **kwargs):
+            if os.path.relpath(path) in paths:
+                os.remove(path)
+            yield path, st
+
+    monkeypatch.setattr(sbs.file_manager, "scan_tree", scan)
+
+
+@pytest.mark.parametrize("pack_threshold", [None, 100000])
+def test_files_vanishing_during_scan_do_not_abort_backup(local_config, monkeypatch, tmp_path, pack_threshold):
+    local_config.pack_threshold = pack_threshold
+    tree = random_tree()
+    write_tree(local_config.backup_path, tree)
+    run_backup(local_config)
+
+    # Stat changed but not size, so the index hashes it
+    touched = os.path.join(local_config.backup_path, "d0/f2")
+    os.utime(touched, (0, 0))
+    # Missing from the index, so the previous backup is checked
+    write_tree(local_config.backup_path, {"d0/new": b"new"})
+    vanishing_scan(monkeypatch, {"d0/f2", "d0/new"})
+    run_backup(local_config)
+
+    del tree["d0/f2"]
+    backup = restore_latest(local_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+    assert "./d0/f2" not in backup.get_files_list()
+    with open(os.path.join(local_config.log_dir, "latest")) as f:
+        log = f.read()
+    assert "Error with ./d0/f2" in log and "Error with ./d0/new" in log
+
+
+def test_delta_manifest_is_written_without_downloads(drive_config, drive, tmp_path):
+    tree = random_tree(seed=5)
+    tree["d0/packed"] = b"packed"
+    write_tree(drive_config.backup_path, tree)
+    drive_config.pack_threshold = 100000
+    run_backup(drive_config)
+    # Changed since, so the second manifest holds a file whose stat misses the index
+    write_tree(drive_config.backup_path, {"d0/new": b"new"})
+    tree["d0/new"] = b"new"
+
+    # As if evicted, so the previous manifest could only be had by downloading it
+    shutil.rmtree(get_data_dir() / "cache" / "manifests")
+    drive.log.clear()
+    fm = run_backup(drive_config)
+
+    assert drive.count("list") == 0 and drive.count("media") == 0
+    latest, previous = fm.list_backups()
+    assert decode_manifest(latest.get_manifest_data())["parent"] == previous.id
+    restore_latest(drive_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
@@ -0,0 +1,88 @@
+import base64
+import io
+import json
+import os
+
+import pytest
+from Cryptodome.Cipher import AES
+from Cryptodome.Hash import SHA256
+
+from sbs.stoof import BLOCK_SIZE, Cryptologor, pad
+from sbs.storage import LocalStorage
+from sbs.values import CHUNK_SIZE, VERSION_CODE
+
+from helpers import random_tree, read_tree, restore_latest
+
+
+def legacy_encrypt(c: Cryptologor, data: bytes) -> bytes:
+    """
+    Cryptologor.encrypt of alpha2.0, an IV followed by an AES-CBC cipher of the padded data
+    """
+    iv = os.urandom(BLOCK_SIZE)
+    return iv + AES.new(c.key, AES.MODE_CBC, iv).encrypt(pad(data))
+
+
+def legacy_encrypt_name(c: Cryptologor, name: str) -> str:
+    return base64.urlsafe_b64encode(legacy_encrypt(c, name.encode("UTF-8"))).decode("UTF-8")
+
+
+def put(storage: LocalStorage, data: bytes, name: str, parent: str) -> str:
+    return storage.put(io.BytesIO(data), len(data), name, parent)
+
+
+@pytest.fixture
+def legacy_backup(local_config) -> map:
+    """
+    Backup of a tree laid out as alpha2.0 left it: folder and object names, objects and the JSON manifest all
+    encrypted with AES-CBC, one object per piece of each file
+    @return: Map of relative path to data of the tree backed up
+    """
+    tree = random_tree(seed=19)
+    # Spans several chunks, so is decrypted over several writes
+    tree["big"] = os.urandom(2 * CHUNK_SIZE + 1000)
+    # Fits the block size, so is padded with a whole block
+    tree["even"] = os.urandom(4 * BLOCK_SIZE)
+    c = Cryptologor(key_file=local_config.key)
+    storage = LocalStorage(local_config.storage_path)
+    folder_id = storage.create_folder(legacy_encrypt_name(c, json.dumps({"dir": local_config.backup_path,
+                                                                           "time": 1600000000.0})),
+                                      local_config.parent_id)
+    files = []
+    for index, (path, data) in enumerate(tree.items()):
+        source = os.path.join(".", path)
+        cipher = legacy_encrypt(c, data)
+        name = legacy_encrypt_name(c, json.dumps({"path": source, "index": 0}))
+        files.append({
+            "source": source,
+            "digest": base64.b64encode(SHA256.new(data).digest()).decode("UTF-8"),
+            "pieces": [{"id": put(storage, cipher, name, folder_id), "size": len(cipher)}],
+            "uploaded": 1600000000.0 + index,
+            "total_size": len(cipher)
+        })
+    manifest = json.dumps({"version": VERSION_CODE, "files": files}).encode("UTF-8")
+    put(storage, legacy_encrypt(c, manifest), legacy_encrypt_name(c, "backup_{}.json".format(VERSION_CODE)),
+        folder_id)
+    return tree
+
+
+def test_legacy_backup_restores(local_config, legacy_backup, tmp_path):
+    backup = restore_latest(local_config, tmp_path / "restored")
+
+    assert backup.time == 1600000000.0
+    assert read_tree(tmp_path / "restored") == legacy_backup
+
+
+def test_legacy_cipher_decrypts(local_config):
+    c = Cryptologor(key_file=local_config.key)
+    data = os.urandom(3 * CHUNK_SIZE + 7)
+    cipher = legacy_encrypt(c, data)
+    out = io.BytesIO()
+    writer = c.decrypting_writer(out)
+    for start in range(0, len(cipher), 100001):
+        writer.write(cipher[start:start + 100001])
+    writer.finish()
+
+    assert c.decrypt(cipher) == data
+    assert out.getvalue() == data
+    assert c.decrypt_name(legacy_encrypt_name(c, "backup_{}.json".format(VERSION_CODE))) == \
+        "backup_{}.json".format(VERSION_CODE)
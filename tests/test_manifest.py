@@ -0,0 +1,137 @@
+import json
+import zlib
+
+import pytest
+
+from sbs.manifest import COLUMN_LENGTH, MAGIC, PREAMBLE, aggregates, decode_manifest, encode_manifest, read_header
+from sbs.values import VERSION_CODE
+
+
+def file_map(source: str, **kwargs) -> map:
+    file = {
+        "source": source,
+        "digest": "n4bQgYhMfWWaL+qgxVrQFaO/TxsrC4Is0V1sFbDwCgg=",
+        "digest_algorithm": "sha256-tree",
+        "pieces": [{"id": "bundle", "size": 1000, "offset": 64}],
+        "uploaded": 1700000000.5,
+        "total_size": 1000
+    }
+    file.update(kwargs)
+    return file
+
+
+def roundtrip(manifest: map) -> map:
+    return decode_manifest(encode_manifest(manifest, aggregates(manifest.get("files"))))
+
+
+def by_source(files: list) -> list:
+    return sorted(files, key=lambda file: file.get("source"))
+
+
+def downgrade(data: bytes) -> bytes:
+    """
+    @return: Binary manifest as format 1 wrote it, without the digest algorithm columns
+    """
+    _, _, header_length = PREAMBLE.unpack_from(data)
+    header = data[PREAMBLE.size:PREAMBLE.size + header_length]
+    body = zlib.decompress(data[PREAMBLE.size + header_length:])
+    position = 0
+    for _ in range(17):
+        length, = COLUMN_LENGTH.unpack_from(body, position)
+        position += COLUMN_LENGTH.size + length
+    header = json.dumps(dict(json.loads(header), format=1)).encode("UTF-8")
+    return PREAMBLE.pack(MAGIC, 1, len(header)) + header + zlib.compress(body[:position])
+
+
+def test_files_roundtrip():
+    files = [
+        file_map("./b/file"),
+        file_map("./a/file", digest_algorithm="blake2b-tree",
+                 pieces=[{"id": "x", "size": 10}, {"id": "y", "size": 20}, {"id": "bundle", "size": 5, "offset": 0}]),
+        file_map("./a/other", digest_algorithm=None),
+    ]
+    manifest = {"version": VERSION_CODE, "files": files}
+
+    decoded = roundtrip(manifest)
+
+    assert decoded["version"] == VERSION_CODE
+    assert "deleted" not in decoded
+    assert decoded["files"] == by_source(files)
+
+
+def test_empty_manifest():
+    data = encode_manifest({"version": VERSION_CODE, "files": []}, aggregates([]))
+
+    assert read_header(data)["stats"] == {"count": 0, "total_size": 0, "dirs": {}}
+    assert decode_manifest(data) == {"version": VERSION_CODE, "files": []}
+
+
+def test_delta_roundtrip():
+    manifest = {"version": VERSION_CODE, "parent": "parent", "depth": 3, "files": [],
+                "deleted": ["./z", "./a/gone", "./a/g"]}
+
+    decoded = roundtrip(manifest)
+
+    assert decoded == dict(manifest, deleted=sorted(manifest["deleted"]))
+
+
+@pytest.mark.parametrize("sources", [
+    ["./été/ñandú", "./été/ñ", "./日本語/ファイル", "./😀/😀😀"],
+    # Names which were not valid UTF-8 on disk, as os.walk gives them
+    ["./bad\udcff\udcfe", "./bad\udcff"],
+    ["./with\nnewline", "./with space", "./", "./a//b", ""],
+])
+def test_odd_paths_roundtrip(sources):
+    files = [file_map(source) for source in sources]
+
+    assert roundtrip({"files": files})["files"] == by_source(files)
+
+
+def test_missing_keys_roundtrip():
+    files = [
+        {"source": "./bare", "pieces": []},
+        {"source": "./no-digest", "pieces": [{"id": "x", "size": 1}], "total_size": 1},
+        {"source": "./no-size", "digest": "AAAA", "pieces": [{"id": "x", "size": 1, "offset": 5}]},
+        {"source": "./no-time", "digest": "AAAA", "uploaded": 1.0, "pieces": []},
+    ]
+
+    assert roundtrip({"files": files})["files"] == by_source(files)
+
+
+def test_odd_values_roundtrip():
+    files = [
+        # Legacy entries of alpha1, and values which do not fit a column, are kept as they are
+        file_map("./legacy", size=10, total_size=None, uploaded="yesterday"),
+        file_map("./odd-digest", digest="not base64!"),
+        file_map("./odd-pieces", pieces=[{"id": "x", "size": 1, "extra": True}]),
+        file_map("./odd-algorithm", digest_algorithm=["sha256"]),
+    ]
+
+    assert roundtrip({"files": files})["files"] == by_source(files)
+
+
+def test_format_1_manifest_loads():
+    files = [file_map("./a"), file_map("./b")]
+    data = downgrade(encode_manifest({"version": VERSION_CODE, "files": files}, aggregates(files)))
+
+    assert read_header(data)["format"] == 1
+    # Format 1 knew of no digest algorithm but the legacy one
+    for file in files:
+        file.pop("digest_algorithm")
+    assert decode_manifest(data) == {"version": VERSION_CODE, "files": files}
+
+
+def test_json_manifest_loads():
+    manifest = {"version": VERSION_CODE, "files": [file_map("./a"), {"source": "./b", "pieces": []}]}
+    data = json.dumps(manifest).encode("UTF-8")
+
+    assert read_header(data) is None
+    assert decode_manifest(data) == manifest
+
+
+def test_newer_format_is_refused():
+    data = bytearray(encode_manifest({"files": []}, aggregates([])))
+    data[len(MAGIC)] += 1
+
+    with pytest.raises(ValueError):
+        read_header(bytes(data))
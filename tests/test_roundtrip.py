@@ -0,0 +1,220 @@
+import os
+import random
+import shutil
+from functools import partial
+
+import pytest
+
+from sbs.backup import MissingParentError
+from sbs.config import get_data_dir
+from sbs.file import File
+from sbs.file_manager import FileManager
+from sbs.manifest import decode_manifest
+from sbs.navigator import Navigator
+from sbs.values import CHUNK_SIZE
+from helpers import write_tree, random_tree, read_tree, run_backup, restore_latest
+
+
+@pytest.fixture(params=["local_config", "drive_config"])
+def config(request):
+    return request.getfixturevalue(request.param)
+
+
+def test_backup_restores_tree(config, tmp_path):
+    tree = random_tree()
+    # Several chunks
+    tree["big"] = os.urandom(3 * CHUNK_SIZE + 7)
+    tree["empty"] = b""
+    write_tree(config.backup_path, tree)
+
+    run_backup(config, jobs=4)
+    restore_latest(config, tmp_path / "restore")
+
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def test_backup_restores_tree_encrypted_on_process_pool(local_config, tmp_path):
+    local_config.crypto_processes = 2
+    tree = {"big": os.urandom(3 * CHUNK_SIZE + 7), "small": b"small"}
+    write_tree(local_config.backup_path, tree)
+
+    run_backup(local_config, jobs=2)
+    restore_latest(local_config, tmp_path / "restore")
+
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def test_restore_through_shards(config, tmp_path):
+    tree = random_tree(seed=1)
+    write_tree(config.backup_path, tree)
+
+    run_backup(config)
+    restore_latest(config, tmp_path / "restore", shards=True)
+
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def test_later_backups_restore_changes(config, tmp_path):
+    tree = random_tree(seed=2)
+    write_tree(config.backup_path, tree)
+    run_backup(config)
+
+    # Unchanged
+    run_backup(config)
+    # Changed, added and deleted files
+    tree["d0/f0"] = b"changed"
+    tree["d9/new"] = b"new"
+    os.remove(os.path.join(config.backup_path, "d1/f2"))
+    del tree["d1/f2"]
+    write_tree(config.backup_path, tree)
+    run_backup(config)
+
+    backup = restore_latest(config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+    assert backup.get_stats()["count"] == len(tree)
+
+
+@pytest.mark.parametrize("option", [None, "pack_threshold", "dedup_threshold"])
+def test_digest_algorithm_of_each_file_is_kept(local_config, tmp_path, option):
+    if option is not None:
+        setattr(local_config, option, 100000)
+    tree = random_tree(seed=7)
+    # Several leaves of a tree hash
+    tree["big"] = os.urandom(2 * CHUNK_SIZE)
+    write_tree(local_config.backup_path, tree)
+    run_backup(local_config)
+
+    local_config.digest_algorithm = "blake2b-tree"
+    tree["d0/f0"] = b"changed"
+    tree["big"] = os.urandom(2 * CHUNK_SIZE)
+    tree["d9/new"] = b"new"
+    write_tree(local_config.backup_path, {path: tree[path] for path in ["d0/f0", "big", "d9/new"]})
+    run_backup(local_config)
+
+    backup = restore_latest(local_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+    algorithms = {file["source"]: file.get("digest_algorithm") for file in backup.get_files_list().values()}
+    assert algorithms.pop("./d0/f0") == algorithms.pop("./big") == algorithms.pop("./d9/new") == "blake2b-tree"
+    # Files which were not uploaded again keep the digests of the first backup, made with the legacy algorithm
+    assert set(algorithms.values()) == {None}
+
+
+@pytest.mark.parametrize("option", ["pack_threshold", "dedup_threshold"])
+def test_packed_and_deduplicated_files_restore(config, tmp_path, option):
+    tree = random_tree(seed=3)
+    tree["big"] = os.urandom(2 * CHUNK_SIZE)
+    # Duplicated and shifted content
+    tree["copy"] = tree["big"]
+    tree["shifted"] = b"abc" + tree["big"]
+    write_tree(config.backup_path, tree)
+    setattr(config, option, 100000)
+
+    run_backup(config, jobs=2)
+    restore_latest(config, tmp_path / "restore")
+
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def stored_bytes(drive) -> int:
+    return sum(len(file["data"]) for file in drive.files.values())
+
+
+def test_duplicated_content_is_uploaded_once(drive_config, drive, tmp_path):
+    drive_config.dedup_threshold = 100000
+    big = random.Random(9).randbytes(3 * CHUNK_SIZE)
+    # A copy only refers to the chunks of big
+    write_tree(drive_config.backup_path, {"big": big, "copy": big})
+    run_backup(drive_config, jobs=4)
+    stored = stored_bytes(drive)
+    assert len(big) < stored < len(big) + len(big) // 10
+
+    # A shifted copy only adds the chunk around the shift
+    write_tree(drive_config.backup_path, {"shifted": b"abc" + big})
+    run_backup(drive_config)
+
+    assert stored_bytes(drive) - stored < len(big) // 2
+    restore_latest(drive_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == {"big": big, "copy": big, "shifted": b"abc" + big}
+
+
+def test_local_storage_keeps_objects_whole(local_config):
+    write_tree(local_config.backup_path, random_tree(seed=4))
+    run_backup(local_config)
+
+    leftovers = [name for _, _, names in os.walk(local_config.storage_path) for name in names
+                 if name.endswith(".tmp")]
+    assert leftovers == []
+
+
+def delete_backup(fm, backup):
+    """
+    Deletes a backup folder and every object in it
+    """
+    fm.storage.delete(backup.id, [file["id"] for file in fm.storage.list(backup.id)])
+    fm.storage.delete(fm.config.parent_id, [backup.id])
+
+
+def test_deduplicated_chunks_outlive_their_backup(config, tmp_path):
+    config.dedup_threshold = 100000
+    config.checkpoint_interval = 1
+    data = os.urandom(2 * CHUNK_SIZE)
+    write_tree(config.backup_path, {"big": data})
+    run_backup(config)
+
+    # Moved, so its chunks are found in the chunk store rather than uploaded again
+    os.rename(os.path.join(config.backup_path, "big"), os.path.join(config.backup_path, "moved"))
+    fm = run_backup(config)
+    delete_backup(fm, fm.list_backups()[1])
+
+    restore_latest(config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == {"moved": data}
+
+
+def test_reused_shards_outlive_their_backup(config, tmp_path):
+    config.checkpoint_interval = 1
+    # Empty files have no pieces, so the later backup refers to the earlier one through its shards alone
+    write_tree(config.backup_path, {"d0/empty": b"", "d1/empty": b""})
+    run_backup(config)
+
+    os.remove(os.path.join(config.backup_path, "d1/empty"))
+    fm = run_backup(config)
+    delete_backup(fm, fm.list_backups()[1])
+
+    restore_latest(config, tmp_path / "restore", shards=True)
+    assert read_tree(tmp_path / "restore") == {"d0/empty": b""}
+
+
+def test_backup_after_lost_parent_writes_full_manifest(config, tmp_path):
+    write_tree(config.backup_path, {"a": b"a"})
+    first = run_backup(config).list_backups()[0]
+    os.remove(os.path.join(config.backup_path, "a"))
+    write_tree(config.backup_path, {"b": b"b"})
+    run_backup(config)
+    fm = FileManager(config=config)
+    delete_backup(fm, first)
+
+    with pytest.raises(MissingParentError, match=first.id):
+        fm.list_backups()[0].get_files_list()
+
+    write_tree(config.backup_path, {"c": b"c"})
+    fm = run_backup(config)
+    assert "parent" not in decode_manifest(fm.list_backups()[0].get_manifest_data())
+    restore_latest(config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == {"b": b"b", "c": b"c"}
+
+
+def test_restore_menu_fetches_shards_only(drive_config, drive):
+    write_tree(drive_config.backup_path, random_tree(seed=6))
+    run_backup(drive_config)
+    # Cold, as on another machine
+    shutil.rmtree(get_data_dir())
+    drive.log.clear()
+
+    navigator = Navigator(drive_config.key, drive_config)
+    backup = navigator.fm.find_latest_backup()
+    assert drive.count("media") == 0
+    root = File(True, None, ".", loader=partial(navigator.load_shard, backup.get_shard_root()))
+
+    assert sorted(child.name for child in root.children) == ["d0", "d1", "d2", "d3"]
+    # The shard index and the bundle of the root shard, no manifest
+    assert drive.count("media") == 2
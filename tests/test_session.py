@@ -0,0 +1,131 @@
+import io
+import os
+import sqlite3
+from unittest.mock import Mock
+
+import pytest
+
+import sbs.file_manager
+from sbs.config import get_data_dir
+from sbs.file_manager import FileManager
+from sbs.index import StatIndex
+from sbs.manifest import decode_manifest
+from sbs.session import SessionJournal
+from sbs.sha import new_hash
+from sbs.values import CHUNK_SIZE, VERSION_CODE
+from helpers import write_tree, random_tree, read_tree, run_backup, restore_latest
+
+
+def interrupting_scan(monkeypatch, after: int):
+    """
+    Interrupts the backup as if with ^C once the scan found so many files
+    """
+    scan_tree = sbs.file_manager.scan_tree
+
+    def scan(*args, **kwargs):
+        for i, found in enumerate(scan_tree(*args, **kwargs)):
+            if i == after:
+                raise KeyboardInterrupt
+            yield found
+
+    monkeypatch.setattr(sbs.file_manager, "scan_tree", scan)
+
+
+def interrupt_backup(config, monkeypatch, after: int = 10):
+    with monkeypatch.context() as m:
+        interrupting_scan(m, after=after)
+        run_backup(config, jobs=1)
+
+
+def read_checkpoint(backup) -> map:
+    """
+    @return: Map of source to file map of the checkpoint manifest of an interrupted backup
+    """
+    data = backup.download_named("checkpoint_{}.manifest".format(VERSION_CODE))
+    return {file["source"]: file for file in decode_manifest(backup.c.decrypt(data))["files"]}
+
+
+def test_interrupted_backup_is_resumed(local_config, monkeypatch, tmp_path):
+    tree = random_tree()
+    write_tree(local_config.backup_path, tree)
+    interrupt_backup(local_config, monkeypatch)
+
+    fm = FileManager(config=local_config)
+    interrupted, = fm.list_backups()
+    checkpoint = read_checkpoint(interrupted)
+    # Only a checkpoint of what was uploaded, which is not taken for a backup, and nothing recorded as backed up yet
+    assert 0 < len(checkpoint) <= 10
+    assert interrupted.get_files_list() is None and fm.find_latest_backup() is None
+    journal = SessionJournal(get_data_dir() / "sessions" / "{}.sqlite".format(local_config.parent_id))
+    assert journal.get_session(local_config.backup_path)[0] == interrupted.id
+    journal.close()
+    index = StatIndex(get_data_dir() / "index" / "{}.sqlite".format(local_config.parent_id), local_config.backup_path)
+    assert index.get_snapshot() is None and index.entries() == {}
+    index.close()
+
+    run_backup(local_config, resume=True)
+
+    backup, = fm.list_backups()
+    assert backup.id == interrupted.id
+    restore_latest(local_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+    # Files of the checkpoint were not uploaded again
+    resumed = backup.get_files_list()
+    assert all(resumed[source]["pieces"] == file["pieces"] for source, file in checkpoint.items())
+
+
+def test_backup_after_interrupted_one_is_not_a_delta_of_it(local_config, monkeypatch, tmp_path):
+    tree = random_tree()
+    write_tree(local_config.backup_path, tree)
+    run_backup(local_config)
+    tree["d0/f0"] = b"changed"
+    write_tree(local_config.backup_path, tree)
+    interrupt_backup(local_config, monkeypatch, after=3)
+    # As on another machine, so the previous backup is looked for on the storage
+    os.remove(get_data_dir() / "index" / "{}.sqlite".format(local_config.parent_id))
+
+    fm = run_backup(local_config)
+
+    latest, interrupted, first = fm.list_backups()
+    assert decode_manifest(latest.get_manifest_data())["parent"] == first.id
+    restore_latest(local_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def test_journal_of_older_version_is_migrated(tmp_path):
+    path = tmp_path / "session.sqlite"
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE pieces (path TEXT, piece_index INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+               "ctime_ns INTEGER, iv BLOB, uri TEXT, piece TEXT, PRIMARY KEY (path, piece_index))")
+    db.execute("INSERT INTO pieces VALUES ('./f', 0, 1, 2, 3, 4, x'00', 'uri', NULL)")
+    db.commit()
+    db.close()
+
+    journal = SessionJournal(path)
+    assert journal.get_pieces("./f", (1, 2, 3, 4)) == {0: (b"\0", "uri", None)}
+    journal.close()
+
+
+def test_piece_whose_session_completed_before_it_was_journaled_is_hashed(drive_config, drive, monkeypatch,
+                                                                        tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE + 7)
+    write_tree(tmp_path, {"big": data})
+    path = str(tmp_path / "big")
+    folder_id = drive.add_folder("folder")
+    fm = FileManager(config=drive_config)
+    journal = SessionJournal(tmp_path / "session.sqlite")
+
+    # Killed once Drive had the whole piece, but before the journal knew
+    with monkeypatch.context() as m:
+        m.setattr(journal, "finish_piece", Mock(side_effect=KeyboardInterrupt))
+        with pytest.raises(KeyboardInterrupt):
+            fm.upload_file(path, io.StringIO(), folder_id, journal=journal)
+    uploads = drive.count("upload")
+    file_digest, pieces, _ = fm.upload_file(path, io.StringIO(), folder_id, journal=journal)
+    journal.close()
+
+    # Only the status query of the session, which Drive answers with the object
+    assert drive.count("upload") == uploads + 1
+    sha = new_hash(fm.digest_algorithm)
+    sha.update(data)
+    assert file_digest == sha.digest()
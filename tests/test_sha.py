@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import os
+
+import pytest
+
+import sbs.sha
+from sbs.sha import LEGACY_ALGORITHM, TreeHash, digest, entry_algorithm, new_hash
+
+LEAF_SIZE = 1024
+
+
+@pytest.fixture(autouse=True)
+def leaf_size(monkeypatch):
+    # Small leaves, for trees of many leaves out of little data
+    monkeypatch.setattr(sbs.sha, "DIGEST_LEAF_SIZE", LEAF_SIZE)
+
+
+def tree_digest(hash_function, data: bytes) -> bytes:
+    """
+    Tree hash by its definition
+    """
+    leaves = [hash_function(b"\0" + data[i:i + LEAF_SIZE]).digest() for i in range(0, len(data), LEAF_SIZE)]
+    return hash_function(b"\1" + b"".join(leaves or [hash_function(b"\0").digest()])).digest()
+
+
+SIZES = [0, 1, LEAF_SIZE - 1, LEAF_SIZE, LEAF_SIZE + 1, 5 * LEAF_SIZE, 5 * LEAF_SIZE + 17]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("name", ["sha256", "blake2b"])
+def test_tree_hash_matches_definition(name, size):
+    data = os.urandom(size)
+    sha = new_hash(name + "-tree")
+    # Updates straddling leaves
+    for i in range(0, size, 700):
+        sha.update(data[i:i + 700])
+
+    assert isinstance(sha, TreeHash)
+    assert sha.digest() == tree_digest(sbs.sha.HASHES[name], data)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("algorithm", ["sha256-tree", "blake2b-tree", "sha256", "blake2b"])
+def test_file_digest_matches_stream(tmp_path, monkeypatch, algorithm, size):
+    # Leaves read in several buffers
+    monkeypatch.setattr(sbs.sha, "BUFFER_SIZE", 300)
+    data = os.urandom(size)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    sha = new_hash(algorithm)
+    sha.update(data)
+    expected = base64.b64encode(sha.digest()).decode("UTF-8")
+
+    assert digest(str(path), algorithm) == expected
+    assert digest(str(path), algorithm, workers=4) == expected
+
+
+def test_algorithms_differ():
+    digests = {algorithm: new_hash(algorithm) for algorithm in ["sha256", "sha256-tree", "blake2b", "blake2b-tree"]}
+    for sha in digests.values():
+        sha.update(b"data")
+
+    assert len({sha.digest() for sha in digests.values()}) == 4
+    assert digests["sha256"].digest() == hashlib.sha256(b"data").digest()
+
+
+@pytest.mark.parametrize("algorithm", ["md5", "sha256-tree-tree", "-tree", "tree"])
+def test_unknown_algorithm(algorithm):
+    with pytest.raises(ValueError):
+        new_hash(algorithm)
+
+
+def test_entry_algorithm():
+    assert entry_algorithm({"digest": "x"}) == LEGACY_ALGORITHM
+    assert entry_algorithm({"digest": "x", "digest_algorithm": "blake2b-tree"}) == "blake2b-tree"
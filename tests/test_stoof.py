@@ -0,0 +1,41 @@
+import io
+import os
+
+import pytest
+
+from sbs.stoof import Cryptologor, EncryptingReader
+from sbs.values import CHUNK_SIZE
+
+
+@pytest.fixture
+def c(tmp_path) -> Cryptologor:
+    return Cryptologor(key_file=str(tmp_path / "key"))
+
+
+def test_encrypting_reader_matches_encrypt(c):
+    data = os.urandom(2 * CHUNK_SIZE + 100)
+    reader = c.encrypting_reader(io.BytesIO(data), 0, len(data))
+
+    assert c.decrypt(reader.read()) == data
+
+
+@pytest.mark.parametrize("keep", [0, 1000, CHUNK_SIZE])
+@pytest.mark.parametrize("first, jump", [
+    (10, CHUNK_SIZE // 2),
+    # Past the end of the buffer by less than a chunk, which used to trim the buffer beyond its end
+    (CHUNK_SIZE, CHUNK_SIZE + 5000),
+    (100, CHUNK_SIZE + 1000),
+    (2 * CHUNK_SIZE, CHUNK_SIZE // 3),
+])
+def test_encrypting_reader_seeks_forward(c, keep, first, jump):
+    data = os.urandom(3 * CHUNK_SIZE + 100)
+    header = c.new_header()
+    expected = header + c.seal(header, 0, data, True)
+    reader = EncryptingReader(c, io.BytesIO(data), 0, len(data), header=header, keep=keep)
+
+    assert reader.read(first) == expected[:first]
+    reader.seek(first + jump)
+    assert reader.read(1000) == expected[first + jump:first + jump + 1000]
+    # Rewinding, as an upload does on retry
+    reader.seek(0)
+    assert reader.read() == expected
@@ -0,0 +1,65 @@
+import os
+import uuid
+from io import BytesIO
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from sbs.retry import RetryPolicy
+from sbs.storage import DriveStorage
+from sbs.values import CHUNK_SIZE
+from fakedrive import error
+
+
+@pytest.fixture
+def storage(drive):
+    return DriveStorage(None, retry_policy=RetryPolicy(max_attempts=3, base_delay=0))
+
+
+def open_session(drive, folder_id: str, data: bytes) -> str:
+    """
+    @return: URI of a resumable upload session holding data
+    """
+    session_id = uuid.uuid4().hex
+    drive.sessions[session_id] = {"metadata": {"name": "object", "parents": [folder_id]}, "data": bytearray(data)}
+    return "https://www.googleapis.com/upload/sessions/" + session_id
+
+
+def stored(drive, object_id: str) -> bytes:
+    return drive.files[object_id]["data"]
+
+
+def test_put_resumes_where_drive_left_off(storage, drive):
+    folder_id = drive.add_folder("folder")
+    data = os.urandom(2 * CHUNK_SIZE + 5)
+    uri = open_session(drive, folder_id, data[:CHUNK_SIZE])
+
+    object_id = storage.put(BytesIO(data), len(data), "object", folder_id, resume_uri=uri)
+
+    assert stored(drive, object_id) == data
+    # The status query and the two chunks left, no new session
+    assert drive.log == [("PUT", "upload")] * 3
+
+
+def test_put_of_expired_session_starts_over(storage, drive):
+    folder_id = drive.add_folder("folder")
+    data = os.urandom(CHUNK_SIZE + 5)
+    started = []
+
+    object_id = storage.put(BytesIO(data), len(data), "object", folder_id,
+                            resume_uri="https://www.googleapis.com/upload/sessions/expired", on_start=started.append)
+
+    assert stored(drive, object_id) == data
+    assert drive.count("upload") == 4 and len(started) == 1
+
+
+def test_put_gives_up_on_sessions_which_keep_expiring(storage, drive):
+    folder_id = drive.add_folder("folder")
+    drive.faults.append(lambda method, uri, headers: error(404, "notFound") if "/upload/sessions/" in uri else None)
+    data = os.urandom(CHUNK_SIZE + 5)
+
+    with pytest.raises(HttpError):
+        storage.put(BytesIO(data), len(data), "object", folder_id)
+
+    # One session per attempt of the retry policy
+    assert sum(1 for entry in drive.log if entry == ("POST", "upload")) == 3
@@ -0,0 +1,65 @@
+import os
+import time
+from io import BytesIO
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from sbs.file_manager import FileManager
+from sbs.values import CHUNK_SIZE
+from fakedrive import error
+
+
+def throttle(drive, count: int = None, status: int = 429):
+    """
+    Answers upload chunks with throttling errors asking to retry right away, the next count of them or all
+    """
+    left = [count]
+
+    def fault(method, uri, headers):
+        if "/upload/sessions/" not in uri or left[0] == 0:
+            return None
+        if left[0] is not None:
+            left[0] -= 1
+        return error(status, "rateLimitExceeded" if status == 403 else None, {"retry-after": "0"})
+
+    drive.faults.append(fault)
+
+
+def upload(fm: FileManager, folder_id: str, size: int = CHUNK_SIZE + 5) -> str:
+    data = os.urandom(size)
+    return fm.upload_piece(BytesIO(data), size, {"bundle": 0}, folder_id, None)
+
+
+@pytest.mark.parametrize("status", [429, 403])
+def test_limiter_backs_off_when_throttled_and_recovers(drive_config, drive, status):
+    fm = FileManager(config=drive_config)
+    fm.limiter.window = 0.05
+    fm.limiter.reset(8)
+    limit, rate = fm.limiter.limit, fm.limiter.rate
+    folder_id = drive.add_folder("folder")
+
+    throttle(drive, 2, status)
+    upload(fm, folder_id)
+
+    assert fm.limiter.limit < limit and fm.limiter.rate < rate
+    limit, rate = fm.limiter.limit, fm.limiter.rate
+    # The session, the throttled requests, the status query which follows them and the two chunks
+    assert drive.count("upload") == 1 + 2 + 1 + 2
+    for _ in range(3):
+        time.sleep(fm.limiter.window)
+        upload(fm, folder_id, 10)
+    assert fm.limiter.limit >= limit and fm.limiter.rate > rate
+
+
+def test_throttled_upload_gives_up_after_retry_limit(drive_config, drive):
+    fm = FileManager(config=drive_config)
+    folder_id = drive.add_folder("folder")
+
+    throttle(drive)
+    with pytest.raises(HttpError):
+        upload(fm, folder_id)
+
+    # The session and one chunk per attempt
+    assert drive.count("upload") == 1 + drive_config.retry_max_attempts
+    assert fm.limiter.limit >= 1 and fm.limiter.rate >= 1
@@ -0,0 +1,74 @@
+import builtins
+import os
+
+import sbs.file_manager
+from sbs.file_manager import FileManager
+from helpers import write_tree, random_tree, read_tree, run_backup, restore_latest
+
+
+def test_concurrent_uploads_upload_each_file_once(drive_config, drive, tmp_path):
+    tree = random_tree(directories=8, files=8, max_size=20000)
+    write_tree(drive_config.backup_path, tree)
+
+    run_backup(drive_config, jobs=8)
+
+    sessions = sum(1 for method, kind in drive.log if (method, kind) == ("POST", "upload"))
+    # On top of the files, the manifest, the shard index and a bundle of shards for each of the 3 directory depths
+    assert sessions == sum(1 for data in tree.values() if data) + 5
+    restore_latest(drive_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+
+
+def test_failed_uploads_close_their_files(local_config, monkeypatch):
+    write_tree(local_config.backup_path, random_tree())
+    opened = []
+
+    def recording_open(*args, **kwargs):
+        f = builtins.open(*args, **kwargs)
+        opened.append(f)
+        return f
+
+    upload_piece = FileManager.upload_piece
+
+    def failing_upload(self, stream, size, info, *args, **kwargs):
+        if "path" in info:
+            raise ConnectionError("Drive is down")
+        return upload_piece(self, stream, size, info, *args, **kwargs)
+
+    monkeypatch.setattr(sbs.file_manager, "open", recording_open, raising=False)
+    monkeypatch.setattr(FileManager, "upload_piece", failing_upload)
+
+    fm = run_backup(local_config, jobs=4)
+
+    uploads = [f for f in opened if "b" in f.mode and not f.name.endswith(".sqlite")]
+    assert uploads
+    assert all(f.closed for f in uploads)
+    # Failures are logged per file rather than aborting the backup, only empty files made it
+    assert all(not entry["pieces"] for entry in fm.list_backups()[0].get_files_list().values())
+    with open(os.path.join(local_config.log_dir, "latest")) as f:
+        assert "Drive is down" in f.read()
+
+
+def test_failed_uploads_keep_the_previous_version(local_config, monkeypatch, tmp_path):
+    tree = random_tree(seed=1)
+    write_tree(local_config.backup_path, tree)
+    run_backup(local_config)
+    changed = dict(tree, **{"d0/f0": b"changed"})
+    write_tree(local_config.backup_path, changed)
+    upload_piece = FileManager.upload_piece
+
+    def failing_upload(self, stream, size, info, *args, **kwargs):
+        if info.get("path") == "./d0/f0":
+            raise ConnectionError("Drive is down")
+        return upload_piece(self, stream, size, info, *args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(FileManager, "upload_piece", failing_upload)
+        run_backup(local_config)
+    restore_latest(local_config, tmp_path / "restore")
+    assert read_tree(tmp_path / "restore") == tree
+
+    # Not taken as unchanged since, so uploaded once Drive is back
+    run_backup(local_config)
+    restore_latest(local_config, tmp_path / "again")
+    assert read_tree(tmp_path / "again") == changed